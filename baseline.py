@@ -0,0 +1,287 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from parsers import align_categories, normalize_ids
+from registry import ID_COLUMN, REGISTRY
+from store import iter_batches
+
+# Kısmi toplamların anahtarı: tesisat × yıl × ay, pozitif ve pozitif olmayan tüketimler ayrı
+PARTIAL_KEYS = ['TN', 'Sozlesme_No', 'Yil', 'Ay', 'Pozitif']
+PARTIAL_COLUMNS = ['Toplam', 'Adet', 'Kare_Toplam', 'Min', 'Max']
+# Depodaki adı: kısmi toplamlar veri setinin tüm yıllarından üretilir, yıl seçimi okurken
+# Yil sütunuyla yapılır (eski, yıl filtreli tablolar bu adla okunmaz)
+PARTIALS_NAME = 'kismi'
+
+# Kantil taslağı: sabit, logaritmik aralıklı kovalar (DDSketch). Kova sınırları tüm
+# tesisat ve dosyalar için aynıdır; taslaklar kova adetleri toplanarak birleştirilir.
+# Her kova değerleri SKETCH_ACCURACY göreli hatayla temsil eder.
+SKETCH_ACCURACY = 0.01
+SKETCH_MIN, SKETCH_MAX = 1e-3, 1e9
+_SKETCH_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+# Tesisat başına en fazla bu kadar kova: bellek okuma sayısından bağımsızdır
+SKETCH_BUCKETS = int(np.ceil(np.log(SKETCH_MAX / SKETCH_MIN) / np.log(_SKETCH_GAMMA))) + 1
+SKETCH_KEYS = ['TN', 'Sozlesme_No', 'Yil', 'Ay', 'Kova']
+# Depodaki adı: taslaklar da tüm yıllardan üretilir, yıl seçimi Yil sütunuyla yapılır
+SKETCH_NAME = 'taslak'
+
+
+def partial_aggregates(df):
+    """Temizlenmiş satırlardan birleştirilebilir kısmi toplamlar üret
+
+    df: TN, Sozlesme_No, Tarih (datetime) ve Tuketim (sayı) sütunları.
+    Her (TN, Sozlesme_No, Yil, Ay, Pozitif) için toplam, adet, kareler toplamı, en
+    küçük ve en büyük değer tutulur; yıl/ay eklemek veya çıkarmak, sıfırları dahil
+    etmek ve adet kuralı bu tablolar birleştirilerek yapılır, ham satırlara dönülmez.
+    """
+    values = df['Tuketim'].astype('float64')
+    frame = pd.DataFrame({
+        'TN': df['TN'],
+        'Sozlesme_No': df['Sozlesme_No'],
+        'Yil': df['Tarih'].dt.year.astype('int16'),
+        'Ay': df['Tarih'].dt.month.astype('int8'),
+        'Pozitif': values > 0,
+        'Tuketim': values,
+        'Kare': values * values,
+    })
+    partials = frame.groupby(PARTIAL_KEYS, observed=True, sort=False).agg(
+        Toplam=('Tuketim', 'sum'),
+        Adet=('Tuketim', 'size'),
+        Kare_Toplam=('Kare', 'sum'),
+        Min=('Tuketim', 'min'),
+        Max=('Tuketim', 'max'),
+    ).reset_index()
+    partials['Adet'] = partials['Adet'].astype('int64')
+    return partials
+
+
+def partials_to_table(partials):
+    """Kısmi toplamları depoya yazılacak Arrow tablosuna çevir"""
+    return pa.Table.from_pandas(partials, preserve_index=False)
+
+
+def combine_baseline(partials, years=None, months=None, positive_only=True, min_count=1):
+    """Kısmi toplamları tesisat bazında birleştirip geçmiş ortalamayı hesapla
+
+    partials: partial_aggregates tablolarının listesi (yıl veya dosya başına bir tane).
+    years / months verilirse sadece o yıl ve aylar, positive_only ise sadece sıfırdan
+    büyük tüketimler dahil edilir. min_count altındaki tesisatlar çıkarılır.
+    Tüm tablolarda Tesisat_ID varsa gruplama bu tamsayı anahtarla yapılır.
+    Dönüş: TN, Sozlesme_No (veya Tesisat_ID), Ortalama_Tuketim, Adet, Standart_Sapma, Min, Max
+    """
+    frames = [p for p in partials if p is not None and not p.empty]
+    keys = [ID_COLUMN] if frames and all(ID_COLUMN in p.columns for p in frames) else ['TN', 'Sozlesme_No']
+    if not frames:
+        return pd.DataFrame(columns=keys + ['Ortalama_Tuketim', 'Adet', 'Standart_Sapma', 'Min', 'Max'])
+    if keys == [ID_COLUMN]:
+        # Kategorik ID'lerin birleştirilmesine gerek yok; sadece tamsayı anahtar taşınır
+        frames = [p.drop(columns=['TN', 'Sozlesme_No'], errors='ignore') for p in frames]
+    else:
+        frames = align_categories(frames)
+    combined = pd.concat(frames, ignore_index=True)
+
+    mask = np.ones(len(combined), dtype=bool)
+    if years:
+        mask &= combined['Yil'].isin(list(years)).to_numpy()
+    if months:
+        mask &= combined['Ay'].isin(list(months)).to_numpy()
+    if positive_only:
+        mask &= combined['Pozitif'].to_numpy(dtype=bool)
+
+    baseline = combined[mask].groupby(keys, observed=True).agg(
+        Toplam=('Toplam', 'sum'),
+        Adet=('Adet', 'sum'),
+        Kare_Toplam=('Kare_Toplam', 'sum'),
+        Min=('Min', 'min'),
+        Max=('Max', 'max'),
+    ).reset_index()
+    baseline = baseline[baseline['Adet'] >= max(min_count, 1)]
+
+    count = baseline['Adet'].to_numpy(dtype='float64')
+    mean = baseline['Toplam'].to_numpy() / count
+    # Örneklem varyansı: (Σx² - n·ortalama²) / (n - 1); tek kayıtlı tesisatlarda tanımsız
+    variance = (baseline['Kare_Toplam'].to_numpy() - count * mean * mean) / np.where(count > 1, count - 1, np.nan)
+    baseline['Ortalama_Tuketim'] = mean
+    baseline['Standart_Sapma'] = np.sqrt(np.clip(variance, 0, None))
+
+    return baseline[keys + ['Ortalama_Tuketim', 'Adet',
+                            'Standart_Sapma', 'Min', 'Max']].reset_index(drop=True)
+
+
+def seasonal_matrix(partials, years=None, positive_only=True, min_count=1):
+    """Ay bazında (mevsimsel) referans: [tesisat × 12] ortalama matrisi
+
+    partials: Tesisat_ID sütunlu kısmi toplam tabloları. Satır Tesisat_ID, sütun
+    takvim ayıdır (0 = Ocak); 12 ayın tamamı tek bir bincount geçişinde hesaplanır.
+    Kaydı min_count altında kalan hücreler NaN'dır. Her güncel satırın referansı
+    matrix[Tesisat_ID, ay] ile doğrudan okunur (seasonal_lookup).
+    """
+    frames = [p[[ID_COLUMN, 'Yil', 'Ay', 'Pozitif', 'Toplam', 'Adet']]
+              for p in partials if p is not None and not p.empty]
+    if not frames:
+        return np.full((0, 12), np.nan)
+    combined = pd.concat(frames, ignore_index=True)
+
+    mask = combined[ID_COLUMN].to_numpy() >= 0
+    if years:
+        mask &= combined['Yil'].isin(list(years)).to_numpy()
+    if positive_only:
+        mask &= combined['Pozitif'].to_numpy(dtype=bool)
+    combined = combined[mask]
+
+    ids = combined[ID_COLUMN].to_numpy(dtype='int64')
+    size = int(ids.max()) + 1 if len(ids) else 0
+    cells = ids * 12 + (combined['Ay'].to_numpy(dtype='int64') - 1)
+    totals = np.bincount(cells, weights=combined['Toplam'].to_numpy(dtype='float64'), minlength=size * 12)
+    counts = np.bincount(cells, weights=combined['Adet'].to_numpy(dtype='float64'), minlength=size * 12)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = totals / counts
+    means[counts < max(min_count, 1)] = np.nan
+    return means.reshape(size, 12)
+
+
+def seasonal_lookup(matrix, ids, periods):
+    """Her satırın kendi takvim ayı referansı; matriste olmayan tesisatlar NaN"""
+    ids = np.asarray(ids, dtype='int64')
+    months = np.asarray(periods, dtype='int64') % 12
+    inside = (ids >= 0) & (ids < len(matrix))
+    values = np.full(len(ids), np.nan)
+    values[inside] = matrix[ids[inside], months[inside]]
+    return values
+
+
+def stored_partials(store, key, variant, load_rows):
+    """Depodaki kısmi toplamları oku; yoksa load_rows() satırlarından bir kez üretip kaydet
+
+    Depo girdisi (anahtar, eşleştirme) başına tektir; load_rows yıl filtresi uygulamamalı,
+    yıllar sonuç tablosunun Yil sütunundan seçilir.
+    """
+    table = store.ensure_baseline(
+        key, f"{variant}.{PARTIALS_NAME}", lambda: partials_to_table(partial_aggregates(load_rows()))
+    )
+    return table.to_pandas()
+
+
+def sketch_buckets(values):
+    """Pozitif tüketimlerin kova numaraları; aralık dışı değerler uç kovalara sıkıştırılır"""
+    values = np.clip(np.asarray(values, dtype='float64'), SKETCH_MIN, SKETCH_MAX)
+    buckets = np.ceil(np.log(values / SKETCH_MIN) / np.log(_SKETCH_GAMMA))
+    return np.clip(buckets, 0, SKETCH_BUCKETS - 1).astype('int16')
+
+
+def bucket_values(buckets):
+    """Kovanın temsil değeri: (γ^(i-1), γ^i] aralığında göreli hatası en küçük nokta"""
+    buckets = np.asarray(buckets, dtype='float64')
+    return SKETCH_MIN * np.power(_SKETCH_GAMMA, buckets) * 2 / (_SKETCH_GAMMA + 1)
+
+
+def sketch_aggregates(df):
+    """Satırlardan tesisat × yıl × ay × kova adetleri (sadece pozitif tüketimler)
+
+    df: Tesisat_ID, Tarih ve Tuketim sütunları. Bir tesisatın taslağı en fazla
+    SKETCH_BUCKETS kova tutar; kaç okuması olursa olsun bellek sabittir.
+    """
+    values = df['Tuketim'].astype('float64')
+    positive = (values > 0).to_numpy() & (df[ID_COLUMN].to_numpy() >= 0)
+    frame = pd.DataFrame({
+        ID_COLUMN: df[ID_COLUMN].to_numpy()[positive],
+        'Yil': df['Tarih'].dt.year.to_numpy()[positive].astype('int16'),
+        'Ay': df['Tarih'].dt.month.to_numpy()[positive].astype('int8'),
+        'Kova': sketch_buckets(values.to_numpy()[positive]),
+    })
+    return frame.groupby(list(frame.columns), sort=False).size().rename('Adet').reset_index()
+
+
+def merge_sketches(sketches):
+    """Aynı anahtarlı taslakların kova adetlerini topla"""
+    frames = [s for s in sketches if s is not None and not s.empty]
+    if not frames:
+        return pd.DataFrame({
+            ID_COLUMN: pd.Series(dtype='int32'), 'Yil': pd.Series(dtype='int16'),
+            'Ay': pd.Series(dtype='int8'), 'Kova': pd.Series(dtype='int16'), 'Adet': pd.Series(dtype='int64'),
+        })
+    combined = pd.concat(frames, ignore_index=True)
+    return combined.groupby([ID_COLUMN, 'Yil', 'Ay', 'Kova'], sort=False)['Adet'].sum().reset_index()
+
+
+def stream_sketches(path, year=None):
+    """Veri setini (year verilirse sadece o yılı) parça parça okuyarak taslakları oluştur
+
+    Her parçanın taslağı eldeki taslakla birleştirilir; bellekte sadece bir parça ve
+    tesisat başına sabit boyutlu taslaklar bulunur, ham okumalar tutulmaz.
+    """
+    sketch = None
+    for batch in iter_batches(path, ['TN', 'Sozlesme_No', 'Tarih', 'Tuketim'],
+                              year=year, positive_only=True):
+        df = batch.to_pandas()
+        for col in ('TN', 'Sozlesme_No'):
+            df[col] = normalize_ids(df[col])
+        sketch = merge_sketches([sketch, sketch_aggregates(REGISTRY.attach(df))])
+    return merge_sketches([sketch])
+
+
+def stored_sketches(store, key, variant, path):
+    """Depodaki kantil taslaklarını oku (Tesisat_ID eklenmiş); yoksa bir kez üretip kaydet
+
+    Kısmi toplamlar gibi TN / Sözleşme No ile saklanır, okunurken numaralar kayıttan alınır.
+    Taslak veri setinin tüm yıllarını kapsar; yıllar Yil sütunundan seçilir.
+    """
+    def compute():
+        sketch = stream_sketches(path)
+        names = REGISTRY.names(sketch[ID_COLUMN])
+        return pa.Table.from_pandas(
+            pd.concat([names, sketch.drop(columns=[ID_COLUMN])], axis=1)[SKETCH_KEYS + ['Adet']],
+            preserve_index=False
+        )
+    table = store.ensure_baseline(key, f"{variant}.{SKETCH_NAME}", compute)
+    return REGISTRY.attach(table.to_pandas())
+
+
+def _sketch_quantiles(counts, keys, quantile):
+    """Anahtar başına birleşmiş kova adetlerinden kantil kovası ve toplam adet"""
+    counts = counts.sort_values(keys + ['Kova'], kind='stable')
+    groups = counts.groupby(keys, observed=True, sort=False)['Adet']
+    cumulative = groups.cumsum().to_numpy()
+    total = groups.transform('sum').to_numpy()
+    # Sıralı okumalarda floor(q·(n-1)). sıradaki değerin bulunduğu kova
+    rank = np.floor(quantile * (total - 1))
+    hit = (cumulative > rank) & (cumulative - counts['Adet'].to_numpy() <= rank)
+    result = counts.loc[hit, keys].reset_index(drop=True)
+    result['Ortalama_Tuketim'] = bucket_values(counts['Kova'].to_numpy()[hit])
+    result['Adet'] = total[hit]
+    return result
+
+
+def sketch_quantile(sketches, quantile=0.5, years=None, months=None, min_count=1):
+    """Tesisat başına yaklaşık kantil (0.5 = medyan) referansı
+
+    Birkaç hatalı sayaç okuması ortalamayı kaydırır, medyan / yüzdelik etkilenmez.
+    Değer SKETCH_ACCURACY göreli hatayla bulunur ve deviation_table ile doğrudan
+    kullanılabilmesi için Ortalama_Tuketim sütununda döner.
+    Dönüş: Tesisat_ID, Ortalama_Tuketim, Adet
+    """
+    combined = merge_sketches(sketches)
+    mask = np.ones(len(combined), dtype=bool)
+    if years:
+        mask &= combined['Yil'].isin(list(years)).to_numpy()
+    if months:
+        mask &= combined['Ay'].isin(list(months)).to_numpy()
+    counts = combined[mask].groupby([ID_COLUMN, 'Kova'], sort=False)['Adet'].sum().reset_index()
+    result = _sketch_quantiles(counts, [ID_COLUMN], quantile)
+    return result[result['Adet'] >= max(min_count, 1)].reset_index(drop=True)
+
+
+def seasonal_sketch_matrix(sketches, quantile=0.5, years=None, min_count=1):
+    """seasonal_matrix'in kantil karşılığı: [tesisat × 12] ay bazında yaklaşık kantiller"""
+    combined = merge_sketches(sketches)
+    if years:
+        combined = combined[combined['Yil'].isin(list(years))]
+    counts = combined.groupby([ID_COLUMN, 'Ay', 'Kova'], sort=False)['Adet'].sum().reset_index()
+    result = _sketch_quantiles(counts, [ID_COLUMN, 'Ay'], quantile)
+    result = result[result['Adet'] >= max(min_count, 1)]
+
+    ids = result[ID_COLUMN].to_numpy(dtype='int64')
+    matrix = np.full((int(ids.max()) + 1 if len(ids) else 0, 12), np.nan)
+    matrix[ids, result['Ay'].to_numpy(dtype='int64') - 1] = result['Ortalama_Tuketim'].to_numpy()
+    return matrix
@@ -0,0 +1,289 @@
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from parsers import normalize_ids, period_codes
+from registry import REGISTRY
+from store import STORE_DIR, read_table
+
+# Bellekte tutulacak toplam boyut (MB); SAPMA_CACHE_MB ile değiştirilebilir
+CACHE_BUDGET_MB = float(os.environ.get('SAPMA_CACHE_MB', 1024))
+# Bellekten çıkarılan girdilerin yazıldığı diskteki alanın sınırı (MB)
+SPILL_BUDGET_MB = float(os.environ.get('SAPMA_SPILL_MB', 8192))
+SPILL_DIR = os.path.join(STORE_DIR, 'spill')
+
+MB = 1024 * 1024
+
+# _share sığ kopyaları ancak copy-on-write ile güvenlidir; pandas 3'te hep açıktır,
+# daha eski sürümlerde açılmazsa uygulamadaki df[...] = ... atamaları önbelleği değiştirir
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
+
+def _share(value):
+    """Önbellekteki değeri kopyalamadan ver
+
+    Arrow tabloları değişmezdir. DataFrame'ler copy-on-write sığ kopya olarak verilir:
+    veri paylaşılır, alan tarafın sütun ekleme/değiştirmeleri önbelleğe yansımaz.
+    """
+    if isinstance(value, pd.DataFrame):
+        return value.copy(deep=False)
+    return value
+
+
+def entry_size(value):
+    """Girdinin bellekteki gerçek boyutu (byte)"""
+    if isinstance(value, pa.Table):
+        return value.nbytes
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return sys.getsizeof(value)
+
+
+class ByteLRUCache:
+    """Boyut bütçeli LRU önbellek; bütçe aşılınca en eski girdiler diske yazılır
+
+    Girdiler Arrow tabloları, DataFrame'ler veya NumPy dizileridir. Diske yazılan girdi
+    tekrar istendiğinde Arrow IPC (dizilerde .npy, memory map ile) dosyasından okunup
+    belleğe geri alınır. Bütçeden büyük girdiler hiç alınmaz, önbelleğe girmeden döner.
+    """
+
+    def __init__(self, budget_bytes=CACHE_BUDGET_MB * MB, spill_dir=SPILL_DIR,
+                 spill_budget_bytes=SPILL_BUDGET_MB * MB):
+        self.budget_bytes = int(budget_bytes)
+        # Diske yazılan girdilerin dizini süreç başınadır; dizin içeriği sadece bu süreçte anlamlıdır
+        self.spill_dir = os.path.join(spill_dir, str(os.getpid()))
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+        self.spill_budget_bytes = int(spill_budget_bytes)
+        self._entries = OrderedDict()  # anahtar -> (değer, boyut)
+        self._spilled = OrderedDict()  # anahtar -> (dosya yolu, tür, dosya boyutu)
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.counters = {'hits': 0, 'spill_hits': 0, 'misses': 0, 'evictions': 0, 'spilled': 0,
+                         'oversized': 0}
+
+    def _spill_path(self, key, suffix='.arrow'):
+        name = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()[:32]
+        return os.path.join(self.spill_dir, f"{name}{suffix}")
+
+    def _spill(self, key, value):
+        """Girdiyi diske yaz; disk bütçesi aşılırsa en eski dosyaları sil"""
+        if isinstance(value, pa.Table):
+            table, kind = value, 'table'
+        elif isinstance(value, pd.DataFrame):
+            table, kind = pa.Table.from_pandas(value), 'frame'
+        elif isinstance(value, np.ndarray) and value.dtype != object:
+            table, kind = None, 'array'
+        else:
+            return
+
+        os.makedirs(self.spill_dir, exist_ok=True)
+        if kind == 'array':
+            path = self._spill_path(key, '.npy')
+            np.save(path, value)
+        else:
+            path = self._spill_path(key)
+            feather.write_feather(table, path, compression='uncompressed')
+        self._spilled[key] = (path, kind, os.path.getsize(path))
+        self.counters['spilled'] += 1
+
+        spill_bytes = sum(size for _, _, size in self._spilled.values())
+        while spill_bytes > self.spill_budget_bytes and len(self._spilled) > 1:
+            _, (old_path, _, size) = self._spilled.popitem(last=False)
+            spill_bytes -= size
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+    def _load_spilled(self, key):
+        path, kind, _ = self._spilled.pop(key)
+        try:
+            if kind == 'array':
+                # Salt okunur memory map; dosya silinse de eşleme açık kaldıkça veri okunur
+                return np.load(path, mmap_mode='r')
+            table = feather.read_table(path)
+        except (OSError, ValueError, pa.ArrowInvalid):
+            return None
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return table.to_pandas() if kind == 'frame' else table
+
+    def _evict_to_budget(self):
+        while self._bytes > self.budget_bytes and self._entries:
+            key, (value, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.counters['evictions'] += 1
+            if size <= self.budget_bytes:
+                self._spill(key, value)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.counters['hits'] += 1
+                return _share(self._entries[key][0])
+            if key in self._spilled:
+                value = self._load_spilled(key)
+                if value is not None:
+                    self.counters['spill_hits'] += 1
+                    self._store(key, value)
+                    return _share(value)
+            self.counters['misses'] += 1
+            return default
+
+    def _store(self, key, value):
+        size = entry_size(value)
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[1]
+        if size > self.budget_bytes:
+            # Bütçeden büyük girdi alınsa hemen diske yazılır, her okumada geri yüklenip
+            # yine çıkarılırdı; önbelleğe girmeden döndürülür
+            self.counters['oversized'] += 1
+            return
+        self._entries[key] = (value, size)
+        self._bytes += size
+        self._evict_to_budget()
+
+    def put(self, key, value):
+        with self._lock:
+            self._spilled.pop(key, None)
+            self._store(key, value)
+        return _share(value)
+
+    def get_or_compute(self, key, compute):
+        """Önbellekte yoksa compute() ile üretip ekle"""
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, compute())
+        return value
+
+    def discard(self, predicate):
+        """predicate(anahtar) doğru olan girdileri bellekten ve diskten sil"""
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                self._bytes -= self._entries.pop(key)[1]
+            for key in [k for k in self._spilled if predicate(k)]:
+                path, _, _ = self._spilled.pop(key)
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def set_budget(self, budget_bytes):
+        with self._lock:
+            self.budget_bytes = int(budget_bytes)
+            self._evict_to_budget()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._spilled.clear()
+            self._bytes = 0
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.counters,
+                'entries': len(self._entries),
+                'spilled_entries': len(self._spilled),
+                'bytes': self._bytes,
+                'budget_bytes': self.budget_bytes,
+            }
+
+
+def format_cache_stats(stats):
+    """Önbellek sayaçlarını kısa bir özet metnine çevir"""
+    return (
+        f"🗄️ Önbellek: {stats['bytes'] / MB:,.0f}/{stats['budget_bytes'] / MB:,.0f} MB, "
+        f"{stats['entries']} girdi ({stats['spilled_entries']} diskte) · "
+        f"{stats['hits']} isabet, {stats['spill_hits']} diskten, {stats['misses']} ıska, "
+        f"{stats['evictions']} çıkarma, {stats['oversized']} bütçeden büyük"
+    )
+
+
+# Süreç genelinde paylaşılan önbellek: ayrıştırılmış yüklemeler ve özet tablolar
+DATA_CACHE = ByteLRUCache()
+
+
+def shared_frame(path, columns=None, year=None, months=None, positive_only=False, arrow_dtypes=False):
+    """Depodaki veri setini bir kez okuyup çözülmüş DataFrame olarak paylaş
+
+    Depo yolu içerik anahtarını ve sütun eşleştirmesini içerir; aynı yol ve filtrelerle
+    sonraki çağrılar Parquet'i yeniden çözmeden önbellekteki tabloyu kopyasız döndürür.
+    TN ve Sözleşme No kategorik olarak çözülür ve Tesisat_ID eklenir. arrow_dtypes ise diğer sütunlar
+    NumPy/nesne tiplerine çevrilmeden Arrow tipli (pd.ArrowDtype) kalır.
+    """
+    key = ('frame', path, tuple(columns or ()), year, tuple(months or ()), positive_only, arrow_dtypes)
+
+    def load():
+        table = read_table(path, columns, year=year, months=months, positive_only=positive_only)
+        df = table.to_pandas(types_mapper=pd.ArrowDtype if arrow_dtypes else None)
+        for col in ('TN', 'Sozlesme_No'):
+            if col in df.columns:
+                df[col] = normalize_ids(df[col])
+        # Yıllar arasında ortak, kalıcı tamsayı tesisat numarası
+        if 'TN' in df.columns and 'Sozlesme_No' in df.columns:
+            df = REGISTRY.attach(df)
+        return df
+    return DATA_CACHE.get_or_compute(key, load)
+
+
+def frame_bytes(df):
+    """DataFrame'in nesneler dahil gerçek bellek kullanımı (byte)"""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def dtype_memory_comparison(path, columns=None, year=None):
+    """Aynı veri setinin nesne tipli ve Arrow tipli bellek kullanımını karşılaştır
+
+    object: TN / Sözleşme No Python metinleri, ay etiketi satır başına '%Y-%m' metni
+    (önceki yol). arrow: kategorik ID'ler, Arrow tipli sayı/tarih ve int32 dönem kodu.
+    """
+    table = read_table(path, columns, year=year)
+
+    object_df = table.to_pandas()
+    for col in ('TN', 'Sozlesme_No'):
+        if col in object_df.columns:
+            object_df[col] = object_df[col].astype(object)
+    object_df['Ay_Adi'] = object_df['Tarih'].dt.strftime('%Y-%m').astype(object)
+
+    arrow_df = table.to_pandas(types_mapper=pd.ArrowDtype)
+    for col in ('TN', 'Sozlesme_No'):
+        if col in arrow_df.columns:
+            arrow_df[col] = normalize_ids(arrow_df[col])
+    arrow_df['Ay_Kodu'] = period_codes(arrow_df['Tarih'])
+
+    return {'rows': table.num_rows, 'object': frame_bytes(object_df), 'arrow': frame_bytes(arrow_df)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Depodaki veri setinin bellek karşılaştırması")
+    parser.add_argument('paths', nargs='+', help="Depo yolları (.parquet, .arrow veya .parts)")
+    parser.add_argument('--year', type=int, help="Sadece bu yılın satırları")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        result = dtype_memory_comparison(path, year=args.year)
+        print(f"{path}: {result['rows']:,} satır  nesne tipli {result['object'] / MB:,.1f} MB  "
+              f"Arrow tipli {result['arrow'] / MB:,.1f} MB  "
+              f"({result['object'] / max(result['arrow'], 1):.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,10 @@ import numpy as np
 from io import BytesIO
 import xlsxwriter
 
+from cache import DATA_CACHE, format_cache_stats
+from ingest import SUPPORTED_TYPES, parse_uploaded, preview, project
+from parsers import align_categories, clean_rows, format_drop_stats, format_number_stats
+
 def main():
     st.title("🔥 Doğalgaz Tüketim Karşılaştırma Uygulaması")
     st.markdown("2024 ve 2025 yaz ayları doğalgaz tüketimlerini karşılaştırın")
@@ -14,22 +18,23 @@ def main():
     # 2024 dosyası yükleme
     file_2024 = st.sidebar.file_uploader(
         "2024 Yaz Ayları Tüketimi", 
-        type=['xlsx', 'xls'],
+        type=SUPPORTED_TYPES,
         key="file_2024"
     )
     
     # 2025 dosyası yükleme
     file_2025 = st.sidebar.file_uploader(
         "2025 Yaz Ayları Tüketimi", 
-        type=['xlsx', 'xls'],
+        type=SUPPORTED_TYPES,
         key="file_2025"
     )
     
     if file_2024 is not None and file_2025 is not None:
         try:
-            # Excel dosyalarını okuma
-            df_2024 = pd.read_excel(file_2024)
-            df_2025 = pd.read_excel(file_2025)
+            # Yüklenen dosyalar içerik anahtarına göre bir kez ayrıştırılır (Excel, CSV, Parquet, Feather);
+            # sıralama veya sütun seçimi değişince önbellekteki tablo kullanılır
+            table_2024 = parse_uploaded(file_2024)
+            table_2025 = parse_uploaded(file_2025)
             
             st.success("✅ Dosyalar başarıyla yüklendi!")
             
@@ -38,13 +43,13 @@ def main():
             
             with col1:
                 st.subheader("2024 Verisi Önizleme")
-                st.dataframe(df_2024.head(), use_container_width=True)
-                st.info(f"Toplam satır sayısı: {len(df_2024)}")
+                st.dataframe(preview(table_2024), use_container_width=True)
+                st.info(f"Toplam satır sayısı: {table_2024.num_rows}")
             
             with col2:
                 st.subheader("2025 Verisi Önizleme")
-                st.dataframe(df_2025.head(), use_container_width=True)
-                st.info(f"Toplam satır sayısı: {len(df_2025)}")
+                st.dataframe(preview(table_2025), use_container_width=True)
+                st.info(f"Toplam satır sayısı: {table_2025.num_rows}")
             
             # Sütun seçimi
             st.header("🔧 Sütun Eşleştirmesi")
@@ -53,19 +58,21 @@ def main():
             with col1:
                 tesisat_col = st.selectbox(
                     "Tesisat/ID Sütunu Seçin:",
-                    options=df_2024.columns.tolist(),
+                    options=table_2024.column_names,
                     help="Tesisatları tanımlayan benzersiz sütunu seçin"
                 )
                 
             with col2:
                 tuketim_col = st.selectbox(
                     "Tüketim Sütunu Seçin:",
-                    options=df_2024.columns.tolist(),
+                    options=table_2024.column_names,
                     help="Doğalgaz tüketim miktarını içeren sütunu seçin"
                 )
             
             if st.button("📊 Karşılaştırmayı Başlat", type="primary"):
-                # Veri temizleme ve hazırlama
+                # Veri temizleme ve hazırlama (sadece seçilen sütunlar DataFrame'e çevrilir)
+                df_2024 = project(table_2024, [tesisat_col, tuketim_col])
+                df_2025 = project(table_2025, [tesisat_col, tuketim_col])
                 df_2024_clean = prepare_data(df_2024, tesisat_col, tuketim_col, "2024")
                 df_2025_clean = prepare_data(df_2025, tesisat_col, tuketim_col, "2025")
                 
@@ -148,7 +155,7 @@ def main():
                         top_10 = increased_consumption.head(10)
                         
                         chart_data = pd.DataFrame({
-                            'Tesisat': top_10['Tesisat'],
+                            'Tesisat': top_10['Tesisat'].astype(str),
                             '2024': top_10['Tüketim_2024'],
                             '2025': top_10['Tüketim_2025']
                         })
@@ -187,19 +194,15 @@ def prepare_data(df, tesisat_col, tuketim_col, year):
         cleaned_df = df[[tesisat_col, tuketim_col]].copy()
         cleaned_df.columns = ['Tesisat', f'Tuketim_{year}']
         
-        # Null değerleri temizle
-        cleaned_df = cleaned_df.dropna()
-        
-        # Tüketim değerlerini sayısal hale getir
-        cleaned_df[f'Tuketim_{year}'] = pd.to_numeric(
-            cleaned_df[f'Tuketim_{year}'], errors='coerce'
+        # Tek geçişli temizlik: boş değerler ve tüketim çevirme tek maskede; tesisat adları
+        # kategorik olur (ad olduğu için harfler korunur)
+        number_stats, drop_stats = {}, {}
+        cleaned_df = clean_rows(
+            cleaned_df, id_columns=['Tesisat'], number_column=f'Tuketim_{year}', date_column=None,
+            allow_negative=True, upper=False, number_stats=number_stats, drop_stats=drop_stats
         )
-        
-        # NaN olan satırları kaldır
-        cleaned_df = cleaned_df.dropna()
-        
-        # Tesisat adlarındaki boşlukları temizle
-        cleaned_df['Tesisat'] = cleaned_df['Tesisat'].astype(str).str.strip()
+        st.caption(f"{year} — {format_number_stats(number_stats)}")
+        st.caption(f"{year} — {format_drop_stats(drop_stats)}")
         
         return cleaned_df
         
@@ -211,6 +214,8 @@ def compare_consumption(df_2024, df_2025):
     """2024 ve 2025 tüketimlerini karşılaştır"""
     try:
         # Verileri birleştir
+        # Ortak kategoriler: eşleştirme kategorik kodlarla yapılır
+        df_2024, df_2025 = align_categories([df_2024, df_2025], columns=['Tesisat'])
         merged_df = pd.merge(df_2024, df_2025, on='Tesisat', how='inner')
         
         if merged_df.empty:
@@ -309,3 +314,4 @@ if __name__ == "__main__":
     )
     
     main()
+    st.sidebar.caption(format_cache_stats(DATA_CACHE.stats()))
@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+
+from baseline import seasonal_lookup
+from parsers import align_categories, format_periods
+from registry import ID_COLUMN, REGISTRY
+
+KEY_COLUMNS = ['TN', 'Sozlesme_No']
+DEVIATION_COLUMNS = [
+    'TN', 'Sozlesme_No', 'Ay', 'Tarih',
+    'Geçmiş_Ortalama', 'Güncel_Tuketim', 'Sapma_Miktarı', 'Sapma_Yüzdesi'
+]
+
+
+def deviation_table(historical_avg, current, positive_only=True, label_months=True, extra_columns=()):
+    """Güncel kayıtları geçmiş ortalamalarla anahtarlı birleştirip sapmaları hesapla
+
+    historical_avg: TN, Sozlesme_No (veya Tesisat_ID), Ortalama_Tuketim (tesisat başına
+    bir satır; tekrar eden anahtarlarda ilk satır kullanılır). current: aynı anahtar,
+    Tuketim, Tarih ve Ay_Kodu (period_codes). Satır başına tarama yerine tek bir hash
+    birleştirmesi yapılır, süre satır sayısıyla doğrusal artar. Sonuç güncel verinin satır
+    sırasını korur. İki tabloda da Tesisat_ID varsa birleştirme bu tamsayı anahtarla
+    yapılır ve TN / Sözleşme No sadece sonuç satırları için kayıttan alınır.
+    positive_only ise ortalaması sıfırdan büyük olmayan tesisatlar atlanır (sıfıra bölme yok).
+    Dönüş: DEVIATION_COLUMNS (+ extra_columns); label_months ise Ay 'YYYY-MM' metni,
+    değilse dönem kodu.
+    """
+    if ID_COLUMN in current.columns and ID_COLUMN in historical_avg.columns:
+        keys = [ID_COLUMN]
+    else:
+        keys = KEY_COLUMNS
+        current, historical_avg = align_categories([current, historical_avg])
+    averages = historical_avg[keys + ['Ortalama_Tuketim']].drop_duplicates(keys)
+    if positive_only:
+        averages = averages[averages['Ortalama_Tuketim'] > 0]
+
+    # İç birleştirme sol tablonun sırasını korur
+    merged = current[keys + ['Ay_Kodu', 'Tarih', 'Tuketim'] + list(extra_columns)].merge(
+        averages, on=keys, how='inner', sort=False
+    )
+    if merged.empty:
+        return pd.DataFrame()
+    return _result_frame(merged, keys, label_months, extra_columns)
+
+
+def seasonal_deviation_table(matrix, current, positive_only=True, label_months=True, extra_columns=()):
+    """Her güncel satırı kendi takvim ayının geçmiş ortalamasıyla karşılaştır
+
+    matrix: seasonal_matrix çıktısı ([Tesisat_ID × 12]). Referans birleştirme yapılmadan
+    matrix[Tesisat_ID, ay] dizi indekslemesiyle okunur; Temmuz okuması geçmiş Temmuzlarla
+    karşılaştırılır. Referansı olmayan (NaN) hücreler ve positive_only ise sıfırdan büyük
+    olmayan referanslar atlanır. Dönüş deviation_table ile aynıdır.
+    """
+    columns = [ID_COLUMN, 'Ay_Kodu', 'Tarih', 'Tuketim'] + list(extra_columns)
+    rows = current[columns]
+    averages = seasonal_lookup(matrix, rows[ID_COLUMN], rows['Ay_Kodu'])
+    keep = ~np.isnan(averages)
+    if positive_only:
+        keep &= averages > 0
+    if not keep.any():
+        return pd.DataFrame()
+
+    merged = rows[keep].reset_index(drop=True)
+    merged['Ortalama_Tuketim'] = averages[keep]
+    return _result_frame(merged, [ID_COLUMN], label_months, extra_columns)
+
+
+def _result_frame(merged, keys, label_months, extra_columns):
+    """Eşleşmiş satırlardan (Ortalama_Tuketim sütunlu) sapma tablosunu üret"""
+    names = REGISTRY.names(merged[ID_COLUMN]) if keys == [ID_COLUMN] else merged
+    deviation = merged['Tuketim'] - merged['Ortalama_Tuketim']
+    result = pd.DataFrame({
+        'TN': names['TN'],
+        'Sozlesme_No': names['Sozlesme_No'],
+        'Ay': format_periods(merged['Ay_Kodu']) if label_months else merged['Ay_Kodu'],
+        'Tarih': merged['Tarih'],
+        'Geçmiş_Ortalama': merged['Ortalama_Tuketim'],
+        'Güncel_Tuketim': merged['Tuketim'],
+        'Sapma_Miktarı': deviation,
+        'Sapma_Yüzdesi': deviation / merged['Ortalama_Tuketim'] * 100,
+    }, columns=DEVIATION_COLUMNS)
+    for name in extra_columns:
+        result[name] = merged[name]
+    return result
+
+
+class DeviationIndex:
+    """Sapma_Yüzdesi'ne göre azalan sıralı sapma tablosu; eşik kesimi ikili arama ile
+
+    Sıralama analizden sonra bir kez yapılır. Eşik değişince sadece kesim noktası
+    searchsorted ile bulunur; eşik üstü satırlar sıralı tablonun baştaki dilimidir.
+    Sapma yüzdesi eksik (NaN) satırlar sonda kalır ve hiçbir eşiği geçmez.
+    """
+
+    def __init__(self, results):
+        if 'Sapma_Yüzdesi' not in results.columns:
+            # Eşleşme olmayan analizler sütunsuz boş tablo döndürür
+            results = pd.DataFrame(columns=DEVIATION_COLUMNS)
+        values = results['Sapma_Yüzdesi'].to_numpy(dtype='float64', na_value=np.nan)
+        order = np.argsort(-values, kind='stable')
+        self.frame = results.iloc[order].reset_index(drop=True)
+        # Artan sıralı anahtar: -sapma; eşik t için kesim -t'nin sağı
+        self._keys = -values[order]
+
+    def __len__(self):
+        return len(self.frame)
+
+    def count_at_least(self, threshold):
+        """Sapma yüzdesi eşik veya üstü olan satır sayısı"""
+        return int(np.searchsorted(self._keys, -threshold, side='right'))
+
+    def at_least(self, threshold, limit=None):
+        """Eşik veya üstü satırlar, en yüksek sapma önce (limit verilirse ilk limit satır)"""
+        count = self.count_at_least(threshold)
+        return self.frame.iloc[:count if limit is None else min(count, limit)]
+
+    def max(self):
+        """En yüksek sapma yüzdesi (boş tabloda NaN)"""
+        return -self._keys[0] if len(self._keys) else np.nan
@@ -0,0 +1,991 @@
+import argparse
+import gc
+import multiprocessing
+import os
+import posixpath
+import re
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from io import BytesIO
+from itertools import islice
+from xml.etree.ElementTree import iterparse
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from openpyxl import load_workbook
+
+try:
+    # Derlenmiş (Rust) Excel okuyucu; kuruluysa otomatik seçilir, .xls dosyalarını da okur
+    import python_calamine
+except ImportError:
+    python_calamine = None
+
+from cache import DATA_CACHE
+from parsers import clean_rows
+from store import file_sha256, group_key
+
+# Akışlı okumada bir seferde tipli kolonlara çevrilen satır sayısı.
+# Tepe bellek dosya boyutuna değil bu değere bağlıdır.
+CHUNK_SIZE = 50_000
+
+# Yüklemede kabul edilen uzantılar (csv.gz dosyaları 'gz' uzantısıyla gelir)
+SUPPORTED_TYPES = ['xlsx', 'xls', 'csv', 'gz', 'parquet', 'feather', 'arrow']
+
+# Çok thread'li CSV okuyucunun her thread'e verdiği blok boyutu
+CSV_BLOCK_SIZE = 8 * 1024 * 1024
+
+# Tercih sırasıyla Excel okuyucuları; ilk kurulu olan kullanılır
+EXCEL_ENGINES = ('calamine', 'openpyxl')
+
+STANDARD_COLUMNS = ['TN', 'Tuketim', 'Tarih', 'Sozlesme_No']
+
+STANDARD_SCHEMA = pa.schema([
+    ('TN', pa.string()),
+    ('Tuketim', pa.float64()),
+    ('Tarih', pa.timestamp('ns')),
+    ('Sozlesme_No', pa.string()),
+])
+
+
+def _header_names(header_row):
+    """Başlık satırını pandas'ın read_excel ile ürettiği isimlere çevir"""
+    return [
+        name if name is not None else f"Unnamed: {i}"
+        for i, name in enumerate(header_row)
+    ]
+
+
+def _column_index(header, col):
+    """Seçilen sütunun başlık satırındaki yerini bul"""
+    if col in header:
+        return header.index(col)
+    as_text = [str(name) for name in header]
+    if str(col) in as_text:
+        return as_text.index(str(col))
+    raise KeyError(f"'{col}' sütunu dosyada bulunamadı")
+
+
+def available_engines():
+    """Bu ortamda kullanılabilen Excel okuyucuları, tercih sırasıyla"""
+    return [engine for engine in EXCEL_ENGINES if engine != 'calamine' or python_calamine is not None]
+
+
+def excel_engine(engine=None):
+    """İstenen okuyucu kurulu değilse openpyxl'e geri düş"""
+    if engine in available_engines():
+        return engine
+    return available_engines()[0]
+
+
+def _is_xls(file_obj):
+    return str(getattr(file_obj, 'name', '')).lower().endswith('.xls')
+
+
+def stream_engine(file_obj):
+    """Akışlı (düşük bellekli) okumanın okuyucusu
+
+    calamine iter_rows()'tan önce sayfanın tamamını belleğe aldığı için xlsx dosyaları
+    openpyxl read-only ile okunur; tepe bellek parça boyutuna bağlı kalır. Akışla
+    okunamayan .xls dosyalarında tercih edilen okuyucu kullanılır.
+    """
+    return excel_engine() if _is_xls(file_obj) else 'openpyxl'
+
+
+def read_excel(file_obj, engine=None, **kwargs):
+    """pd.read_excel'i seçilen okuyucu ile çağır
+
+    calamine yoksa xlsx için openpyxl, xls için pandas'ın varsayılan okuyucusu kullanılır.
+    """
+    engine = excel_engine(engine)
+    if engine == 'openpyxl' and _is_xls(file_obj):
+        engine = None
+    file_obj.seek(0)
+    try:
+        return pd.read_excel(file_obj, engine=engine, **kwargs)
+    except ImportError:
+        if engine is None:
+            raise
+        file_obj.seek(0)
+        return pd.read_excel(file_obj, **kwargs)
+
+
+def _iter_calamine_rows(file_obj, sheet_name=None):
+    workbook = python_calamine.CalamineWorkbook.from_filelike(file_obj)
+    sheet = workbook.get_sheet_by_name(sheet_name) if sheet_name else workbook.get_sheet_by_index(0)
+    for row in sheet.iter_rows():
+        # calamine boş hücreleri '' döndürür; openpyxl ile aynı olsun diye None yapılır
+        yield tuple(None if value == '' else value for value in row)
+
+
+def iter_sheet_rows(file_obj, sheet_name=None, engine=None):
+    """Çalışma sayfasını satır satır oku (ilk satır başlık)
+
+    calamine kuruluysa onunla, değilse openpyxl read-only modda okunur. openpyxl'in
+    açamadığı .xls dosyaları pandas ile tek seferde okunup satır satır verilir. Akışlı
+    yollar engine=stream_engine(file_obj) verir.
+    """
+    file_obj.seek(0)
+    if excel_engine(engine) == 'calamine':
+        yield from _iter_calamine_rows(file_obj, sheet_name)
+        return
+    if _is_xls(file_obj):
+        sheet = read_excel(file_obj, engine=engine, sheet_name=sheet_name or 0, header=None)
+        for row in sheet.astype(object).where(sheet.notna(), None).itertuples(index=False, name=None):
+            yield row
+        return
+
+    workbook = load_workbook(file_obj, read_only=True, data_only=True)
+    try:
+        sheet = workbook[sheet_name] if sheet_name else workbook.worksheets[0]
+        for row in sheet.iter_rows(values_only=True):
+            yield row
+    finally:
+        workbook.close()
+
+
+# Excel'in yerleşik tarih/saat numara formatları
+BUILTIN_DATE_FORMATS = set(range(14, 23)) | {45, 46, 47}
+_DATE_CODE = re.compile(r'[dmyhs]', re.IGNORECASE)
+_QUOTED = re.compile(r'"[^"]*"|\\.|\[[^\]]*\]')
+
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _column_number(ref):
+    """'AB12' hücre referansından 0 tabanlı sütun numarası"""
+    number = 0
+    for ch in ref:
+        if not ch.isalpha():
+            break
+        number = number * 26 + (ord(ch.upper()) - 64)
+    return number - 1
+
+
+def _first_sheet_path(archive):
+    """workbook.xml içindeki ilk çalışma sayfasının zip içi yolunu bul"""
+    try:
+        with archive.open('xl/workbook.xml') as f:
+            rel_id = next(
+                elem.get('{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id')
+                for _, elem in iterparse(f) if _local(elem.tag) == 'sheet'
+            )
+        with archive.open('xl/_rels/workbook.xml.rels') as f:
+            target = next(
+                elem.get('Target') for _, elem in iterparse(f)
+                if _local(elem.tag) == 'Relationship' and elem.get('Id') == rel_id
+            )
+        if target.startswith('/'):
+            return target.lstrip('/')
+        return posixpath.normpath(posixpath.join('xl', target))
+    except (KeyError, StopIteration):
+        return 'xl/worksheets/sheet1.xml'
+
+
+def _date_styles(archive):
+    """Tarih formatı taşıyan hücre stili (cellXfs) numaraları"""
+    try:
+        with archive.open('xl/styles.xml') as f:
+            custom_dates = set()
+            styles = []
+            in_cell_xfs = False
+            for event, elem in iterparse(f, events=('start', 'end')):
+                tag = _local(elem.tag)
+                if event == 'start':
+                    if tag == 'cellXfs':
+                        in_cell_xfs = True
+                    continue
+                if tag == 'numFmt':
+                    code = _QUOTED.sub('', elem.get('formatCode', ''))
+                    if _DATE_CODE.search(code):
+                        custom_dates.add(int(elem.get('numFmtId')))
+                elif tag == 'xf' and in_cell_xfs:
+                    styles.append(int(elem.get('numFmtId', 0)))
+                elif tag == 'cellXfs':
+                    break
+        date_formats = BUILTIN_DATE_FORMATS | custom_dates
+        return {i for i, fmt in enumerate(styles) if fmt in date_formats}
+    except KeyError:
+        return set()
+
+
+def _shared_strings(archive, needed):
+    """Sadece gereken indekslere kadar paylaşılan metinleri oku"""
+    if not needed:
+        return {}
+    last = max(needed)
+    strings = {}
+    try:
+        with archive.open('xl/sharedStrings.xml') as f:
+            index = 0
+            for _, elem in iterparse(f):
+                if _local(elem.tag) != 'si':
+                    continue
+                if index in needed:
+                    strings[index] = ''.join(
+                        t.text or '' for t in elem.iter() if _local(t.tag) == 't'
+                    )
+                if index >= last:
+                    break
+                index += 1
+                elem.clear()
+    except KeyError:
+        pass
+    return strings
+
+
+def _mangle_duplicates(names):
+    """pandas gibi tekrar eden başlıklara .1, .2 ekle"""
+    seen = {}
+    result = []
+    for name in names:
+        if name in seen:
+            seen[name] += 1
+            result.append(f"{name}.{seen[name]}")
+        else:
+            seen[name] = 0
+            result.append(name)
+    return result
+
+
+def sniff_header(file_obj, sample_rows=1):
+    """xlsx zip akışından sadece başlık ve ilk satır(lar)ı okuyup sütun adı ve tipini çıkar
+
+    Dönüş: (sütun listesi, {sütun: 'metin' | 'sayı' | 'tarih' | 'mantıksal' | 'boş'})
+    """
+    file_obj.seek(0)
+    with zipfile.ZipFile(file_obj) as archive:
+        sheet_path = _first_sheet_path(archive)
+        rows = []
+        with archive.open(sheet_path) as f:
+            for _, elem in iterparse(f):
+                if _local(elem.tag) != 'row':
+                    continue
+                cells = {}
+                for position, cell in enumerate(c for c in elem if _local(c.tag) == 'c'):
+                    ref = cell.get('r')
+                    col = _column_number(ref) if ref else position
+                    value = None
+                    inline = None
+                    for child in cell:
+                        if _local(child.tag) == 'v':
+                            value = child.text
+                        elif _local(child.tag) == 'is':
+                            inline = ''.join(t.text or '' for t in child.iter() if _local(t.tag) == 't')
+                    cells[col] = (cell.get('t', 'n'), cell.get('s'), value, inline)
+                rows.append(cells)
+                elem.clear()
+                if len(rows) > sample_rows:
+                    break
+
+        needed = {
+            int(value) for cells in rows for kind, _, value, _ in cells.values()
+            if kind == 's' and value is not None
+        }
+        strings = _shared_strings(archive, needed)
+        date_styles = _date_styles(archive)
+
+    file_obj.seek(0)
+    header_cells = rows[0] if rows else {}
+    width = max((max(cells) + 1 for cells in rows if cells), default=0)
+
+    def text_of(kind, value, inline):
+        if kind == 's' and value is not None:
+            return strings.get(int(value))
+        if kind == 'inlineStr':
+            return inline
+        return value
+
+    names = []
+    for col in range(width):
+        if col in header_cells:
+            kind, _, value, inline = header_cells[col]
+            name = text_of(kind, value, inline)
+            if kind == 'n' and name is not None:
+                number = float(name)
+                name = int(number) if number.is_integer() else number
+        else:
+            name = None
+        names.append(name if name not in (None, '') else f"Unnamed: {col}")
+    names = _mangle_duplicates(names)
+
+    types = {}
+    for col, name in enumerate(names):
+        kinds = []
+        for cells in rows[1:]:
+            if col not in cells or (cells[col][2] is None and cells[col][3] is None):
+                continue
+            kind, style, _, _ = cells[col]
+            if kind in ('s', 'str', 'inlineStr'):
+                kinds.append('metin')
+            elif kind == 'b':
+                kinds.append('mantıksal')
+            elif kind == 'd' or (style is not None and int(style) in date_styles):
+                kinds.append('tarih')
+            else:
+                kinds.append('sayı')
+        types[name] = kinds[0] if kinds and len(set(kinds)) == 1 else ('metin' if kinds else 'boş')
+    return names, types
+
+
+def file_format(file_obj):
+    """Dosya adından biçimi çıkar: 'excel', 'csv', 'csv.gz', 'parquet' veya 'feather'"""
+    name = str(getattr(file_obj, 'name', '')).lower()
+    if name.endswith('.gz'):
+        return 'csv.gz'
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.parquet', '.pq')):
+        return 'parquet'
+    if name.endswith(('.feather', '.arrow')):
+        return 'feather'
+    return 'excel'
+
+
+def _file_buffer(file_obj):
+    """Yüklenen dosyayı kopyalamadan Arrow buffer'ı olarak sar
+
+    Diskteki dosyayı temsil eden nesneler (path özniteliği, ör. watch.StoredFile)
+    memory map ile açılır.
+    """
+    path = getattr(file_obj, 'path', None)
+    if path is not None:
+        with pa.memory_map(path) as source:
+            return source.read_buffer()
+    if hasattr(file_obj, 'getvalue'):
+        data = file_obj.getvalue()
+    else:
+        file_obj.seek(0)
+        data = file_obj.read()
+        file_obj.seek(0)
+    return pa.py_buffer(data)
+
+
+def _csv_stream(buffer, fmt):
+    stream = pa.BufferReader(buffer)
+    if fmt == 'csv.gz':
+        stream = pa.CompressedInputStream(stream, 'gzip')
+    return stream
+
+
+def _csv_options(buffer, fmt):
+    """İlk satırdan ayracı tahmin et; ';' ayraçlı dosyalarda ondalık ayırıcı virgüldür"""
+    first_line = _csv_stream(buffer, fmt).read(64 * 1024).split(b'\n', 1)[0]
+    delimiter = max(',;\t|', key=lambda d: first_line.count(d.encode()))
+    read_options = pacsv.ReadOptions(use_threads=True, block_size=CSV_BLOCK_SIZE)
+    parse_options = pacsv.ParseOptions(delimiter=delimiter)
+    decimal_point = ',' if delimiter == ';' else '.'
+    return read_options, parse_options, decimal_point
+
+
+def read_native_table(file_obj, columns=None, string_columns=(), float_columns=()):
+    """CSV / CSV.gz çok thread'li Arrow okuyucu ile, Parquet / Feather kopyasız okunur"""
+    fmt = file_format(file_obj)
+    buffer = _file_buffer(file_obj)
+
+    if fmt == 'parquet':
+        return pq.read_table(pa.BufferReader(buffer), columns=columns)
+    if fmt == 'feather':
+        return feather.read_table(pa.BufferReader(buffer), columns=columns, memory_map=False)
+
+    read_options, parse_options, decimal_point = _csv_options(buffer, fmt)
+    column_types = {name: pa.string() for name in string_columns}
+    column_types.update({name: pa.float64() for name in float_columns})
+
+    def read(types):
+        convert_options = pacsv.ConvertOptions(
+            column_types=types,
+            include_columns=columns or [],
+            decimal_point=decimal_point,
+        )
+        return pacsv.read_csv(
+            _csv_stream(buffer, fmt), read_options=read_options,
+            parse_options=parse_options, convert_options=convert_options
+        )
+
+    try:
+        return read(column_types)
+    except pa.ArrowInvalid:
+        # Sayıya çevrilemeyen tüketim değerleri metin olarak okunur, temizlikte çevrilir
+        return read({name: pa.string() for name in column_types})
+
+
+def _arrow_type_label(arrow_type):
+    if pa.types.is_timestamp(arrow_type) or pa.types.is_date(arrow_type):
+        return 'tarih'
+    if pa.types.is_boolean(arrow_type):
+        return 'mantıksal'
+    if pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type):
+        return 'sayı'
+    if pa.types.is_null(arrow_type):
+        return 'boş'
+    return 'metin'
+
+
+def native_schema(file_obj):
+    """Yerel biçimli dosyanın şemasını veriyi okumadan çıkar"""
+    fmt = file_format(file_obj)
+    buffer = _file_buffer(file_obj)
+    if fmt == 'parquet':
+        return pq.read_schema(pa.BufferReader(buffer))
+    if fmt == 'feather':
+        return pa.ipc.open_file(pa.BufferReader(buffer)).schema
+    read_options, parse_options, _ = _csv_options(buffer, fmt)
+    reader = pacsv.open_csv(_csv_stream(buffer, fmt), read_options=read_options, parse_options=parse_options)
+    return reader.schema
+
+
+# Streamlit yükleme kimliği -> içerik anahtarı; aynı yükleme her çalıştırmada yeniden hash'lenmez
+_upload_keys = {}
+
+
+def upload_key(file_obj):
+    """Yüklenen dosyanın içerik anahtarı (SHA-256)"""
+    # Depodan seçilen veri setleri anahtarlarını taşır, tekrar hash'lenmez
+    content_key = getattr(file_obj, 'content_key', None)
+    if content_key is not None:
+        return content_key
+    file_id = getattr(file_obj, 'file_id', None)
+    if file_id is not None and file_id in _upload_keys:
+        return _upload_keys[file_id]
+    key = file_sha256(file_obj)
+    if file_id is not None:
+        _upload_keys[file_id] = key
+    return key
+
+
+def upload_group_key(file_objs):
+    """Birlikte yüklenen dosyaların (tüm sayfalarıyla) ortak içerik anahtarı"""
+    return group_key([upload_key(file_obj) for file_obj in file_objs])
+
+
+def _frame_to_table(df):
+    """read_excel çıktısını Arrow tablosuna çevir; karışık tipli sütunlar metin olarak saklanır"""
+    columns = {}
+    for name in df.columns:
+        column = df[name]
+        try:
+            columns[str(name)] = pa.array(column, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            columns[str(name)] = pa.array(
+                column.map(lambda v: None if pd.isna(v) else str(v)), type=pa.string()
+            )
+    return pa.table(columns)
+
+
+def parse_table(file_obj):
+    """Dosyanın tamamını Arrow tablosu olarak ayrıştır"""
+    if file_format(file_obj) == 'excel':
+        return _frame_to_table(read_excel(file_obj))
+    return read_native_table(file_obj)
+
+
+def _widened_type(current, new):
+    """İki parçada farklı çıkan sütun tipini ikisini de taşıyabilen tipe genişlet"""
+    if pa.types.is_null(current):
+        return new
+    if pa.types.is_null(new):
+        return current
+    numeric = (pa.types.is_integer, pa.types.is_floating, pa.types.is_boolean)
+    if any(check(current) for check in numeric) and any(check(new) for check in numeric):
+        return pa.float64()
+    return pa.string()
+
+
+def _raw_chunk_table(rows, header, columns, types):
+    """Ham satır parçasını ortak şemadaki Arrow tablosuna çevir
+
+    types'ta tipi belirlenmiş sütunlar o tipe çevrilir; çevrilemeyen veya tipi ilk kez
+    belli olan sütunlar için {sütun: tip} olarak ikinci değer döner.
+    """
+    width = len(header)
+    df = pd.DataFrame.from_records(
+        [tuple(row[:width]) + (None,) * (width - len(row)) for row in rows], columns=header
+    )
+    table = _frame_to_table(df)
+    arrays, changed = [], {}
+    for name in columns:
+        if name not in table.column_names:
+            arrays.append(pa.nulls(len(df), type=types.get(name, pa.null())))
+            continue
+        column = table[name]
+        target = types.get(name)
+        if target is None or column.type == target:
+            if target is None and not pa.types.is_null(column.type):
+                changed[name] = column.type
+            arrays.append(column)
+            continue
+        if pa.types.is_string(target):
+            column = pa.array(
+                df[name].map(lambda v: None if pd.isna(v) else str(v)), type=pa.string()
+            )
+            arrays.append(column)
+            continue
+        try:
+            arrays.append(column.cast(target))
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            changed[name] = _widened_type(target, column.type)
+            arrays.append(None)
+    return arrays, changed
+
+
+def stream_raw_to_parquet(file_obj, out_path, chunk_size=CHUNK_SIZE):
+    """Dosyanın tamamını sütun seçmeden, parça parça tipli Parquet'e yaz; dönüş satır sayısı
+
+    Excel sayfaları iter_sheet_rows ile (stream_engine) chunk_size satırlık row group'lar
+    halinde yazılır, kitap belleğe alınmaz. Birden çok sayfa ortak şemada birleşir ve 'Kaynak' sütunu sayfa
+    adını taşır. Bir sütunun tipi sonraki bir parçada değişirse (tam sayı → ondalık,
+    sayı → metin) o sütun genişletilmiş tiple dosya baştan yazılır. Excel dışı biçimler
+    Arrow okuyucusuyla okunur.
+    """
+    if file_format(file_obj) != 'excel':
+        table = read_native_table(file_obj)
+        pq.write_table(table, out_path, compression='snappy', row_group_size=chunk_size)
+        return table.num_rows
+
+    engine = stream_engine(file_obj)
+    sheets = sheet_names(file_obj, engine)
+    headers = {
+        sheet: _mangle_duplicates([
+            str(name) for name in _header_names(next(iter_sheet_rows(file_obj, sheet, engine), ()))
+        ])
+        for sheet in sheets
+    }
+    columns = list(dict.fromkeys(name for header in headers.values() for name in header))
+    label = os.path.basename(file_obj.name) if len(sheets) > 1 else None
+
+    types = {}
+    while True:
+        # İlk geçişte tipler parçalardan öğrenilir; değişen tip görülürse baştan yazılır
+        rows_written, widened = _write_raw_sheets(
+            file_obj, out_path, sheets, headers, columns, types, label, chunk_size, engine
+        )
+        if not widened:
+            return rows_written
+        types.update(widened)
+
+
+def _write_raw_sheets(file_obj, out_path, sheets, headers, columns, types, label, chunk_size, engine):
+    writer = None
+    rows_written = 0
+    try:
+        for sheet in sheets:
+            rows = iter_sheet_rows(file_obj, sheet, engine)
+            next(rows, None)
+            for chunk in iter(lambda: list(islice(rows, chunk_size)), []):
+                arrays, changed = _raw_chunk_table(chunk, headers[sheet], columns, types)
+                if writer is not None and changed:
+                    return rows_written, changed
+                while changed:
+                    # Henüz yazılmış parça yok; tipler bu parçaya göre genişletilir
+                    types.update(changed)
+                    arrays, changed = _raw_chunk_table(chunk, headers[sheet], columns, types)
+                names = list(columns)
+                if label is not None:
+                    arrays.append(pa.repeat(source_label(label, sheet), len(chunk)))
+                    names.append('Kaynak')
+                table = pa.Table.from_arrays(arrays, names=names)
+                if writer is None:
+                    writer = pq.ParquetWriter(out_path, table.schema, compression='snappy')
+                writer.write_table(table)
+                rows_written += len(chunk)
+        if writer is None:
+            # Sadece başlık satırı olan kitap: boş tablo yazılır
+            names = list(columns) + (['Kaynak'] if label is not None else [])
+            pq.write_table(pa.table({name: pa.array([], type=pa.string()) for name in names}), out_path)
+        return rows_written, {}
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def parse_uploaded(file_obj):
+    """Yüklenen dosyanın tamamını bir kez ayrıştır; sonraki çağrılar önbellekten döner
+
+    Tablolar içerik SHA-256'sı ile süreç genelindeki DATA_CACHE'te tutulur; eşik, sıralama
+    veya sütun seçimi değişince dosya yeniden ayrıştırılmaz.
+    """
+    return DATA_CACHE.get_or_compute(('parsed', upload_key(file_obj)), lambda: parse_table(file_obj))
+
+
+def preview(table, rows=5):
+    """Önizleme için tablonun ilk satırları"""
+    return table.slice(0, rows).to_pandas()
+
+
+def project(table, columns):
+    """Sütun eşleştirmesi: önbellekteki tablodan sadece seçilen sütunları DataFrame olarak al"""
+    names = list(dict.fromkeys(str(col) for col in columns))
+    return table.select(names).to_pandas()
+
+
+def read_header(file_obj):
+    """Sütun adları ve tipleri; her yükleme için bir kez çıkarılıp önbellekte tutulur"""
+    return DATA_CACHE.get_or_compute(('header', upload_key(file_obj)), lambda: _read_header(file_obj))
+
+
+def _read_header(file_obj):
+    """Sütun adları ve tipleri; xlsx dışı (xls) dosyalarda pandas'a geri düş"""
+    if file_format(file_obj) != 'excel':
+        schema = native_schema(file_obj)
+        return schema.names, {field.name: _arrow_type_label(field.type) for field in schema}
+    try:
+        return sniff_header(file_obj)
+    except zipfile.BadZipFile:
+        file_obj.seek(0)
+        sample = read_excel(file_obj, nrows=3)
+        file_obj.seek(0)
+        types = {}
+        for name, dtype in sample.dtypes.items():
+            if pd.api.types.is_datetime64_any_dtype(dtype):
+                types[name] = 'tarih'
+            elif pd.api.types.is_bool_dtype(dtype):
+                types[name] = 'mantıksal'
+            elif pd.api.types.is_numeric_dtype(dtype):
+                types[name] = 'sayı'
+            else:
+                types[name] = 'metin'
+        return sample.columns.tolist(), types
+
+
+def _clean_frame(chunk, extra_names, date_stats=None, number_stats=None, drop_stats=None,
+                 number_convention=None):
+    """Standart isimli parçayı temizleyip tipli bir Arrow tablosuna çevir"""
+    read_count = len(chunk)
+    chunk = clean_rows(chunk, date_stats=date_stats, number_stats=number_stats, drop_stats=drop_stats,
+                       number_convention=number_convention)
+    for name in extra_names:
+        chunk[name] = chunk[name].astype('string')
+
+    table = pa.Table.from_pandas(chunk, schema=_output_schema(extra_names), preserve_index=False)
+    return table, read_count
+
+
+def _clean_chunk(rows, key_idx, extra_idx, extra_names, date_stats=None, number_stats=None,
+                 drop_stats=None, number_convention=None):
+    """Ham satır parçasını tipli ve temizlenmiş bir Arrow tablosuna çevir"""
+    chunk = pd.DataFrame({
+        name: [row[i] if i < len(row) else None for row in rows]
+        for name, i in zip(STANDARD_COLUMNS, key_idx)
+    })
+    for name, i in zip(extra_names, extra_idx):
+        chunk[name] = [
+            str(row[i]) if i < len(row) and row[i] is not None else None
+            for row in rows
+        ]
+    return _clean_frame(chunk, extra_names, date_stats, number_stats, drop_stats, number_convention)
+
+
+def _output_schema(extra_names):
+    schema = STANDARD_SCHEMA
+    for name in extra_names:
+        schema = schema.append(pa.field(name, pa.string()))
+    return schema
+
+
+def _extra_columns(header, key_idx):
+    """Minimal mod kapalıyken saklanacak diğer sütunlar"""
+    extra_idx, extra_names = [], []
+    for i, name in enumerate(header):
+        if i not in key_idx and str(name) not in STANDARD_COLUMNS + extra_names:
+            extra_idx.append(i)
+            extra_names.append(str(name))
+    return extra_idx, extra_names
+
+
+def stream_excel_to_parquet(file_obj, sink, tn_col, cons_col, date_col, contract_col,
+                            minimal=True, chunk_size=CHUNK_SIZE, sheet_name=None):
+    """Excel'i sabit boyutlu parçalar halinde okuyup Parquet row group'ları olarak yaz"""
+    rows = iter_sheet_rows(file_obj, sheet_name, engine=stream_engine(file_obj))
+    header = _header_names(next(rows, ()))
+
+    key_idx = [_column_index(header, col) for col in (tn_col, cons_col, date_col, contract_col)]
+    extra_idx, extra_names = _extra_columns(header, key_idx) if not minimal else ([], [])
+
+    stats = {'rows_read': 0, 'rows_kept': 0, 'row_groups': 0, 'date_paths': {}, 'number_paths': {},
+             'drops': {}}
+    buffer = []
+    # Tüketim ayraç kuralı ilk parçada belirlenir, tüm parçalarda aynı kalır
+    number_convention = {}
+
+    with pq.ParquetWriter(sink, _output_schema(extra_names), compression='snappy') as writer:
+        def flush():
+            table, read_count = _clean_chunk(
+                buffer, key_idx, extra_idx, extra_names,
+                stats['date_paths'], stats['number_paths'], stats['drops'], number_convention
+            )
+            writer.write_table(table, row_group_size=chunk_size)
+            stats['rows_read'] += read_count
+            stats['rows_kept'] += table.num_rows
+            stats['row_groups'] += 1
+            buffer.clear()
+
+        for row in rows:
+            buffer.append(row)
+            if len(buffer) >= chunk_size:
+                flush()
+        if buffer:
+            flush()
+
+    gc.collect()
+    return stats
+
+
+def native_to_parquet(file_obj, sink, tn_col, cons_col, date_col, contract_col,
+                      minimal=True, chunk_size=CHUNK_SIZE):
+    """CSV / Parquet / Feather dosyasını Excel yolu ile aynı şemada Parquet'e yaz"""
+    key_cols = [tn_col, cons_col, date_col, contract_col]
+    table = read_native_table(
+        file_obj,
+        columns=[str(c) for c in key_cols] if minimal else None,
+        string_columns=[str(tn_col), str(contract_col)],
+        float_columns=[str(cons_col)],
+    )
+    header = table.column_names
+    key_idx = [_column_index(header, col) for col in key_cols]
+    extra_idx, extra_names = _extra_columns(header, key_idx) if not minimal else ([], [])
+    table = table.select(key_idx + extra_idx).rename_columns(STANDARD_COLUMNS + extra_names)
+
+    stats = {'rows_read': 0, 'rows_kept': 0, 'row_groups': 0, 'date_paths': {}, 'number_paths': {},
+             'drops': {}}
+    number_convention = {}
+    with pq.ParquetWriter(sink, _output_schema(extra_names), compression='snappy') as writer:
+        for batch in table.to_batches(max_chunksize=chunk_size):
+            cleaned, read_count = _clean_frame(
+                batch.to_pandas(), extra_names,
+                stats['date_paths'], stats['number_paths'], stats['drops'], number_convention
+            )
+            writer.write_table(cleaned, row_group_size=chunk_size)
+            stats['rows_read'] += read_count
+            stats['rows_kept'] += cleaned.num_rows
+            stats['row_groups'] += 1
+    return stats
+
+
+def file_to_parquet(file_obj, sink, tn_col, cons_col, date_col, contract_col,
+                    minimal=True, chunk_size=CHUNK_SIZE):
+    """Dosya biçimine göre Excel ya da yerel (CSV/Parquet/Feather) yolunu seç"""
+    if file_format(file_obj) == 'excel':
+        return stream_excel_to_parquet(
+            file_obj, sink, tn_col, cons_col, date_col, contract_col, minimal, chunk_size
+        )
+    return native_to_parquet(
+        file_obj, sink, tn_col, cons_col, date_col, contract_col, minimal, chunk_size
+    )
+
+
+def excel_to_parquet_bytes(file_obj, tn_col, cons_col, date_col, contract_col,
+                           minimal=True, chunk_size=CHUNK_SIZE):
+    """Akışlı dönüşümü bellek içi Parquet bytes olarak döndür"""
+    sink = pa.BufferOutputStream()
+    stats = file_to_parquet(
+        file_obj, sink, tn_col, cons_col, date_col, contract_col,
+        minimal=minimal, chunk_size=chunk_size
+    )
+    return sink.getvalue().to_pybytes(), stats
+
+
+def _ingest_worker(name, file_name, data, tn_col, cons_col, date_col, contract_col, minimal, chunk_size):
+    """Süreç havuzunda tek dosyayı Parquet bytes'a çevir"""
+    # Biçim (.xls / .xlsx / CSV...) dosya adından anlaşılır
+    file_obj = BytesIO(data)
+    file_obj.name = file_name
+    parquet_bytes, stats = excel_to_parquet_bytes(
+        file_obj, tn_col, cons_col, date_col, contract_col,
+        minimal=minimal, chunk_size=chunk_size
+    )
+    return name, parquet_bytes, stats
+
+
+def parallel_excel_to_parquet(files, tn_col, cons_col, date_col, contract_col,
+                              minimal=True, chunk_size=CHUNK_SIZE, max_workers=None, file_names=None):
+    """Birden çok Excel dosyasını ayrı süreçlerde aynı anda Parquet'e çevir
+
+    files: {ad: dosya bytes'ı}; file_names: {ad: yüklenen dosyanın adı} (verilmezse ad
+    dosya adı sayılır). Dönüş: {ad: (parquet bytes, istatistik)}
+    """
+    file_names = file_names or {}
+    if not files:
+        return {}
+    max_workers = max_workers or min(len(files), os.cpu_count() or 1)
+
+    results = {}
+    # spawn: Streamlit sunucusunun thread'leri alt süreçlere kopyalanmasın
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as pool:
+        futures = [
+            pool.submit(_ingest_worker, name, file_names.get(name, name), data, tn_col, cons_col, date_col,
+                        contract_col, minimal, chunk_size)
+            for name, data in files.items()
+        ]
+        for future in as_completed(futures):
+            name, parquet_bytes, stats = future.result()
+            results[name] = (parquet_bytes, stats)
+    return results
+
+
+def sheet_names(file_obj, engine=None):
+    """Çalışma kitabındaki sayfa adları; Excel dışı biçimlerde [None]"""
+    if file_format(file_obj) != 'excel':
+        return [None]
+    file_obj.seek(0)
+    try:
+        if excel_engine(engine) == 'calamine':
+            return list(python_calamine.CalamineWorkbook.from_filelike(file_obj).sheet_names)
+        if _is_xls(file_obj):
+            return list(pd.ExcelFile(file_obj).sheet_names)
+        workbook = load_workbook(file_obj, read_only=True)
+        try:
+            return list(workbook.sheetnames)
+        finally:
+            workbook.close()
+    finally:
+        file_obj.seek(0)
+
+
+def source_label(name, sheet):
+    """Kaynak sütunu değeri: 'dosya' veya 'dosya / sayfa'"""
+    return name if sheet is None else f"{name} / {sheet}"
+
+
+def _sheet_worker(name, data, sheet, tn_col, cons_col, date_col, contract_col, minimal, chunk_size):
+    """Tek dosyanın tek sayfasını Parquet bytes'a çevir; seçilen sütunlar sayfada yoksa None"""
+    file_obj = BytesIO(data)
+    file_obj.name = name
+    sink = pa.BufferOutputStream()
+    try:
+        if sheet is None:
+            stats = file_to_parquet(
+                file_obj, sink, tn_col, cons_col, date_col, contract_col, minimal, chunk_size
+            )
+        else:
+            stats = stream_excel_to_parquet(
+                file_obj, sink, tn_col, cons_col, date_col, contract_col, minimal, chunk_size,
+                sheet_name=sheet
+            )
+    except KeyError:
+        # Özet/boş sayfalar: eşleştirilen sütunlar bu sayfada yok
+        return None, None
+    return sink.getvalue().to_pybytes(), stats
+
+
+def _merge_counts(target, counts):
+    for name, count in counts.items():
+        target[name] = target.get(name, 0) + count
+
+
+def parallel_sheets_to_parquet(files, tn_col, cons_col, date_col, contract_col,
+                               minimal=True, chunk_size=CHUNK_SIZE, max_workers=None):
+    """Birden çok dosyanın tüm sayfalarını ayrı süreçlerde okuyup tek Parquet'te birleştir
+
+    files: {dosya adı: bytes}. Her sayfa bir iş olarak süreç havuzuna verilir; sonuçlar
+    aynı şemada birleştirilir ve her satır 'Kaynak' sütununda dosya / sayfa adını taşır.
+    Dönüş: (parquet bytes, istatistik); istatistikte 'sources' okunan, 'skipped'
+    eşleştirilen sütunları içermediği için atlanan kaynaklardır.
+    """
+    jobs = []
+    for name, data in files.items():
+        file_obj = BytesIO(data)
+        file_obj.name = name
+        jobs.extend((name, sheet) for sheet in sheet_names(file_obj))
+
+    args = (tn_col, cons_col, date_col, contract_col, minimal, chunk_size)
+    max_workers = max_workers or min(len(jobs), os.cpu_count() or 1)
+    results = {}
+    if max_workers <= 1:
+        for index, (name, sheet) in enumerate(jobs):
+            results[index] = _sheet_worker(name, files[name], sheet, *args)
+    else:
+        # spawn: Streamlit sunucusunun thread'leri alt süreçlere kopyalanmasın
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as pool:
+            futures = {
+                pool.submit(_sheet_worker, name, files[name], sheet, *args): index
+                for index, (name, sheet) in enumerate(jobs)
+            }
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+
+    stats = {'rows_read': 0, 'rows_kept': 0, 'row_groups': 0, 'date_paths': {}, 'number_paths': {},
+             'drops': {}, 'sources': [], 'skipped': []}
+    tables = []
+    for index, (name, sheet) in enumerate(jobs):
+        parquet_bytes, sheet_stats = results[index]
+        label = source_label(name, sheet)
+        if parquet_bytes is None:
+            stats['skipped'].append(label)
+            continue
+        table = pq.read_table(pa.BufferReader(parquet_bytes))
+        tables.append(table.append_column('Kaynak', pa.repeat(label, table.num_rows)))
+        stats['sources'].append(label)
+        for name_ in ('rows_read', 'rows_kept', 'row_groups'):
+            stats[name_] += sheet_stats[name_]
+        _merge_counts(stats['date_paths'], sheet_stats['date_paths'])
+        _merge_counts(stats['number_paths'], sheet_stats['number_paths'])
+        _merge_counts(stats['drops'], sheet_stats['drops'])
+
+    if not tables:
+        raise KeyError("Seçilen sütunlar hiçbir dosya/sayfada bulunamadı")
+    # Tam modda sayfaların ek sütunları farklı olabilir; eksikler boş olarak eklenir
+    merged = pa.concat_tables(tables, promote_options='default')
+    sink = pa.BufferOutputStream()
+    pq.write_table(merged, sink, compression='snappy', row_group_size=chunk_size)
+    return sink.getvalue().to_pybytes(), stats
+
+
+def benchmark_engines(file_obj, engines=None, repeat=1):
+    """Her okuyucu ile dosyayı oku; satır sayısı, süre ve satır/saniye döndür
+
+    Hem pd.read_excel ile tam okuma hem de akışlı satır okuma ölçülür.
+    """
+    results = {}
+    for engine in available_engines() if engines is None else engines:
+        for mode in ('read_excel', 'stream'):
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                if mode == 'read_excel':
+                    rows = len(read_excel(file_obj, engine=engine))
+                else:
+                    rows = sum(1 for _ in iter_sheet_rows(file_obj, engine=engine)) - 1
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            results[(engine, mode)] = {
+                'rows': rows,
+                'seconds': best,
+                'rows_per_sec': rows / best if best else float('inf'),
+            }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Excel okuyucu karşılaştırması")
+    parser.add_argument('files', nargs='+', help="Ölçülecek Excel dosyaları")
+    parser.add_argument('--engine', action='append', choices=EXCEL_ENGINES,
+                        help="Sadece bu okuyucuyu ölç (tekrarlanabilir)")
+    parser.add_argument('--repeat', type=int, default=1, help="Her ölçüm için tekrar sayısı (en iyisi alınır)")
+    args = parser.parse_args()
+
+    engines = args.engine or list(EXCEL_ENGINES)
+    missing = [engine for engine in engines if engine not in available_engines()]
+    for engine in missing:
+        print(f"{engine}: kurulu değil, atlanıyor", file=sys.stderr)
+    engines = [engine for engine in engines if engine not in missing]
+
+    for path in args.files:
+        with open(path, 'rb') as f:
+            file_obj = BytesIO(f.read())
+        file_obj.name = path
+        for (engine, mode), result in benchmark_engines(file_obj, engines, args.repeat).items():
+            print(f"{os.path.basename(path)}  {engine:<9} {mode:<10} {result['rows']:>10,} satır  "
+                  f"{result['seconds']:>7.2f} sn  {result['rows_per_sec']:>12,.0f} satır/sn")
+
+
+if __name__ == "__main__":
+    main()
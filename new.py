@@ -4,6 +4,13 @@ import numpy as np
 from io import BytesIO
 from datetime import datetime
 
+from baseline import combine_baseline, partial_aggregates, stored_partials
+from cache import DATA_CACHE, format_cache_stats
+from deviation import DeviationIndex, deviation_table
+from ingest import SUPPORTED_TYPES, parse_uploaded, preview, project, upload_key
+from parsers import clean_rows, format_date_stats, format_drop_stats, format_number_stats, period_codes
+from store import DatasetStore, variant_key
+
 def main():
     st.title("Doğalgaz Tüketim Sapma Analizi")
     st.markdown("2023-2024 ortalamasından %30 fazla sapma gösteren tesisatları tespit edin")
@@ -14,7 +21,7 @@ def main():
     # 2023 dosyası yükleme
     file_2023 = st.sidebar.file_uploader(
         "2023 Veriler", 
-        type=['xlsx', 'xls'],
+        type=SUPPORTED_TYPES,
         key="file_2023",
         help="TN, Tüketim Miktarı, Tarih, Sözleşme Numarası sütunları olmalı"
     )
@@ -22,7 +29,7 @@ def main():
     # 2024 dosyası yükleme
     file_2024 = st.sidebar.file_uploader(
         "2024 Veriler", 
-        type=['xlsx', 'xls'],
+        type=SUPPORTED_TYPES,
         key="file_2024",
         help="TN, Tüketim Miktarı, Tarih, Sözleşme Numarası sütunları olmalı"
     )
@@ -30,26 +37,18 @@ def main():
     # 2025 dosyası yükleme
     file_2025 = st.sidebar.file_uploader(
         "2025 Güncel Veriler", 
-        type=['xlsx', 'xls'],
+        type=SUPPORTED_TYPES,
         key="file_2025",
         help="TN, Tüketim Miktarı, Tarih, Sözleşme Numarası sütunları olmalı"
     )
     
-    # Eşik değeri ayarı
-    threshold = st.sidebar.slider(
-        "Sapma Eşiği (%)", 
-        min_value=10, 
-        max_value=100, 
-        value=30,
-        help="Bu yüzdeden fazla artış gösteren tesisatlar raporlanacak"
-    )
-    
     if file_2023 is not None and file_2024 is not None and file_2025 is not None:
         try:
-            # Excel dosyalarını okuma
-            df_2023 = pd.read_excel(file_2023)
-            df_2024 = pd.read_excel(file_2024)
-            df_2025 = pd.read_excel(file_2025)
+            # Yüklenen dosyalar içerik anahtarına göre bir kez ayrıştırılır (Excel, CSV, Parquet, Feather);
+            # eşik veya sütun seçimi değişince önbellekteki tablo kullanılır
+            table_2023 = parse_uploaded(file_2023)
+            table_2024 = parse_uploaded(file_2024)
+            table_2025 = parse_uploaded(file_2025)
             
             st.success("✅ Tüm dosyalar başarıyla yüklendi!")
             
@@ -58,18 +57,18 @@ def main():
             
             with col1:
                 st.subheader("2023 Verisi")
-                st.dataframe(df_2023.head(), use_container_width=True)
-                st.info(f"Toplam kayıt: {len(df_2023)}")
+                st.dataframe(preview(table_2023), use_container_width=True)
+                st.info(f"Toplam kayıt: {table_2023.num_rows}")
             
             with col2:
                 st.subheader("2024 Verisi")
-                st.dataframe(df_2024.head(), use_container_width=True)
-                st.info(f"Toplam kayıt: {len(df_2024)}")
+                st.dataframe(preview(table_2024), use_container_width=True)
+                st.info(f"Toplam kayıt: {table_2024.num_rows}")
                 
             with col3:
                 st.subheader("2025 Verisi")
-                st.dataframe(df_2025.head(), use_container_width=True)
-                st.info(f"Toplam kayıt: {len(df_2025)}")
+                st.dataframe(preview(table_2025), use_container_width=True)
+                st.info(f"Toplam kayıt: {table_2025.num_rows}")
             
             # Sütun eşleştirmesi - 2023 dosyasına göre
             st.header("🔧 Sütun Eşleştirmesi")
@@ -78,32 +77,43 @@ def main():
             with col1:
                 tn_col = st.selectbox(
                     "TN Sütunu:",
-                    options=df_2023.columns.tolist()
+                    options=table_2023.column_names
                 )
                 
             with col2:
                 tuketim_col = st.selectbox(
                     "Tüketim Sütunu:",
-                    options=df_2023.columns.tolist()
+                    options=table_2023.column_names
                 )
                 
             with col3:
                 tarih_col = st.selectbox(
                     "Tarih Sütunu:",
-                    options=df_2023.columns.tolist()
+                    options=table_2023.column_names
                 )
                 
             with col4:
                 sozlesme_col = st.selectbox(
                     "Sözleşme No Sütunu:",
-                    options=df_2023.columns.tolist()
+                    options=table_2023.column_names
                 )
             
+            # Sonuçlar bu girdilere aittir; dosya veya sütun değişince eski sonuç gösterilmez
+            signature = (upload_key(file_2023), upload_key(file_2024), upload_key(file_2025),
+                         tn_col, tuketim_col, tarih_col, sozlesme_col)
+            
             if st.button("🔍 Sapma Analizini Başlat", type="primary"):
                 with st.spinner("Analiz yapılıyor..."):
+                    # Sadece seçilen sütunlar DataFrame'e çevrilir
+                    key_cols = [tn_col, tuketim_col, tarih_col, sozlesme_col]
+                    df_2023 = project(table_2023, key_cols)
+                    df_2024 = project(table_2024, key_cols)
+                    df_2025 = project(table_2025, key_cols)
+                    
                     # 2023-2024 ortalamalarını hesapla
                     historical_avg = calculate_historical_average_separate(
-                        df_2023, df_2024, tn_col, tuketim_col, tarih_col, sozlesme_col
+                        df_2023, df_2024, tn_col, tuketim_col, tarih_col, sozlesme_col,
+                        store_keys=(upload_key(file_2023), upload_key(file_2024))
                     )
                     
                     # 2025 verilerini hazırla
@@ -112,56 +122,19 @@ def main():
                     )
                     
                     # Sapma analizini yap
-                    deviation_results = analyze_deviations(
-                        historical_avg, current_data, threshold
-                    )
+                    deviation_results = analyze_deviations(historical_avg, current_data)
                     
                     if deviation_results is not None and not deviation_results.empty:
                         st.success(f"✅ Analiz tamamlandı!")
-                        
-                        # Özet bilgi
-                        total_compared = len(deviation_results)
-                        high_deviation = len(deviation_results[deviation_results['Sapma_Yüzdesi'] >= threshold])
-                        
-                        col1, col2, col3 = st.columns(3)
-                        with col1:
-                            st.metric("Karşılaştırılan Tesisat", f"{total_compared}")
-                        with col2:
-                            st.metric(f">{threshold}% Sapma Gösteren", f"{high_deviation}")
-                        with col3:
-                            st.metric("Oran", f"{high_deviation/total_compared*100:.1f}%" if total_compared > 0 else "0%")
-                        
-                        # Yüksek sapma gösteren tesisatları filtrele
-                        high_deviations = deviation_results[
-                            deviation_results['Sapma_Yüzdesi'] >= threshold
-                        ].copy()
-                        
-                        if not high_deviations.empty:
-                            st.header(f"⚠️ {threshold}% Üzeri Sapma Gösteren Tesisatlar")
-                            
-                            # Sıralama
-                            high_deviations = high_deviations.sort_values('Sapma_Yüzdesi', ascending=False)
-                            
-                            # Tablo gösterimi
-                            display_df = format_display_table(high_deviations)
-                            st.dataframe(display_df, use_container_width=True, hide_index=True)
-                            
-                            # Excel indirme
-                            excel_data = create_deviation_report(high_deviations, threshold)
-                            
-                            st.download_button(
-                                label="📥 Sapma Raporunu Excel Olarak İndir",
-                                data=excel_data,
-                                file_name=f"sapma_raporu_{threshold}pct_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                type="primary"
-                            )
-                            
-                        else:
-                            st.success(f"🎉 {threshold}% üzeri sapma gösteren tesisat bulunmamaktadır!")
-                            
+                        # Sonuçlar bir kez sıralanıp saklanır; eşik değişince analiz tekrar çalışmaz
+                        st.session_state['sapma_sonuclari'] = (signature, DeviationIndex(deviation_results))
                     else:
+                        st.session_state.pop('sapma_sonuclari', None)
                         st.error("❌ Veri analizi sırasında hata oluştu.")
+            
+            analysis = st.session_state.get('sapma_sonuclari')
+            if analysis is not None and analysis[0] == signature:
+                show_threshold_results(analysis[1])
                         
         except Exception as e:
             st.error(f"❌ Hata: {str(e)}")
@@ -181,40 +154,95 @@ def main():
         st.dataframe(example_data, use_container_width=True)
         st.warning("⚠️ Her üç dosya da aynı sütun yapısına sahip olmalıdır!")
 
-def calculate_historical_average_separate(df_2023, df_2024, tn_col, tuketim_col, tarih_col, sozlesme_col):
-    """2023 ve 2024 verilerini ayrı ayrı işleyip ortalamasını hesapla"""
-    try:
-        # 2023 verilerini temizle
-        df_2023_clean = clean_data(df_2023, tn_col, tuketim_col, tarih_col, sozlesme_col, 2023)
-        # 2024 verilerini temizle  
-        df_2024_clean = clean_data(df_2024, tn_col, tuketim_col, tarih_col, sozlesme_col, 2024)
+@st.fragment
+def show_threshold_results(index):
+    """Eşiğe bağlı metrikler, tablo ve rapor; eşik değişince sadece bu bölüm yeniden çalışır"""
+    threshold = st.slider(
+        "Sapma Eşiği (%)", 
+        min_value=10, 
+        max_value=100, 
+        value=30,
+        key="threshold",
+        help="Bu yüzdeden fazla artış gösteren tesisatlar raporlanacak"
+    )
+    
+    # Özet bilgi: eşik üstü satır sayısı sıralı indekste ikili aramayla bulunur
+    total_compared = len(index)
+    high_deviation = index.count_at_least(threshold)
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Karşılaştırılan Tesisat", f"{total_compared}")
+    with col2:
+        st.metric(f">{threshold}% Sapma Gösteren", f"{high_deviation}")
+    with col3:
+        st.metric("Oran", f"{high_deviation/total_compared*100:.1f}%" if total_compared > 0 else "0%")
+    
+    if high_deviation:
+        st.header(f"⚠️ {threshold}% Üzeri Sapma Gösteren Tesisatlar")
         
-        if df_2023_clean is None or df_2024_clean is None:
-            return None
-            
-        # İki veriyi birleştir
-        combined_df = pd.concat([df_2023_clean, df_2024_clean], ignore_index=True)
+        # Yüksek sapmalar zaten azalan sırada
+        high_deviations = index.at_least(threshold)
         
-        st.info(f"📊 2023 verisi: {len(df_2023_clean)} kayıt, 2024 verisi: {len(df_2024_clean)} kayıt")
+        # Tablo gösterimi
+        display_df = format_display_table(high_deviations)
+        st.dataframe(display_df, use_container_width=True, hide_index=True)
         
-        # Sıfır tüketim değerlerini filtrele
-        before_filter = len(combined_df)
-        combined_df = combined_df[combined_df['Tuketim'] > 0]
-        after_filter = len(combined_df)
+        # Excel raporu sadece indirme tıklanınca üretilir
+        st.download_button(
+            label="📥 Sapma Raporunu Excel Olarak İndir",
+            data=lambda: create_deviation_report(high_deviations, threshold),
+            file_name=f"sapma_raporu_{threshold}pct_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            type="primary"
+        )
         
-        if before_filter > after_filter:
-            st.warning(f"⚠️ {before_filter - after_filter} adet sıfır tüketim değeri ortalamadan çıkarıldı")
+    else:
+        st.success(f"🎉 {threshold}% üzeri sapma gösteren tesisat bulunmamaktadır!")
+
+def calculate_historical_average_separate(df_2023, df_2024, tn_col, tuketim_col, tarih_col, sozlesme_col,
+                                          store_keys=None):
+    """2023 ve 2024 verilerini ayrı ayrı işleyip ortalamasını kısmi toplamlardan hesapla
+
+    store_keys (yüklenen dosyaların içerik anahtarları) verilirse her yılın tesisat × ay
+    kısmi toplamları depoda saklanır; aynı dosya ve sütun eşleştirmesiyle ham satırlar
+    tekrar taranmaz.
+    """
+    try:
+        store = DatasetStore()
+        partials = []
+        for df, expected_year, store_key in zip(
+            (df_2023, df_2024), (2023, 2024), store_keys or (None, None)
+        ):
+            def load_rows(df=df, expected_year=expected_year):
+                # Yılın verisini temizle
+                rows = clean_data(df, tn_col, tuketim_col, tarih_col, sozlesme_col, expected_year)
+                if rows is None:
+                    raise ValueError(f"{expected_year} verisi temizlenemedi")
+                return rows
+            
+            if store_key:
+                variant = variant_key(tn_col, tuketim_col, tarih_col, sozlesme_col, expected_year)
+                partials.append(stored_partials(store, store_key, variant, load_rows))
+            else:
+                partials.append(partial_aggregates(load_rows()))
         
-        if combined_df.empty:
-            st.error("❌ Sıfırdan büyük tüketim değeri bulunamadı!")
-            return None
+        counts = [int(p['Adet'].sum()) for p in partials]
+        st.info(f"📊 2023 verisi: {counts[0]} kayıt, 2024 verisi: {counts[1]} kayıt")
+        
+        # Sıfır tüketim değerleri ortalamaya girmez
+        zero_count = sum(int(p.loc[~p['Pozitif'], 'Adet'].sum()) for p in partials)
+        if zero_count:
+            st.warning(f"⚠️ {zero_count} adet sıfır tüketim değeri ortalamadan çıkarıldı")
         
         # TN bazında ortalama hesapla (sıfır olmayan değerlerden)
-        monthly_avg = combined_df.groupby(['TN', 'Sozlesme_No'])['Tuketim'].mean().reset_index()
-        monthly_avg.columns = ['TN', 'Sozlesme_No', 'Ortalama_Tuketim']
+        monthly_avg = combine_baseline(partials, positive_only=True)
         
+        if monthly_avg.empty:
+            st.error("❌ Sıfırdan büyük tüketim değeri bulunamadı!")
+            return None
             
-        return monthly_avg
+        return monthly_avg[['TN', 'Sozlesme_No', 'Ortalama_Tuketim']]
         
     except Exception as e:
         st.error(f"Geçmiş veri analizi hatası: {str(e)}")
@@ -227,30 +255,17 @@ def clean_data(df, tn_col, tuketim_col, tarih_col, sozlesme_col, expected_year):
         df_clean = df[[tn_col, tuketim_col, tarih_col, sozlesme_col]].copy()
         df_clean.columns = ['TN', 'Tuketim', 'Tarih', 'Sozlesme_No']
         
-        # Boş değerleri temizle
-        initial_count = len(df_clean)
-        df_clean = df_clean.dropna()
-        
-    
-        
-        # Tarihi datetime'a çevir
-        df_clean['Tarih'] = pd.to_datetime(df_clean['Tarih'], errors='coerce')
-        df_clean = df_clean.dropna(subset=['Tarih'])
-        
-        # Tüketimi sayısal yap
-        df_clean['Tuketim'] = pd.to_numeric(df_clean['Tuketim'], errors='coerce')
-        df_clean = df_clean.dropna(subset=['Tuketim'])
-        
-        # Belirtilen yılı filtrele
-        df_clean = df_clean[df_clean['Tarih'].dt.year == expected_year]
+        # Tek geçişli temizlik: boş değerler, tarih/tüketim çevirme ve yıl filtresi tek maskede
+        date_stats, number_stats, drop_stats = {}, {}, {}
+        df_clean = clean_rows(df_clean, years=[expected_year], allow_negative=True,
+                              date_stats=date_stats, number_stats=number_stats, drop_stats=drop_stats)
+        st.caption(format_date_stats(date_stats))
+        st.caption(format_number_stats(number_stats))
+        st.caption(format_drop_stats(drop_stats))
         
         if df_clean.empty:
             st.warning(f"⚠️ {expected_year} yılına ait veri bulunamadı!")
             return None
-            
-        # TN ve Sözleşme No'yu string yap
-        df_clean['TN'] = df_clean['TN'].astype(str).str.strip()
-        df_clean['Sozlesme_No'] = df_clean['Sozlesme_No'].astype(str).str.strip()
         
         return df_clean
         
@@ -264,35 +279,22 @@ def prepare_current_data(df, tn_col, tuketim_col, tarih_col, sozlesme_col):
         df_clean = df[[tn_col, tuketim_col, tarih_col, sozlesme_col]].copy()
         df_clean.columns = ['TN', 'Tuketim', 'Tarih', 'Sozlesme_No']
         
-        # Boş değerleri temizle
-        df_clean = df_clean.dropna()
-        
-        # Tarihi datetime'a çevir
-        df_clean['Tarih'] = pd.to_datetime(df_clean['Tarih'], errors='coerce')
-        df_clean = df_clean.dropna(subset=['Tarih'])
-        
-        # Tüketimi sayısal yap
-        df_clean['Tuketim'] = pd.to_numeric(df_clean['Tuketim'], errors='coerce')
-        df_clean = df_clean.dropna(subset=['Tuketim'])
-        
-        # 2025 yılını filtrele
-        df_clean = df_clean[df_clean['Tarih'].dt.year == 2025]
+        # Tek geçişli temizlik: boş değerler, tarih/tüketim çevirme, 2025 filtresi ve
+        # negatif tüketimler tek maskede (sıfır tüketim 2025 için önemli olabilir, tutulur)
+        date_stats, number_stats, drop_stats = {}, {}, {}
+        df_clean = clean_rows(df_clean, years=[2025], date_stats=date_stats,
+                              number_stats=number_stats, drop_stats=drop_stats)
+        st.caption(format_date_stats(date_stats))
+        st.caption(format_number_stats(number_stats))
+        st.caption(format_drop_stats(drop_stats))
         
         if df_clean.empty:
             st.error("❌ 2025 yılına ait veri bulunamadı!")
             return None
         
-        # Sıfır tüketim değerlerini dahil et (2025 için sıfır da önemli olabilir)
-        # Ama negatif değerleri temizle
-        df_clean = df_clean[df_clean['Tuketim'] >= 0]
-        
-        # TN ve Sözleşme No'yu string yap
-        df_clean['TN'] = df_clean['TN'].astype(str).str.strip()
-        df_clean['Sozlesme_No'] = df_clean['Sozlesme_No'].astype(str).str.strip()
-        
         # Ay bilgisi ekle
         df_clean['Ay'] = df_clean['Tarih'].dt.month
-        df_clean['Ay_Adi'] = df_clean['Tarih'].dt.strftime('%Y-%m')
+        df_clean['Ay_Kodu'] = period_codes(df_clean['Tarih'])
         
         st.success(f"✅ 2025 verisi hazırlandı: {len(df_clean)} kayıt")
         
@@ -302,55 +304,20 @@ def prepare_current_data(df, tn_col, tuketim_col, tarih_col, sozlesme_col):
         st.error(f"2025 veri hazırlama hatası: {str(e)}")
         return None
 
-def analyze_deviations(historical_avg, current_data, threshold):
-    """Sapma analizini yap"""
+def analyze_deviations(historical_avg, current_data):
+    """Sapma analizini yap (TN + Sözleşme No anahtarıyla tek birleştirme)"""
     try:
         if historical_avg is None or current_data is None:
             return None
-            
-        results = []
-        matched_count = 0
         
-        # Her 2025 kaydı için kontrol et
-        for _, row in current_data.iterrows():
-            tn = row['TN']
-            sozlesme_no = row['Sozlesme_No']
-            current_tuketim = row['Tuketim']
-            ay_adi = row['Ay_Adi']
-            tarih = row['Tarih']
-            
-            # Bu TN'nin geçmiş ortalamasını bul
-            historical_record = historical_avg[
-                (historical_avg['TN'] == tn) & 
-                (historical_avg['Sozlesme_No'] == sozlesme_no)
-            ]
-            
-            if not historical_record.empty:
-                matched_count += 1
-                avg_tuketim = historical_record.iloc[0]['Ortalama_Tuketim']
-                
-                # Sapma hesapla (ortalama > 0 olduğundan emin olduk)
-                sapma_miktar = current_tuketim - avg_tuketim
-                sapma_yuzde = (sapma_miktar / avg_tuketim) * 100
-                
-                results.append({
-                    'TN': tn,
-                    'Sozlesme_No': sozlesme_no,
-                    'Ay': ay_adi,
-                    'Tarih': tarih,
-                    'Geçmiş_Ortalama': avg_tuketim,
-                    'Güncel_Tuketim': current_tuketim,
-                    'Sapma_Miktarı': sapma_miktar,
-                    'Sapma_Yüzdesi': sapma_yuzde
-                })
+        # Ortalamalar sıfırdan büyük tüketimlerden hesaplandığı için bölme güvenli
+        results = deviation_table(historical_avg, current_data, positive_only=True)
         
-        st.info(f"📊 {len(current_data)} adet 2025 kaydından {matched_count} tanesi geçmiş verilerle eşleşti")
+        st.info(f"📊 {len(current_data)} adet 2025 kaydından {len(results)} tanesi geçmiş verilerle eşleşti")
         
-        if results:
-            return pd.DataFrame(results)
-        else:
+        if results.empty:
             st.warning("⚠️ Eşleşen tesisat bulunamadı!")
-            return pd.DataFrame()
+        return results
             
     except Exception as e:
         st.error(f"Sapma analizi hatası: {str(e)}")
@@ -423,3 +390,4 @@ if __name__ == "__main__":
     )
     
     main()
+    st.sidebar.caption(format_cache_stats(DATA_CACHE.stats()))
@@ -1,11 +1,26 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-from io import BytesIO
 from datetime import datetime
 import gc
 import time
-import os
+
+from baseline import (
+    SKETCH_ACCURACY, combine_baseline, seasonal_matrix, seasonal_sketch_matrix, sketch_quantile,
+    stored_partials, stored_sketches
+)
+from cache import DATA_CACHE, MB, format_cache_stats, frame_bytes, shared_frame
+from deviation import DeviationIndex, deviation_table, seasonal_deviation_table
+from ingest import (
+    STANDARD_COLUMNS, SUPPORTED_TYPES, file_format, file_to_parquet,
+    excel_engine, parallel_excel_to_parquet, parallel_sheets_to_parquet, parse_uploaded, project,
+    read_header, upload_group_key, upload_key
+)
+from parsers import (clean_rows, format_date_stats, format_drop_stats, format_number_stats,
+                     format_periods, period_codes)
+from registry import ID_COLUMN, REGISTRY
+from store import DatasetStore, schema_names, variant_key
+from watch import FolderWatcher, StoredFile, stored_label, stored_sources
 
 def main():
     st.title("Doğalgaz Sapma Analizi")
@@ -28,14 +43,60 @@ def main():
     # Minimal kolonlar
     minimal_mode = st.sidebar.checkbox("Minimal Mod (Sadece gerekli kolonlar)", value=True)
     
+    # Akışlı okuma (tepe bellek dosya boyutundan bağımsız)
+    streaming_mode = st.sidebar.checkbox("Akışlı Okuma (düşük bellek)", value=True)
+    
+    # Yıllık dosyaları ayrı süreçlerde aynı anda işle
+    parallel_mode = st.sidebar.checkbox("Paralel Okuma (çok çekirdek)", value=True)
+    
+    # Okunan veri NumPy/nesne tiplerine çevrilmeden Arrow tipli kalır (karşılaştırma: python cache.py yol)
+    arrow_dtypes = st.sidebar.checkbox("Arrow Tipleri (düşük bellek)", value=True)
+    
+    # Ayrıştırılmış ve özetlenmiş veriler için bellek bütçesi; aşılınca eski girdiler diske yazılır
+    cache_budget = st.sidebar.number_input(
+        "Önbellek Bütçesi (MB)", min_value=64, value=int(DATA_CACHE.budget_bytes // MB), step=64
+    )
+    DATA_CACHE.set_budget(cache_budget * MB)
+    
+    # calamine kuruluysa tam okuma onunla yapılır; calamine sayfayı bütünüyle belleğe
+    # aldığı için akışlı (düşük bellekli) okuma xlsx'te openpyxl read-only kalır
+    st.sidebar.caption(
+        f"📗 Excel okuyucu: {excel_engine()} (tam okuma), openpyxl read-only (akışlı okuma) "
+        f"· karşılaştırma: python ingest.py dosya.xlsx"
+    )
+    
     # Dosya yükleme
     st.sidebar.header("📁 Dosya Yükleme")
     
-    file_2023 = st.sidebar.file_uploader("2023 Veriler", type=['xlsx', 'xls'], key="file_2023")
-    file_2024 = st.sidebar.file_uploader("2024 Veriler", type=['xlsx', 'xls'], key="file_2024")  
-    file_2025 = st.sidebar.file_uploader("2025 Veriler", type=['xlsx', 'xls'], key="file_2025")
+    # Aylık ekleme: sadece yeni ay dosyası işlenir, geçmiş yıllar depodaki haliyle kullanılır
+    append_mode = st.sidebar.checkbox(
+        "Aylık Ekleme (sadece yeni ay)", value=False,
+        help="Daha önce tam analizi yapılmış sütun eşleştirmesine yeni 2025 ayını ekler"
+    )
+    
+    # Veri kaynağı: tarayıcıdan yükleme veya sunucudaki izlenen klasörden depoya alınmış dosyalar
+    folder_mode = st.sidebar.radio(
+        "Veri Kaynağı", ["Dosya Yükleme", "İzlenen Klasör"], horizontal=True
+    ) == "İzlenen Klasör"
     
-    threshold = st.sidebar.slider("Sapma Eşiği (%)", 10, 100, 30)
+    # Çoklu dosya: her yıl birden çok dosya, her dosyanın tüm sayfaları tek veri setinde birleşir
+    multi_mode = not append_mode and not folder_mode and st.sidebar.checkbox(
+        "Çoklu Dosya ve Sayfa", value=False,
+        help="Yıl başına birden çok dosya yüklenir; tüm sayfalar paralel okunup birleştirilir"
+    )
+    
+    if folder_mode:
+        file_2023, file_2024, file_2025 = select_stored_files(append_mode)
+    elif append_mode:
+        file_2023 = file_2024 = None
+        file_2025 = st.sidebar.file_uploader("2025 Yeni Ay Verisi", type=SUPPORTED_TYPES, key="file_2025_append")
+    else:
+        file_2023 = st.sidebar.file_uploader("2023 Veriler", type=SUPPORTED_TYPES, key="file_2023",
+                                             accept_multiple_files=multi_mode)
+        file_2024 = st.sidebar.file_uploader("2024 Veriler", type=SUPPORTED_TYPES, key="file_2024",
+                                             accept_multiple_files=multi_mode)
+        file_2025 = st.sidebar.file_uploader("2025 Veriler", type=SUPPORTED_TYPES, key="file_2025",
+                                             accept_multiple_files=multi_mode)
     
     # Hızlı ön işleme seçenekleri
     st.sidebar.header("Hızlandırma Seçenekleri")
@@ -52,13 +113,30 @@ def main():
         format_func=lambda x: datetime(2023, x, 1).strftime("%B")
     )
     
-    if file_2023 and file_2024 and file_2025:
+    # Mevsimsel referans: her ay, geçmiş yılların aynı ayının ortalamasıyla karşılaştırılır
+    seasonal = st.sidebar.checkbox(
+        "Mevsimsel Referans (aynı ayın ortalaması)", value=False,
+        help="Kapalıyken 2023-2024'ün tüm aylarının tek ortalaması kullanılır"
+    )
+    
+    # Sağlam referans: tek tük hatalı sayaç okumalarından etkilenmeyen medyan / yüzdelik
+    reference = st.sidebar.selectbox("Geçmiş Referansı", ["Ortalama", "Medyan", "Yüzdelik"])
+    quantile = None
+    if reference == "Medyan":
+        quantile = 0.5
+    elif reference == "Yüzdelik":
+        quantile = st.sidebar.slider("Yüzdelik (p)", 5, 95, 90, 5) / 100
+    
+    if file_2025 and (append_mode or (file_2023 and file_2024)):
         
-        # İlk sütun analizi
+        # İlk sütun analizi (sadece başlık satırı okunur)
         with st.spinner("Sütun yapısı analiz ediliyor..."):
             try:
-                sample_df = pd.read_excel(file_2023, nrows=3)
-                columns = sample_df.columns.tolist()
+                header_file = file_2025 if append_mode else file_2023
+                if isinstance(header_file, list):
+                    # Çoklu modda sütunlar ilk dosyanın ilk sayfasından okunur
+                    header_file = header_file[0]
+                columns, column_types = read_header(header_file)
             except:
                 st.error("Excel dosyası okunamıyor!")
                 return
@@ -67,14 +145,25 @@ def main():
         st.header("🔧 Hızlı Sütun Seçimi")
         col1, col2, col3, col4 = st.columns(4)
         
+        column_label = lambda c: f"{c} ({column_types.get(c, '?')})"
+        
         with col1:
-            tn_col = st.selectbox("TN:", columns, key="tn")
+            tn_col = st.selectbox("TN:", columns, key="tn", format_func=column_label)
         with col2:
-            consumption_col = st.selectbox("Tüketim:", columns, key="cons")
+            consumption_col = st.selectbox("Tüketim:", columns, key="cons", format_func=column_label)
         with col3:
-            date_col = st.selectbox("Tarih:", columns, key="date")
+            date_col = st.selectbox("Tarih:", columns, key="date", format_func=column_label)
         with col4:
-            contract_col = st.selectbox("Sözleşme:", columns, key="contract")
+            contract_col = st.selectbox("Sözleşme:", columns, key="contract", format_func=column_label)
+        
+        # Sonuçlar bu dosya, sütun ve ayarlara aittir; biri değişince eski sonuç gösterilmez
+        uploads = [f for group in (file_2023, file_2024, file_2025)
+                   for f in (group if isinstance(group, list) else [group]) if f is not None]
+        signature = (
+            tuple(upload_key(f) for f in uploads), tn_col, consumption_col, date_col, contract_col,
+            append_mode, sample_rate, tuple(months_filter), seasonal, quantile,
+            quick_threshold if quick_scan else None
+        )
         
         # Süper hızlı analiz butonu
         if st.button("🚀 SÜPER HIZLI ANALİZ", type="primary"):
@@ -89,11 +178,26 @@ def main():
                 status.text("📦 Dosyalar Parquet formatına çevriliyor...")
                 progress.progress(10)
                 
-                parquet_files = convert_to_parquet_cached(
-                    file_2023, file_2024, file_2025,
-                    tn_col, consumption_col, date_col, contract_col,
-                    minimal_mode
-                )
+                current_months = months_filter
+                if append_mode:
+                    # Sadece yeni ay dosyası işlenir; sapma yalnızca yeni eklenen aylar için hesaplanır
+                    parquet_files, new_months = append_current_month(
+                        file_2025, tn_col, consumption_col, date_col, contract_col,
+                        minimal_mode, streaming_mode, use_memory_mapping
+                    )
+                    current_months = [
+                        month for year, month in new_months
+                        if year == 2025 and (not months_filter or month in months_filter)
+                    ]
+                    if parquet_files and not current_months:
+                        st.info("ℹ️ Dosyada seriye yeni eklenen 2025 ayı yok")
+                        return
+                else:
+                    parquet_files = convert_to_parquet_cached(
+                        file_2023, file_2024, file_2025,
+                        tn_col, consumption_col, date_col, contract_col,
+                        minimal_mode, streaming_mode, use_memory_mapping, parallel_mode
+                    )
                 
                 if not parquet_files:
                     st.error("❌ Dosya dönüştürme başarısız!")
@@ -105,12 +209,12 @@ def main():
                 status.text("⚡ Lightning speed veri okuma...")
                 historical_data = fast_read_historical(
                     parquet_files['2023'], parquet_files['2024'],
-                    sample_rate, months_filter
+                    sample_rate, months_filter, seasonal, quantile
                 )
                 
                 current_data = fast_read_current(
                     parquet_files['2025'], 
-                    sample_rate, months_filter
+                    sample_rate, current_months, arrow_dtypes
                 )
                 
                 progress.progress(50)
@@ -118,15 +222,15 @@ def main():
                 # 3. ADIM: Vectorized hesaplamalar
                 status.text("🧮 Süper hızlı hesaplamalar...")
                 results = lightning_deviation_analysis(
-                    historical_data, current_data, threshold,
-                    quick_scan, quick_threshold if quick_scan else None
+                    historical_data, current_data,
+                    quick_scan, quick_threshold if quick_scan else None, seasonal
                 )
                 
                 progress.progress(80)
                 
-                # 4. ADIM: Sonuçları göster
+                # 4. ADIM: Sonuçlar bir kez sıralanır; eşik değişince analiz tekrar çalışmaz
                 status.text("📊 Sonuçlar hazırlanıyor...")
-                display_lightning_results(results, threshold, sample_rate)
+                st.session_state['lightning_sonuclari'] = (signature, DeviationIndex(results))
                 
                 progress.progress(100)
                 
@@ -134,16 +238,21 @@ def main():
                 total_time = time.time() - start_time
                 st.success(f"✅ {total_time:.1f} saniyede tamamlandı!")
                 
-                # Cleanup (in-memory parquet, dosya temizleme gereksiz)
+                # Cleanup (Parquet dosyaları depoda kalır, sonraki yüklemede tekrar kullanılır)
                 del parquet_files
                 gc.collect()
                 
             except Exception as e:
+                st.session_state.pop('lightning_sonuclari', None)
                 st.error(f"❌ Hata: {str(e)}")
                 st.info("💡 Örnekleme oranını düşürmeyi deneyin")
+        
+        analysis = st.session_state.get('lightning_sonuclari')
+        if analysis is not None and analysis[0] == signature:
+            display_lightning_results(analysis[1], sample_rate)
     else:
         # Hız ipuçları
-        st.info("📂 3 Excel dosyasını yükleyin")
+        st.info("📂 3 veri dosyasını yükleyin (Excel, CSV, Parquet veya Feather; çoklu modda yıl başına birden çok dosya)")
         
         st.header("⚡ Süper Hızlı Analiz İpuçları")
         tips = """
@@ -162,55 +271,126 @@ def main():
         """
         st.markdown(tips)
 
-@st.cache_data(ttl=3600, max_entries=3)  # 1 saat cache, max 3 dosya
+@st.cache_resource
+def folder_watcher():
+    """Sunucu süreci başına tek klasör izleyici; yoklama arka plan thread'inde çalışır"""
+    return FolderWatcher().start()
+
+def select_stored_files(append_mode):
+    """İzlenen klasörden depoya alınmış veri setlerini yıl başına seçtir"""
+    watcher = folder_watcher()
+    st.sidebar.caption(f"📂 Klasör: {watcher.watch_dir} (her {watcher.poll_seconds:.0f} sn taranır)")
+    if st.sidebar.button("🔄 Klasörü Şimdi Tara"):
+        watcher.wake()
+    
+    for name, status in sorted(watcher.snapshot().items()):
+        if status['state'] == 'hata':
+            st.sidebar.error(f"❌ {name}: {status['error']}")
+        elif status['state'] == 'işleniyor':
+            st.sidebar.info(f"⏳ {name} depoya alınıyor...")
+    
+    store = DatasetStore()
+    sources = {source['key']: source for source in stored_sources(store)}
+    if not sources:
+        st.sidebar.info("ℹ️ Depoda klasörden alınmış veri seti yok")
+        return None, None, None
+    
+    options = [None] + list(sources)
+    label = lambda key: "— seçin —" if key is None else stored_label(sources[key])
+    years = ['2025'] if append_mode else ['2023', '2024', '2025']
+    selected = {
+        year: st.sidebar.selectbox(f"{year} Veri Seti", options, format_func=label, key=f"stored_{year}")
+        for year in years
+    }
+    files = [
+        StoredFile(store, selected[year], sources[selected[year]]['file_name'])
+        if selected.get(year) else None
+        for year in ('2023', '2024', '2025')
+    ]
+    return tuple(files)
+
 def convert_to_parquet_cached(file_2023, file_2024, file_2025, 
-                             tn_col, cons_col, date_col, contract_col, minimal):
-    """Excel dosyalarını Parquet'e çevir ve cache'le"""
+                             tn_col, cons_col, date_col, contract_col, minimal,
+                             streaming=False, memory_mapping=False, parallel=False):
+    """Excel dosyalarını Parquet'e çevir ve kalıcı veri deposuna yaz"""
     try:
-        parquet_files = {}
-        
-        for year, file_obj in [('2023', file_2023), ('2024', file_2024), ('2025', file_2025)]:
-            st.info(f"📊 {year} dosyası işleniyor...")
-            
-            # Excel'i oku (chunksize kullanmadan)
-            if minimal:
-                # Sadece gerekli kolonları oku
-                usecols = [tn_col, cons_col, date_col, contract_col]
-                df = pd.read_excel(file_obj, usecols=usecols, engine='openpyxl')
+        store = DatasetStore()
+        variant = variant_key(tn_col, cons_col, date_col, contract_col, minimal)
+        files = {'2023': file_2023, '2024': file_2024, '2025': file_2025}
+        keys = {}
+        pending = {}
+        
+        for year, file_obj in files.items():
+            # Aynı içerik daha önce işlendiyse Excel'i hiç açma (anahtar yükleme başına bir kez hesaplanır)
+            keys[year] = upload_group_key(file_obj) if isinstance(file_obj, list) else upload_key(file_obj)
+            if store.has(keys[year], variant):
+                st.info(f"♻️ {year}: depodan okundu, Excel tekrar işlenmedi")
             else:
-                df = pd.read_excel(file_obj, engine='openpyxl')
-            
-            st.info(f"✅ {year}: {len(df)} satır okundu")
-            
-            # Hızlı temizlik
-            initial_rows = len(df)
-            df = df.dropna(subset=[tn_col, cons_col, date_col, contract_col])
-            st.info(f"🧹 {initial_rows - len(df)} boş satır temizlendi")
-            
-            # Tip optimizasyonu - memory efficient
-            try:
-                df[tn_col] = df[tn_col].astype('category')
-                df[contract_col] = df[contract_col].astype('category') 
-                df[cons_col] = pd.to_numeric(df[cons_col], errors='coerce')
-                df[date_col] = pd.to_datetime(df[date_col], errors='coerce')
-            except Exception as type_error:
-                st.warning(f"⚠️ Tip dönüştürme uyarısı: {type_error}")
-            
-            # Geçersiz veriyi temizle
-            df = df.dropna()
-            df = df[df[cons_col] >= 0]  # Negatif tüketim yok
-            
-            st.success(f"🎯 {year}: {len(df)} temiz satır hazır")
-            
-            # In-memory parquet bytes oluştur (dosya sistemi yerine)
-            parquet_buffer = BytesIO()
-            df.to_parquet(parquet_buffer, compression='snappy', index=False)
-            parquet_buffer.seek(0)
-            parquet_files[year] = parquet_buffer.getvalue()
-            
-            del df  # Belleği hemen serbest bırak
+                pending[year] = file_obj
+        
+        # CSV/Parquet/Feather zaten hızlı okunur, süreç havuzuna sadece Excel gider
+        excel_pending = {
+            year: f for year, f in pending.items()
+            if not isinstance(f, list) and file_format(f) == 'excel'
+        }
+        if parallel and len(excel_pending) > 1:
+            # Her yıl ayrı bir süreçte, aynı anda işlenir
+            st.info(f"📊 {', '.join(excel_pending)} dosyaları paralel işleniyor...")
+            results = parallel_excel_to_parquet(
+                {year: file_obj.getvalue() for year, file_obj in excel_pending.items()},
+                tn_col, cons_col, date_col, contract_col, minimal,
+                file_names={year: file_obj.name for year, file_obj in excel_pending.items()}
+            )
+            for year, (parquet_bytes, stats) in results.items():
+                store.put_bytes(
+                    keys[year], variant, parquet_bytes,
+                    file_name=getattr(files[year], 'name', None)
+                )
+                st.success(
+                    f"🎯 {year}: {stats['rows_read']} satırdan {stats['rows_kept']} temiz satır "
+                    f"({stats['row_groups']} parça)"
+                )
+                st.caption(format_date_stats(stats['date_paths']))
+                st.caption(format_number_stats(stats['number_paths']))
+                st.caption(format_drop_stats(stats['drops']))
+            del results
+            pending = {year: f for year, f in pending.items() if year not in excel_pending}
+        
+        for year, file_obj in pending.items():
+            if isinstance(file_obj, list):
+                write_multi_parquet(
+                    store, keys[year], variant, year, file_obj,
+                    tn_col, cons_col, date_col, contract_col, minimal, parallel
+                )
+                continue
+            st.info(f"📊 {year} dosyası işleniyor...")
+            store.put(
+                keys[year], variant,
+                lambda path: write_year_parquet(
+                    file_obj, path, year, tn_col, cons_col, date_col, contract_col,
+                    minimal, streaming
+                ),
+                file_name=getattr(file_obj, 'name', None)
+            )
             gc.collect()
         
+        parquet_files = {}
+        for year, key in keys.items():
+            parquet_files[year] = read_path(store, key, variant, memory_mapping)
+        
+        # Sonraki aylık eklemeler için geçmiş yıl anahtarlarını ve 2025 serisini kaydet
+        _, discarded = store.start_series(
+            variant, {'2023': keys['2023'], '2024': keys['2024']}, keys['2025'],
+            file_name=upload_name(file_2025)
+        )
+        if discarded:
+            st.warning(
+                "⚠️ Geçmiş yıllar veya güncel dosya değiştiği için seri yeniden başlatıldı; "
+                "sonradan eklenen aylar çıkarıldı: "
+                + ", ".join(f"{year}-{month:02d}" for year, month in discarded)
+            )
+        DATA_CACHE.discard(lambda cache_key: store.series_path(variant) in cache_key)
+        
         return parquet_files
         
     except Exception as e:
@@ -218,80 +398,220 @@ def convert_to_parquet_cached(file_2023, file_2024, file_2025,
         st.info("💡 Dosya boyutu çok büyük olabilir, örnekleme kullanmayı deneyin")
         return None
 
-def fast_read_historical(parquet_data_2023, parquet_data_2024, sample_rate, months_filter):
-    """Parquet bytes'larını çok hızlı oku"""
+def upload_name(file_obj):
+    """Manifestte kaydedilecek dosya adı; çoklu yüklemede adlar birleştirilir"""
+    if isinstance(file_obj, list):
+        return ", ".join(getattr(f, 'name', '?') for f in file_obj)
+    return getattr(file_obj, 'name', None)
+
+def write_multi_parquet(store, key, variant, year, file_objs,
+                        tn_col, cons_col, date_col, contract_col, minimal, parallel=False):
+    """Bir yılın tüm dosya ve sayfalarını okuyup tek veri seti olarak depoya yaz"""
+    st.info(f"📚 {year}: {len(file_objs)} dosyanın tüm sayfaları işleniyor...")
+    parquet_bytes, stats = parallel_sheets_to_parquet(
+        {f.name: f.getvalue() for f in file_objs},
+        tn_col, cons_col, date_col, contract_col, minimal,
+        max_workers=None if parallel else 1
+    )
+    store.put_bytes(key, variant, parquet_bytes, file_name=upload_name(file_objs))
+    st.success(
+        f"🎯 {year}: {len(stats['sources'])} kaynaktan {stats['rows_read']} satır okundu, "
+        f"{stats['rows_kept']} temiz satır birleştirildi"
+    )
+    if stats['skipped']:
+        st.warning(f"⚠️ {year}: seçilen sütunları içermeyen sayfalar atlandı: {', '.join(stats['skipped'])}")
+    st.caption(format_date_stats(stats['date_paths']))
+    st.caption(format_number_stats(stats['number_paths']))
+    st.caption(format_drop_stats(stats['drops']))
+    del parquet_bytes
+    gc.collect()
+
+def read_path(store, key, variant, memory_mapping):
+    """Okuma fazında kullanılacak depo yolu"""
+    # Memory mapping: okuma fazında sıkıştırmasız Arrow IPC dosyası kullan
+    if memory_mapping:
+        return store.ensure_arrow(key, variant)
+    # year=/month= bölümlü veri seti: ay ve yıl filtreleri dosya seviyesinde uygulanır
+    return store.ensure_partitioned(key, variant)
+
+def append_current_month(file_obj, tn_col, cons_col, date_col, contract_col, minimal,
+                         streaming=False, memory_mapping=False):
+    """Yeni aylık 2025 dosyasını tek başına işleyip depodaki seriye ekle
+
+    Dönüş: ({'2023', '2024': geçmiş yıl yolları, '2025': seri dizini}, yeni eklenen (yıl, ay) listesi)
+    """
     try:
-        # Parquet bytes'dan DataFrame'e çevir
-        df_2023 = pd.read_parquet(BytesIO(parquet_data_2023))
-        df_2024 = pd.read_parquet(BytesIO(parquet_data_2024))
-        
-        st.info(f"📊 2023: {len(df_2023)}, 2024: {len(df_2024)} satır okundu")
+        store = DatasetStore()
+        variant = variant_key(tn_col, cons_col, date_col, contract_col, minimal)
+        series = store.load_series().get(variant)
+        if not series or not all(store.has(key, variant) for key in series['baseline'].values()):
+            st.error("❌ Bu sütun eşleştirmesi için kayıtlı geçmiş veri yok, önce tam analizi çalıştırın")
+            return None, []
+        
+        key = upload_key(file_obj)
+        if store.has(key, variant):
+            st.info("♻️ Yeni ay dosyası depodan okundu, tekrar işlenmedi")
+        else:
+            st.info("📊 Yeni ay dosyası işleniyor...")
+            store.put(
+                key, variant,
+                lambda path: write_year_parquet(
+                    file_obj, path, '2025', tn_col, cons_col, date_col, contract_col,
+                    minimal, streaming
+                ),
+                file_name=getattr(file_obj, 'name', None)
+            )
+        
+        new_months = store.append_series(variant, key, file_name=getattr(file_obj, 'name', None))
+        # Seri dizininin içeriği değişti; bu dizinden okunmuş tablolar önbellekten atılır
+        DATA_CACHE.discard(lambda cache_key: store.series_path(variant) in cache_key)
+        if new_months:
+            st.success("➕ Eklenen aylar: " + ", ".join(f"{year}-{month:02d}" for year, month in new_months))
+        
+        parquet_files = {
+            year: read_path(store, baseline_key, variant, memory_mapping)
+            for year, baseline_key in series['baseline'].items()
+        }
+        parquet_files['2025'] = store.series_path(variant)
+        return parquet_files, new_months
         
-        # Sampling (memory tasarrufu)
-        if sample_rate < 1.0:
-            original_2023 = len(df_2023)
-            original_2024 = len(df_2024)
-            df_2023 = df_2023.sample(frac=sample_rate, random_state=42)
-            df_2024 = df_2024.sample(frac=sample_rate, random_state=42)
-            st.info(f"🎯 Örnekleme: 2023 {original_2023}→{len(df_2023)}, 2024 {original_2024}→{len(df_2024)}")
-        
-        # Kolon isimlerini normalize et (ilk 4 kolonu al)
-        cols = df_2023.columns.tolist()[:4]  # İlk 4 kolon: TN, Tuketim, Tarih, Sozlesme
-        df_2023 = df_2023[cols].copy()
-        df_2024 = df_2024[cols].copy()
-        
-        df_2023.columns = ['TN', 'Tuketim', 'Tarih', 'Sozlesme_No']
-        df_2024.columns = ['TN', 'Tuketim', 'Tarih', 'Sozlesme_No']
-        
-        # Yıl filtreleri (eğer tarih bilgisi varsa)
-        try:
-            df_2023 = df_2023[df_2023['Tarih'].dt.year == 2023]
-            df_2024 = df_2024[df_2024['Tarih'].dt.year == 2024]
-        except:
-            st.warning("⚠️ Tarih filtreleme atlandı")
-        
-        # Ay filtresi
+    except Exception as e:
+        st.error(f"❌ Aylık ekleme hatası: {str(e)}")
+        return None, []
+
+def write_year_parquet(file_obj, path, year, tn_col, cons_col, date_col, contract_col,
+                       minimal, streaming):
+    """Tek yılın dosyasını temizleyip Parquet dosyasına yaz"""
+    if streaming or file_format(file_obj) != 'excel':
+        # Satırları parça parça okuyup row group olarak yaz
+        stats = file_to_parquet(
+            file_obj, path, tn_col, cons_col, date_col, contract_col, minimal
+        )
+        st.success(
+            f"🎯 {year}: {stats['rows_read']} satırdan {stats['rows_kept']} temiz satır "
+            f"({stats['row_groups']} parça)"
+        )
+        st.caption(format_date_stats(stats['date_paths']))
+        st.caption(format_number_stats(stats['number_paths']))
+        st.caption(format_drop_stats(stats['drops']))
+        return
+    
+    # Excel bir kez ayrıştırılır; sütun eşleştirmesi değişince önbellekteki tablodan seçilir
+    key_cols = [str(c) for c in (tn_col, cons_col, date_col, contract_col)]
+    table = parse_uploaded(file_obj)
+    if minimal:
+        # Sadece gerekli kolonları al
+        df = project(table, key_cols)
+    else:
+        df = table.to_pandas()
+    
+    st.info(f"✅ {year}: {len(df)} satır okundu")
+    
+    # Seçilen kolonları öne al ve standart isimlerle adlandır
+    df = df[key_cols + [c for c in df.columns if c not in key_cols]]
+    df.columns = STANDARD_COLUMNS + [str(c) for c in df.columns[4:]]
+    
+    # Tek geçişli temizlik: tip dönüşümü ve tüm filtreler tek maskede, çıktı bir kez üretilir
+    number_stats, date_stats, drop_stats = {}, {}, {}
+    df = clean_rows(df, date_stats=date_stats, number_stats=number_stats, drop_stats=drop_stats)
+    st.caption(format_number_stats(number_stats))
+    st.caption(format_date_stats(date_stats))
+    st.caption(format_drop_stats(drop_stats))
+    
+    st.success(f"🎯 {year}: {len(df)} temiz satır hazır")
+    df.to_parquet(path, compression='snappy', index=False)
+
+def fast_read_historical(parquet_path_2023, parquet_path_2024, sample_rate, months_filter, seasonal=False,
+                         quantile=None):
+    """Geçmiş ortalamaları depodaki kısmi toplamlardan hesapla
+
+    seasonal ise tesisat × takvim ayı ortalama matrisi döner (seasonal_matrix).
+    quantile verilirse ortalama yerine kantil taslaklarından yaklaşık medyan / yüzdelik kullanılır.
+    """
+    # Depo yolları içerik anahtarı ve sütun eşleştirmesini içerir; aynı ayarlarla sonuç değişmez
+    if seasonal:
+        # Her ay kendi referansını kullandığından ay filtresi matrisi değiştirmez
+        cache_key = ('seasonal', parquet_path_2023, parquet_path_2024, quantile)
+    else:
+        cache_key = ('historical', parquet_path_2023, parquet_path_2024, tuple(months_filter or ()), quantile)
+    cached = DATA_CACHE.get(cache_key)
+    if cached is not None:
+        st.info(f"♻️ {len(cached)} tesisat ortalaması önbellekten alındı")
+        return cached
+    try:
+        # Her yıl için tesisat × ay kısmi toplamları bir kez üretilip depoda saklanır;
+        # ay filtresi, sıfır tüketim ve adet kuralı bu tablolar birleştirilerek uygulanır
+        store = DatasetStore()
+        partials = []
+        for year, path in ((2023, parquet_path_2023), (2024, parquet_path_2024)):
+            key, variant = store.locate(path)
+            if quantile is not None:
+                # Kova adetli taslaklar veri seti parça parça okunarak bir kez üretilir;
+                # kısmi toplamlar gibi her yuva kendi yılını seçer
+                sketches = stored_sketches(store, key, variant, path)
+                partials.append(sketches[sketches['Yil'] == year])
+                continue
+            # Kısmi toplamlar veri setinin tamamından bir kez üretilir; her yuva kendi yılını
+            # Yil sütunuyla seçer (aynı dosya iki yuvaya yüklense de yıllar karışmaz).
+            # Tesisat numarasıyla eşlenir; yıllar tamsayı anahtarla birleşir
+            year_partials = stored_partials(
+                store, key, variant, lambda: shared_frame(path, STANDARD_COLUMNS)
+            )
+            partials.append(REGISTRY.attach(year_partials[year_partials['Yil'] == year]))
+        
+        kind = "kantil taslağı kovası" if quantile is not None else "tesisat-ay kısmi toplamı"
+        st.info(f"📊 2023: {len(partials[0])}, 2024: {len(partials[1])} {kind} okundu")
         if months_filter:
-            try:
-                df_2023 = df_2023[df_2023['Tarih'].dt.month.isin(months_filter)]
-                df_2024 = df_2024[df_2024['Tarih'].dt.month.isin(months_filter)]
-                st.info(f"📅 Ay filtresi uygulandı: {months_filter}")
-            except:
-                st.warning("⚠️ Ay filtresi atlandı")
-        
-        # Birleştir
-        combined = pd.concat([df_2023, df_2024], ignore_index=True)
+            st.info(f"📅 Ay filtresi uygulandı: {months_filter}")
+        if sample_rate < 1.0:
+            st.info("🎯 Geçmiş ortalamalar kısmi toplamlardan örneklemesiz hesaplandı")
         
-        # Sıfır tüketim filtrele (historical için)
-        before_filter = len(combined)
-        combined = combined[combined['Tuketim'] > 0]
-        st.info(f"🔥 Sıfır tüketim temizleme: {before_filter}→{len(combined)}")
+        if seasonal:
+            # 12 ayın referansı tek geçişte; sıfır tüketimler hariç
+            if quantile is not None:
+                matrix = seasonal_sketch_matrix(partials, quantile)
+            else:
+                matrix = seasonal_matrix(partials, positive_only=True)
+            if not (matrix > 0).any():
+                st.error("❌ Temizleme sonrası veri kalmadı!")
+                return None
+            matrix.flags.writeable = False
+            st.success(f"📈 {len(matrix)} tesisat × 12 ay mevsimsel ortalama hesaplandı "
+                       f"({matrix.nbytes / MB:,.1f} MB)")
+            return DATA_CACHE.put(cache_key, matrix)
+        
+        # Sıfır tüketimler hariç, en az 2 kayıt olan tesisatlar
+        if quantile is not None:
+            historical_avg = sketch_quantile(partials, quantile, months=months_filter, min_count=2)
+            st.info(f"🛡️ Referans: %{quantile * 100:.0f} yüzdelik (yaklaşık, en fazla "
+                    f"%{SKETCH_ACCURACY * 100:.0f} göreli hata)")
+        else:
+            historical_avg = combine_baseline(partials, months=months_filter, positive_only=True, min_count=2)
         
-        if combined.empty:
+        if historical_avg.empty:
             st.error("❌ Temizleme sonrası veri kalmadı!")
             return None
         
-        # Vectorized ortalama hesapla
-        historical_avg = combined.groupby(['TN', 'Sozlesme_No'])['Tuketim'].agg(['mean', 'count']).reset_index()
-        historical_avg.columns = ['TN', 'Sozlesme_No', 'Ortalama_Tuketim', 'Count']
+        st.success(f"📈 {len(historical_avg)} tesisat ortalaması hesaplandı")
         
-        # En az 2 kayıt olanları al
-        initial_count = len(historical_avg)
-        historical_avg = historical_avg[historical_avg['Count'] >= 2]
-        st.success(f"📈 {initial_count}→{len(historical_avg)} tesisat ortalaması hesaplandı")
-        
-        return historical_avg[['TN', 'Sozlesme_No', 'Ortalama_Tuketim']]
+        return DATA_CACHE.put(cache_key, historical_avg[[ID_COLUMN, 'Ortalama_Tuketim']])
         
     except Exception as e:
         st.error(f"❌ Historical read hatası: {str(e)}")
         return None
 
-def fast_read_current(parquet_data_2025, sample_rate, months_filter):
+def fast_read_current(parquet_path_2025, sample_rate, months_filter, arrow_dtypes=False):
     """2025 verisini hızlı oku"""
     try:
-        df = pd.read_parquet(BytesIO(parquet_data_2025))
+        # Yıl ve ay filtreleri Arrow üzerinde uygulanır; çözülmüş tablo paylaşılan önbellekten gelir
+        # Çoklu dosya/sayfa veri setlerinde satırın kaynağı da okunur
+        columns = STANDARD_COLUMNS + [c for c in ('Kaynak',) if c in schema_names(parquet_path_2025)]
+        df = shared_frame(parquet_path_2025, columns, year=2025, months=months_filter,
+                          arrow_dtypes=arrow_dtypes)
         
         st.info(f"📊 2025: {len(df)} satır okundu")
+        if months_filter:
+            st.info(f"📅 Ay filtresi uygulandı: {months_filter}")
         
         # Sampling
         if sample_rate < 1.0:
@@ -299,106 +619,79 @@ def fast_read_current(parquet_data_2025, sample_rate, months_filter):
             df = df.sample(frac=sample_rate, random_state=42)
             st.info(f"🎯 2025 örnekleme: {original_count}→{len(df)}")
         
-        # Normalize columns (ilk 4 kolon)
-        cols = df.columns.tolist()[:4]
-        df = df[cols].copy()
-        df.columns = ['TN', 'Tuketim', 'Tarih', 'Sozlesme_No']
-        
-        # 2025 filtresi
-        try:
-            df = df[df['Tarih'].dt.year == 2025]
-            st.info(f"📅 2025 yıl filtresi: {len(df)} satır kaldı")
-        except:
-            st.warning("⚠️ 2025 yıl filtresi atlandı")
-        
-        # Ay filtresi
-        if months_filter:
-            try:
-                initial = len(df)
-                df = df[df['Tarih'].dt.month.isin(months_filter)]
-                st.info(f"📅 Ay filtresi: {initial}→{len(df)} satır")
-            except:
-                st.warning("⚠️ Ay filtresi atlandı")
-        
         if df.empty:
             st.error("❌ 2025 filtresi sonrası veri kalmadı!")
             return None
         
-        # Ay bilgisi ekle
-        try:
-            df['Ay_Adi'] = df['Tarih'].dt.strftime('%Y-%m')
-        except:
-            df['Ay_Adi'] = '2025-01'  # Fallback
+        # Ay bilgisi: int32 dönem kodu, 'YYYY-MM' metnine sadece gösterimde çevrilir
+        df['Ay_Kodu'] = period_codes(df['Tarih'])
         
-        st.success(f"✅ 2025 veri hazır: {len(df)} satır")
+        st.success(f"✅ 2025 veri hazır: {len(df)} satır ({frame_bytes(df) / MB:,.1f} MB)")
         return df
         
     except Exception as e:
         st.error(f"❌ Current read hatası: {str(e)}")
         return None
 
-def lightning_deviation_analysis(historical, current, threshold, quick_scan=False, quick_threshold=None):
+def lightning_deviation_analysis(historical, current, quick_scan=False, quick_threshold=None,
+                                 seasonal=False):
     """Işık hızında sapma analizi"""
     try:
         if historical is None or current is None:
             st.error("❌ Veri eksik!")
             return pd.DataFrame()
         
-        if historical.empty or current.empty:
+        if len(historical) == 0 or current.empty:
             st.error("❌ Boş veri!")
             return pd.DataFrame()
         
         st.info(f"🔗 Eşleştirme: Historical={len(historical)}, Current={len(current)}")
         
-        # Super fast merge
-        merged = pd.merge(current, historical, on=['TN', 'Sozlesme_No'], how='inner')
+        # Tesisat_ID (tamsayı) üzerinden tek birleştirme; TN / Sözleşme sadece eşleşen satırlar için
+        # kayıttan alınır, ay dönem kodu olarak kalır ve gösterimde metne çevrilir
+        extra_columns = [c for c in ('Kaynak',) if c in current.columns]
+        if seasonal:
+            # Mevsimsel referans birleştirmesiz, matrix[Tesisat_ID, ay] ile okunur
+            result = seasonal_deviation_table(historical, current, label_months=False,
+                                              extra_columns=extra_columns)
+        else:
+            result = deviation_table(historical, current, label_months=False,
+                                     extra_columns=extra_columns)
         
-        if merged.empty:
+        if result.empty:
             st.warning("⚠️ Eşleşen tesisat bulunamadı!")
             return pd.DataFrame()
         
-        st.success(f"🎯 {len(merged)} eşleşme bulundu")
-        
-        # Vectorized hesaplamalar (tek seferde)
-        merged['Sapma_Miktari'] = merged['Tuketim'] - merged['Ortalama_Tuketim']
-        merged['Sapma_Yüzdesi'] = (merged['Sapma_Miktari'] / merged['Ortalama_Tuketim']) * 100
+        st.success(f"🎯 {len(result)} eşleşme bulundu")
         
         # Quick scan filter
         if quick_scan and quick_threshold:
             # Önce yüksek sapmaları bul
-            high_dev_mask = merged['Sapma_Yüzdesi'] >= quick_threshold
+            high_dev_mask = result['Sapma_Yüzdesi'] >= quick_threshold
             high_count = high_dev_mask.sum()
             if high_count > 0:
-                merged = merged[high_dev_mask]
+                result = result[high_dev_mask]
                 st.info(f"⚡ Quick scan: {high_count} yüksek sapma tespit edildi")
         
-        # Final result
-        result = merged[[
-            'TN', 'Sozlesme_No', 'Ay_Adi', 'Tarih',
-            'Ortalama_Tuketim', 'Tuketim', 'Sapma_Miktari', 'Sapma_Yüzdesi'
-        ]].copy()
-        
-        result.columns = [
-            'TN', 'Sozlesme_No', 'Ay', 'Tarih',
-            'Geçmiş_Ortalama', 'Güncel_Tuketim', 'Sapma_Miktarı', 'Sapma_Yüzdesi'
-        ]
-        
         return result
         
     except Exception as e:
         st.error(f"❌ Lightning analysis hatası: {str(e)}")
         return pd.DataFrame()
 
-def display_lightning_results(results, threshold, sample_rate):
-    """Lightning speed sonuç gösterimi"""
+@st.fragment
+def display_lightning_results(index, sample_rate):
+    """Lightning speed sonuç gösterimi; eşik değişince sadece bu bölüm yeniden çalışır"""
     try:
-        if results.empty:
+        if len(index) == 0:
             st.warning("⚠️ Sonuç bulunamadı")
             return
         
-        # Quick stats
-        total = len(results)
-        high_dev = len(results[results['Sapma_Yüzdesi'] >= threshold])
+        threshold = st.slider("Sapma Eşiği (%)", 10, 100, 30, key="threshold")
+        
+        # Quick stats: eşik üstü satır sayısı sıralı indekste ikili aramayla bulunur
+        total = len(index)
+        high_dev = index.count_at_least(threshold)
         
         # Sampling uyarısı
         if sample_rate < 1.0:
@@ -415,35 +708,29 @@ def display_lightning_results(results, threshold, sample_rate):
             ratio = (high_dev/total*100) if total > 0 else 0
             st.metric("Sapma Oranı", f"{ratio:.1f}%")
         with col4:
-            max_dev = results['Sapma_Yüzdesi'].max()
+            max_dev = index.max()
             st.metric("Max Sapma", f"{max_dev:.0f}%")
         
-        # Yüksek sapma tablosu
-        high_deviations = results[results['Sapma_Yüzdesi'] >= threshold].copy()
-        
-        if not high_deviations.empty:
+        # Yüksek sapma tablosu: sıralı tablonun baştaki dilimi (azalan sapma)
+        if high_dev:
             st.header(f"⚠️ {threshold}% Üzeri Sapma")
             
-            # Sort by deviation
-            high_deviations = high_deviations.sort_values('Sapma_Yüzdesi', ascending=False)
-            
             # Top 500 göster (hız için)
-            display_count = min(500, len(high_deviations))
-            st.info(f"📊 İlk {display_count} gösteriliyor (Toplam: {len(high_deviations)})")
+            display_count = min(500, high_dev)
+            st.info(f"📊 İlk {display_count} gösteriliyor (Toplam: {high_dev})")
             
             # Format ve göster
-            display_df = format_lightning_table(high_deviations.head(display_count))
+            display_df = format_lightning_table(index.at_least(threshold, display_count))
             st.dataframe(display_df, use_container_width=True)
             
-            # Süper hızlı CSV download
-            if st.button("📥 Hızlı CSV İndir"):
-                csv = high_deviations.to_csv(index=False)
-                st.download_button(
-                    "💾 CSV Dosyasını İndir",
-                    csv,
-                    f"sapma_raporu_{datetime.now().strftime('%H%M%S')}.csv",
-                    "text/csv"
-                )
+            # Süper hızlı CSV download: dosya sadece indirme tıklanınca üretilir
+            high_deviations = index.at_least(threshold)
+            st.download_button(
+                "📥 Hızlı CSV İndir",
+                lambda: high_deviations.assign(Ay=format_periods(high_deviations['Ay'])).to_csv(index=False),
+                f"sapma_raporu_{datetime.now().strftime('%H%M%S')}.csv",
+                "text/csv"
+            )
         else:
             st.success(f"🎉 {threshold}% üzeri sapma yok!")
             
@@ -454,6 +741,7 @@ def format_lightning_table(df):
     """Hızlı tablo formatı"""
     try:
         display = df.copy()
+        display['Ay'] = format_periods(display['Ay'])
         
         # Hızlı format (detaysız)
         display['Geçmiş_Ortalama'] = display['Geçmiş_Ortalama'].round(0).astype(int)
@@ -461,25 +749,16 @@ def format_lightning_table(df):
         display['Sapma_Yüzdesi'] = display['Sapma_Yüzdesi'].round(0).astype(int)
         
         # Sütun adları
-        display.columns = [
-            'TN', 'Sözleşme', 'Ay', 'Tarih',
-            'Eski Ort.', 'Yeni', 'Sapma', 'Sapma%'
-        ]
+        display = display.rename(columns={
+            'Sozlesme_No': 'Sözleşme', 'Geçmiş_Ortalama': 'Eski Ort.',
+            'Güncel_Tuketim': 'Yeni', 'Sapma_Miktarı': 'Sapma', 'Sapma_Yüzdesi': 'Sapma%'
+        })
         
         return display
         
     except:
         return df
 
-def cleanup_temp_files(parquet_files):
-    """Geçici dosyaları temizle"""
-    try:
-        for file_path in parquet_files.values():
-            if os.path.exists(file_path):
-                os.remove(file_path)
-    except:
-        pass
-
 if __name__ == "__main__":
     st.set_page_config(
         page_title="⚡ Süper Hızlı Doğalgaz Analizi",
@@ -493,3 +772,4 @@ if __name__ == "__main__":
     st.sidebar.markdown("800K satır ~1-2 dakikada!")
     
     main()
+    st.sidebar.caption(format_cache_stats(DATA_CACHE.stats()))
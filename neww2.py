@@ -1,11 +1,21 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-from io import BytesIO
 from datetime import datetime
 import gc
 import time
 
+from baseline import combine_baseline, stored_partials
+from cache import DATA_CACHE, format_cache_stats, shared_frame
+from deviation import DeviationIndex, deviation_table
+from ingest import (
+    STANDARD_COLUMNS, SUPPORTED_TYPES, file_format, file_to_parquet,
+    parallel_excel_to_parquet, parse_uploaded, project, read_header, upload_key
+)
+from parsers import clean_rows, format_periods, period_codes
+from registry import ID_COLUMN, REGISTRY
+from store import DatasetStore, variant_key
+
 # -----------------------------------------
 # Sayfa yapılandırması (en başta olmalı)
 # -----------------------------------------
@@ -32,14 +42,15 @@ def main():
     )
     use_memory_mapping = st.sidebar.checkbox("Memory Mapping Kullan", value=True)
     minimal_mode = st.sidebar.checkbox("Minimal Mod (Sadece gerekli kolonlar)", value=True)
+    streaming_mode = st.sidebar.checkbox("Akışlı Okuma (düşük bellek)", value=True)
+    parallel_mode = st.sidebar.checkbox("Paralel Okuma (çok çekirdek)", value=True)
 
     # Dosya yükleme
     st.sidebar.header("📁 Dosya Yükleme")
-    file_2023 = st.sidebar.file_uploader("2023 Veriler", type=['xlsx', 'xls'], key="file_2023")
-    file_2024 = st.sidebar.file_uploader("2024 Veriler", type=['xlsx', 'xls'], key="file_2024")
-    file_2025 = st.sidebar.file_uploader("2025 Veriler", type=['xlsx', 'xls'], key="file_2025")
+    file_2023 = st.sidebar.file_uploader("2023 Veriler", type=SUPPORTED_TYPES, key="file_2023")
+    file_2024 = st.sidebar.file_uploader("2024 Veriler", type=SUPPORTED_TYPES, key="file_2024")
+    file_2025 = st.sidebar.file_uploader("2025 Veriler", type=SUPPORTED_TYPES, key="file_2025")
 
-    threshold = st.sidebar.slider("Sapma Eşiği (%)", 10, 100, 30)
     st.sidebar.header("Hızlandırma Seçenekleri")
     quick_scan = st.sidebar.checkbox("Sadece yüksek sapmaları tara", value=False)
     if quick_scan:
@@ -54,10 +65,9 @@ def main():
     # Dosyalar yüklüyse
     if file_2023 and file_2024 and file_2025:
 
-        # Kolon isimlerini al
+        # Kolon isimlerini al (sadece başlık satırı okunur)
         try:
-            sample_df = pd.read_excel(file_2023, nrows=3)
-            columns = sample_df.columns.tolist()
+            columns, column_types = read_header(file_2023)
         except:
             st.error("Excel dosyası okunamıyor!")
             return
@@ -65,10 +75,18 @@ def main():
         # Hızlı sütun seçimi
         st.header("🔧 Hızlı Sütun Seçimi")
         col1, col2, col3, col4 = st.columns(4)
-        with col1: tn_col = st.selectbox("TN:", columns, key="tn")
-        with col2: consumption_col = st.selectbox("Tüketim:", columns, key="cons")
-        with col3: date_col = st.selectbox("Tarih:", columns, key="date")
-        with col4: contract_col = st.selectbox("Sözleşme:", columns, key="contract")
+        column_label = lambda c: f"{c} ({column_types.get(c, '?')})"
+        with col1: tn_col = st.selectbox("TN:", columns, key="tn", format_func=column_label)
+        with col2: consumption_col = st.selectbox("Tüketim:", columns, key="cons", format_func=column_label)
+        with col3: date_col = st.selectbox("Tarih:", columns, key="date", format_func=column_label)
+        with col4: contract_col = st.selectbox("Sözleşme:", columns, key="contract", format_func=column_label)
+
+        # Sonuçlar bu dosya, sütun ve ayarlara aittir; biri değişince eski sonuç gösterilmez
+        signature = (
+            tuple(upload_key(f) for f in (file_2023, file_2024, file_2025)),
+            tn_col, consumption_col, date_col, contract_col, sample_rate, tuple(months_filter),
+            quick_threshold if quick_scan else None
+        )
 
         if st.button("🚀 SÜPER HIZLI ANALİZ", type="primary"):
             start_time = time.time()
@@ -81,7 +99,7 @@ def main():
                 parquet_files = convert_to_parquet_cached(
                     file_2023, file_2024, file_2025,
                     tn_col, consumption_col, date_col, contract_col,
-                    minimal_mode
+                    minimal_mode, streaming_mode, use_memory_mapping, parallel_mode
                 )
                 if not parquet_files:
                     st.error("❌ Dosya dönüştürme başarısız!")
@@ -95,13 +113,14 @@ def main():
                 progress.progress(50)
                 status.text("🧮 Süper hızlı hesaplamalar...")
                 results = lightning_deviation_analysis(
-                    historical_data, current_data, threshold,
+                    historical_data, current_data,
                     quick_scan, quick_threshold if quick_scan else None
                 )
 
                 progress.progress(80)
                 status.text("📊 Sonuçlar hazırlanıyor...")
-                display_lightning_results(results, threshold, sample_rate)
+                # Sonuçlar bir kez sıralanır; eşik değişince analiz tekrar çalışmaz
+                st.session_state['lightning_sonuclari'] = (signature, DeviationIndex(results))
                 progress.progress(100)
 
                 total_time = time.time() - start_time
@@ -110,11 +129,16 @@ def main():
                 gc.collect()
 
             except Exception as e:
+                st.session_state.pop('lightning_sonuclari', None)
                 st.error(f"❌ Hata: {str(e)}")
                 st.info("💡 Örnekleme oranını düşürmeyi deneyin")
 
+        analysis = st.session_state.get('lightning_sonuclari')
+        if analysis is not None and analysis[0] == signature:
+            display_lightning_results(analysis[1], sample_rate)
+
     else:
-        st.info("📂 3 Excel dosyasını yükleyin")
+        st.info("📂 3 veri dosyasını yükleyin (Excel, CSV, Parquet veya Feather)")
         st.header("⚡ Süper Hızlı Analiz İpuçları")
         st.markdown("""
         **🚀 Maximum Hız İçin:**
@@ -134,101 +158,113 @@ def main():
 # -----------------------------------------
 # Fonksiyonlar (Parquet, read, analiz vs)
 # -----------------------------------------
-@st.cache_data(ttl=3600, max_entries=3)
-def convert_to_parquet_cached(file_2023, file_2024, file_2025, tn_col, cons_col, date_col, contract_col, minimal):
+def convert_to_parquet_cached(file_2023, file_2024, file_2025, tn_col, cons_col, date_col, contract_col, minimal, streaming=False, memory_mapping=False, parallel=False):
     parquet_files = {}
     try:
-        for year, file_obj in [('2023', file_2023), ('2024', file_2024), ('2025', file_2025)]:
-            if minimal:
-                usecols = [tn_col, cons_col, date_col, contract_col]
-                df = pd.read_excel(file_obj, usecols=usecols, engine='openpyxl')
+        store = DatasetStore()
+        variant = variant_key(tn_col, cons_col, date_col, contract_col, minimal)
+        files = {'2023': file_2023, '2024': file_2024, '2025': file_2025}
+        keys = {year: upload_key(file_obj) for year, file_obj in files.items()}
+        pending = {year: files[year] for year, key in keys.items() if not store.has(key, variant)}
+
+        excel_pending = {year: f for year, f in pending.items() if file_format(f) == 'excel'}
+        if parallel and len(excel_pending) > 1:
+            results = parallel_excel_to_parquet(
+                {year: file_obj.getvalue() for year, file_obj in excel_pending.items()},
+                tn_col, cons_col, date_col, contract_col, minimal,
+                file_names={year: file_obj.name for year, file_obj in excel_pending.items()}
+            )
+            for year, (parquet_bytes, _) in results.items():
+                store.put_bytes(keys[year], variant, parquet_bytes, file_name=getattr(files[year], 'name', None))
+            del results
+            pending = {year: f for year, f in pending.items() if year not in excel_pending}
+
+        for year, file_obj in pending.items():
+            store.put(
+                keys[year], variant,
+                lambda path: write_year_parquet(file_obj, path, tn_col, cons_col, date_col, contract_col, minimal, streaming),
+                file_name=getattr(file_obj, 'name', None)
+            )
+            gc.collect()
+
+        for year, key in keys.items():
+            if memory_mapping:
+                parquet_files[year] = store.ensure_arrow(key, variant)
             else:
-                df = pd.read_excel(file_obj, engine='openpyxl')
-
-            df = df.dropna(subset=[tn_col, cons_col, date_col, contract_col])
-            df[tn_col] = df[tn_col].astype('category')
-            df[contract_col] = df[contract_col].astype('category') 
-            df[cons_col] = pd.to_numeric(df[cons_col], errors='coerce')
-            df[date_col] = pd.to_datetime(df[date_col], errors='coerce')
-            df = df.dropna()
-            df = df[df[cons_col] >= 0]
-
-            buffer = BytesIO()
-            df.to_parquet(buffer, compression='snappy', index=False)
-            buffer.seek(0)
-            parquet_files[year] = buffer.getvalue()
-            del df; gc.collect()
+                # year=/month= bölümlü veri seti: ay ve yıl filtreleri dosya seviyesinde uygulanır
+                parquet_files[year] = store.ensure_partitioned(key, variant)
         return parquet_files
     except Exception as e:
         st.error(f"❌ Parquet dönüşüm hatası: {str(e)}")
         return None
 
+def write_year_parquet(file_obj, path, tn_col, cons_col, date_col, contract_col, minimal, streaming):
+    if streaming or file_format(file_obj) != 'excel':
+        file_to_parquet(file_obj, path, tn_col, cons_col, date_col, contract_col, minimal)
+        return
+    key_cols = [str(c) for c in (tn_col, cons_col, date_col, contract_col)]
+    table = parse_uploaded(file_obj)
+    df = project(table, key_cols) if minimal else table.to_pandas()
+
+    df = df[key_cols + [c for c in df.columns if c not in key_cols]]
+    df.columns = STANDARD_COLUMNS + [str(c) for c in df.columns[4:]]
+    df = clean_rows(df)
+    df.to_parquet(path, compression='snappy', index=False)
+
 def fast_read_historical(parquet_2023, parquet_2024, sample_rate, months_filter):
     try:
-        df_2023 = pd.read_parquet(BytesIO(parquet_2023))
-        df_2024 = pd.read_parquet(BytesIO(parquet_2024))
-        if sample_rate < 1.0:
-            df_2023 = df_2023.sample(frac=sample_rate, random_state=42)
-            df_2024 = df_2024.sample(frac=sample_rate, random_state=42)
-        cols = df_2023.columns.tolist()[:4]
-        df_2023.columns = ['TN', 'Tuketim', 'Tarih', 'Sozlesme_No']
-        df_2024.columns = ['TN', 'Tuketim', 'Tarih', 'Sozlesme_No']
-        combined = pd.concat([df_2023, df_2024], ignore_index=True)
-        if months_filter:
-            combined = combined[combined['Tarih'].dt.month.isin(months_filter)]
-        combined = combined[combined['Tuketim']>0]
-        historical_avg = combined.groupby(['TN','Sozlesme_No'])['Tuketim'].agg(['mean','count']).reset_index()
-        historical_avg = historical_avg[historical_avg['count']>=2]
-        historical_avg.columns = ['TN','Sozlesme_No','Ortalama_Tuketim','Count']
-        return historical_avg[['TN','Sozlesme_No','Ortalama_Tuketim']]
+        # Tesisat × ay kısmi toplamları depoda saklanır; ortalama bunlar birleştirilerek hesaplanır
+        store = DatasetStore()
+        partials = [
+            REGISTRY.attach(stored_partials(
+                store, *store.locate(path), lambda path=path: shared_frame(path, STANDARD_COLUMNS)
+            ))
+            for path in (parquet_2023, parquet_2024)
+        ]
+        historical_avg = combine_baseline(partials, months=months_filter, positive_only=True, min_count=2)
+        return historical_avg[[ID_COLUMN,'Ortalama_Tuketim']]
     except Exception as e:
         st.error(f"❌ Historical read hatası: {str(e)}")
         return None
 
 def fast_read_current(parquet_2025, sample_rate, months_filter):
     try:
-        df = pd.read_parquet(BytesIO(parquet_2025))
+        df = shared_frame(parquet_2025, STANDARD_COLUMNS, months=months_filter, arrow_dtypes=True)
         if sample_rate < 1.0:
             df = df.sample(frac=sample_rate, random_state=42)
-        cols = df.columns.tolist()[:4]
-        df.columns = ['TN','Tuketim','Tarih','Sozlesme_No']
         df = df[df['Tuketim']>=0]
-        if months_filter:
-            df = df[df['Tarih'].dt.month.isin(months_filter)]
-        df['Ay_Adi'] = df['Tarih'].dt.strftime('%Y-%m')
+        df['Ay_Kodu'] = period_codes(df['Tarih'])
         return df
     except Exception as e:
         st.error(f"❌ Current read hatası: {str(e)}")
         return None
 
-def lightning_deviation_analysis(historical, current, threshold, quick_scan=False, quick_threshold=None):
+def lightning_deviation_analysis(historical, current, quick_scan=False, quick_threshold=None):
     if historical is None or current is None: return pd.DataFrame()
-    merged = pd.merge(current, historical, on=['TN','Sozlesme_No'], how='inner')
-    if merged.empty: return pd.DataFrame()
-    merged['Sapma_Miktari'] = merged['Tuketim'] - merged['Ortalama_Tuketim']
-    merged['Sapma_Yüzdesi'] = (merged['Sapma_Miktari']/merged['Ortalama_Tuketim'])*100
+    result = deviation_table(historical, current, label_months=False)
+    if result.empty: return pd.DataFrame()
     if quick_scan and quick_threshold:
-        merged = merged[merged['Sapma_Yüzdesi']>=quick_threshold]
-    result = merged[['TN','Sozlesme_No','Ay_Adi','Tarih','Ortalama_Tuketim','Tuketim','Sapma_Miktari','Sapma_Yüzdesi']].copy()
-    result.columns = ['TN','Sözleşme','Ay','Tarih','Geçmiş_Ortalama','Güncel_Tuketim','Sapma_Miktarı','Sapma_Yüzdesi']
-    return result
+        result = result[result['Sapma_Yüzdesi']>=quick_threshold]
+    return result.rename(columns={'Sozlesme_No':'Sözleşme'})
 
-def display_lightning_results(results, threshold, sample_rate):
-    if results.empty:
+@st.fragment
+def display_lightning_results(index, sample_rate):
+    # Eşik değişince sadece bu bölüm yeniden çalışır; kesim sıralı indekste ikili aramayla
+    if len(index) == 0:
         st.warning("⚠️ Sonuç bulunamadı")
         return
-    total = len(results)
-    high_dev = len(results[results['Sapma_Yüzdesi']>=threshold])
+    threshold = st.slider("Sapma Eşiği (%)", 10, 100, 30, key="threshold")
+    total = len(index)
+    high_dev = index.count_at_least(threshold)
     col1,col2,col3,col4 = st.columns(4)
     with col1: st.metric("Toplam Analiz", f"{total:,}")
     with col2: st.metric(f">{threshold}% Sapma", f"{high_dev:,}")
     with col3: st.metric("Sapma Oranı", f"{(high_dev/total*100):.1f}%" if total>0 else "0%")
-    with col4: st.metric("Max Sapma", f"{results['Sapma_Yüzdesi'].max():.0f}%")
-    high_deviations = results[results['Sapma_Yüzdesi']>=threshold].copy()
-    if not high_deviations.empty:
+    with col4: st.metric("Max Sapma", f"{index.max():.0f}%")
+    if high_dev:
         st.header(f"⚠️ {threshold}% Üzeri Sapma")
-        high_deviations = high_deviations.sort_values('Sapma_Yüzdesi', ascending=False)
-        display_df = high_deviations.head(500)
+        display_df = index.at_least(threshold, 500)
+        display_df = display_df.assign(Ay=format_periods(display_df['Ay']))
         st.dataframe(display_df, use_container_width=True)
 
 # -----------------------------------------
@@ -236,3 +272,4 @@ def display_lightning_results(results, threshold, sample_rate):
 # -----------------------------------------
 if __name__ == "__main__":
     main()
+    st.sidebar.caption(format_cache_stats(DATA_CACHE.stats()))
@@ -0,0 +1,395 @@
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+# Excel seri numaraları 1899-12-30 gününden itibaren gün sayısıdır
+EXCEL_EPOCH = '1899-12-30'
+# Seri numarası sayılacak aralık (1900-01-01 ... 2173 civarı); daha büyük sayılar ID'dir
+SERIAL_RANGE = (1, 100_000)
+
+# Metin tarihler için denenecek açık formatlar (sıra önemli: gün önce)
+DATE_FORMATS = [
+    '%d.%m.%Y', '%d.%m.%Y %H:%M:%S', '%d.%m.%Y %H:%M',
+    '%Y-%m-%d', '%Y-%m-%d %H:%M:%S',
+    '%d/%m/%Y', '%d-%m-%Y', '%Y.%m.%d', '%Y/%m/%d',
+    '%d.%m.%y', '%m.%Y', '%Y-%m', '%Y',
+]
+FORMAT_SAMPLE_SIZE = 200
+
+DATE_PATHS = ('native', 'serial', 'format', 'generic', 'failed')
+
+# Tüketim değerlerinin sonundaki birimler ("890,25 m³", "1.250 m3", "12 kWh")
+UNIT_SUFFIX = r'\s*(?:s?m³|s?m3|kwh|lt|l)\.?$'
+NUMBER_PATHS = ('numeric', 'plain', 'turkish', 'thousands', 'english', 'unit', 'failed')
+
+# Sütun anahtarına göre bulunan son format; sonraki parça/dosyalarda önce bu denenir
+_format_cache = {}
+
+
+def _detect_format(sample, cache_key):
+    """Örnek metinler üzerinde en çok eşleşen açık formatı bul"""
+    cached = _format_cache.get(cache_key)
+    if cached is not None:
+        parsed = pd.to_datetime(sample, format=cached, errors='coerce')
+        if parsed.notna().mean() >= 0.9:
+            return cached
+
+    best, best_hits = None, 0
+    for fmt in DATE_FORMATS:
+        hits = pd.to_datetime(sample, format=fmt, errors='coerce').notna().sum()
+        if hits > best_hits:
+            best, best_hits = fmt, hits
+            if hits == len(sample):
+                break
+    if best is not None:
+        _format_cache[cache_key] = best
+    return best
+
+
+def _decode_unique(uniques, cache_key):
+    """Tekil değerleri çöz; her değer için kullanılan yolu da döndür"""
+    decoded = pd.Series(pd.NaT, index=uniques.index, dtype='datetime64[ns]')
+    path = np.full(len(uniques), 'failed', dtype=object)
+
+    is_text = uniques.map(lambda v: isinstance(v, str)).to_numpy(dtype=bool)
+    is_time = uniques.map(lambda v: isinstance(v, (datetime, date, np.datetime64))).to_numpy(dtype=bool)
+    # True/False da int sayılır; mantıksal hücreler seri numarası değildir
+    is_number = uniques.map(
+        lambda v: isinstance(v, (int, float, np.integer, np.floating)) and not isinstance(v, (bool, np.bool_))
+    ).to_numpy(dtype=bool)
+
+    # 1) Yerel tarih nesneleri: doğrudan
+    if is_time.any():
+        decoded[is_time] = pd.to_datetime(uniques[is_time], errors='coerce')
+        path[is_time] = 'native'
+
+    # 2) Metinler: önce önbellekteki/tespit edilen açık format, kalanlara diğer formatlar
+    # sırayla; "01.2023" gibi metinler seri numarası sanılmadan '%m.%Y' ile okunur
+    strings = uniques[is_text].str.strip()
+    if not strings.empty:
+        fmt = _detect_format(strings.iloc[:FORMAT_SAMPLE_SIZE], cache_key)
+        remaining = strings
+        for candidate in ([fmt] if fmt else []) + [f for f in DATE_FORMATS if f != fmt]:
+            if remaining.empty:
+                break
+            parsed = pd.to_datetime(remaining, format=candidate, errors='coerce')
+            hit = parsed.notna()
+            decoded[remaining.index[hit]] = parsed[hit]
+            path[remaining.index[hit]] = 'format'
+            remaining = remaining[~hit]
+
+    # 3) Sayılar ve sadece rakamdan oluşan metinler: Excel seri numarası, aritmetik dönüşüm
+    digits = pd.Series(False, index=uniques.index)
+    digits[strings.index] = strings.str.fullmatch(r'\d+')
+    candidates = (is_number | digits.to_numpy()) & decoded.isna().to_numpy()
+    numbers = pd.to_numeric(uniques.where(candidates), errors='coerce')
+    serial = numbers.between(*SERIAL_RANGE).to_numpy()
+    if serial.any():
+        decoded[serial] = pd.to_datetime(numbers[serial], unit='D', origin=EXCEL_EPOCH)
+        path[serial] = 'serial'
+
+    # 4) Kalan metinler genel ayrıştırıcı; rakamdan ibaret metinler (ID'ler) denenmez
+    leftover = strings[decoded[strings.index].isna() & strings.ne('') & ~digits[strings.index]]
+    if not leftover.empty:
+        # ISO metinler (ör. metne çevrilmiş datetime '2023-02-01 00:00:00') gün-önce
+        # okunursa gün ve ay yer değiştirir; önce ISO 8601, kalanlar gün-önce
+        parsed = pd.to_datetime(leftover, errors='coerce', format='ISO8601')
+        rest = parsed.isna()
+        if rest.any():
+            parsed[rest] = pd.to_datetime(leftover[rest], errors='coerce', dayfirst=True, format='mixed')
+        decoded[leftover.index] = parsed
+        path[leftover.index[parsed.notna()]] = 'generic'
+
+    path[decoded.isna().to_numpy()] = 'failed'
+    return decoded, path
+
+
+def decode_dates(series, cache_key='Tarih', stats=None):
+    """Tarih sütununu kodlamasına göre çöz: yerel tarih, Excel seri no, metin format, genel
+
+    Çözümleme tekil değerler üzerinde yapılır ve kodlarla satırlara yayılır.
+    stats sözlüğü verilirse her yoldan çözülen satır sayısı eklenir:
+    native, serial, format, generic, failed
+    """
+    if stats is None:
+        stats = {}
+    for name in DATE_PATHS:
+        stats.setdefault(name, 0)
+
+    if pd.api.types.is_datetime64_any_dtype(series):
+        result = series.astype('datetime64[ns]')
+        stats['native'] += int(result.notna().sum())
+        return result
+
+    codes, uniques = pd.factorize(series)
+    decoded, path = _decode_unique(pd.Series(uniques, dtype=object), cache_key)
+
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    for name in DATE_PATHS:
+        stats[name] += int(counts[path == name].sum())
+
+    values = decoded.to_numpy(dtype='datetime64[ns]')[np.where(codes >= 0, codes, 0)]
+    values[codes < 0] = np.datetime64('NaT')
+    return pd.Series(values, index=series.index)
+
+
+def _parse_unique_numbers(uniques, convention=None):
+    """Tekil metin değerleri kurallara göre sayıya çevir; her değerin kuralını döndür
+
+    convention sözlüğü verilirse sütunun ayraç kuralı ilk çağrıda ('decimal_comma')
+    kaydedilir ve sonraki parçalarda aynen kullanılır.
+    """
+    text = (
+        uniques.str.replace('\u00a0', ' ', regex=False)
+        .str.strip()
+        .str.lower()
+    )
+    unit = text.str.contains(UNIT_SUFFIX, regex=True)
+    text = text.str.replace(UNIT_SUFFIX, '', regex=True).str.replace(' ', '', regex=False)
+
+    comma = text.str.contains(',', regex=False)
+    english_grouped = text.str.match(r'^[-+]?\d{1,3}(?:,\d{3})+(?:\.\d+)?$')
+    # Tek gruplu "1.250" ancak sütunda virgüllü ondalık varsa binlik sayılır; akışlı
+    # okumada karar ilk parçada verilir, aynı değer her parçada aynı sayıya çevrilir.
+    # Virgüllü ondalık sütunda "1,250" da ondalıktır; İngiliz binlik sayılması için
+    # noktalı ondalık kısmı da olmalı ("1,250.50")
+    decimal_comma = bool((comma & ~english_grouped).any())
+    if convention is not None:
+        decimal_comma = convention.setdefault('decimal_comma', decimal_comma)
+    if decimal_comma:
+        english = english_grouped & text.str.contains('.', regex=False)
+    else:
+        english = english_grouped
+    turkish = comma & ~english
+    grouped = text.str.match(r'^[-+]?\d{1,3}(?:\.\d{3})+$') & ~turkish
+    multi_group = text.str.match(r'^[-+]?\d{1,3}(?:\.\d{3}){2,}$')
+    thousands = grouped & (multi_group | decimal_comma)
+
+    normalized = text.copy()
+    normalized[english] = text[english].str.replace(',', '', regex=False)
+    normalized[turkish] = (
+        text[turkish].str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+    )
+    normalized[thousands] = text[thousands].str.replace('.', '', regex=False)
+    values = pd.to_numeric(normalized, errors='coerce')
+
+    path = np.full(len(uniques), 'plain', dtype=object)
+    path[english.to_numpy()] = 'english'
+    path[turkish.to_numpy()] = 'turkish'
+    path[thousands.to_numpy()] = 'thousands'
+    path[values.isna().to_numpy()] = 'failed'
+    return values, path, unit.to_numpy() & values.notna().to_numpy()
+
+
+def parse_consumption(series, stats=None, convention=None):
+    """Tüketim sütununu vektörel çevir: Türkçe binlik/ondalık ayraçları, birim ekleri, boşluklar
+
+    Kurallar tekil metin değerleri üzerinde uygulanır. stats sözlüğü verilirse her
+    kuralın çevirdiği satır sayısı eklenir: numeric (zaten sayı), plain, turkish
+    (1.250,50), thousands (1.250.000), english (1,250.50), unit (birim eki atıldı), failed.
+    Parça parça çevrilen sütunlarda aynı convention sözlüğü her parçaya verilir.
+    """
+    if stats is None:
+        stats = {}
+    for name in NUMBER_PATHS:
+        stats.setdefault(name, 0)
+
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        result = series.astype('float64')
+        stats['numeric'] += int(result.notna().sum())
+        return result
+
+    codes, uniques = pd.factorize(series)
+    uniques = pd.Series(uniques, dtype=object)
+    values = pd.Series(np.nan, index=uniques.index)
+    path = np.full(len(uniques), 'failed', dtype=object)
+    unit = np.zeros(len(uniques), dtype=bool)
+
+    is_text = uniques.map(lambda v: isinstance(v, str)).to_numpy(dtype=bool)
+    numbers = pd.to_numeric(uniques.where(~is_text), errors='coerce')
+    is_number = numbers.notna().to_numpy()
+    values[is_number] = numbers[is_number]
+    path[is_number] = 'numeric'
+
+    if is_text.any():
+        text_values, text_path, text_unit = _parse_unique_numbers(
+            uniques[is_text].astype(str), convention
+        )
+        values[is_text] = text_values.to_numpy()
+        path[is_text] = text_path
+        unit[is_text] = text_unit
+
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    for name in NUMBER_PATHS:
+        if name != 'unit':
+            stats[name] += int(counts[path == name].sum())
+    stats['unit'] += int(counts[unit].sum())
+
+    result = values.to_numpy(dtype='float64')[np.where(codes >= 0, codes, 0)]
+    result[codes < 0] = np.nan
+    return pd.Series(result, index=series.index)
+
+
+def normalize_ids(series, upper=True, pad_width=None):
+    """ID sütununu tekil değerler üzerinde normalleştirip kategorik olarak döndür
+
+    Kurallar (sırayla): metne çevir, boşlukları kırp, Excel'in sayı ID'lerine eklediği
+    '.0' sonekini at, büyük harfe çevir, sadece rakamlardan oluşan ID'leri pad_width
+    uzunluğa sıfırla doldur. Sonuç kategorileri sıralıdır; aynı ID'ye düşen farklı
+    yazımlar tek kategoride birleşir.
+    """
+    codes, uniques = pd.factorize(series)
+    text = pd.Series(uniques, dtype=object).astype(str).str.strip()
+    text = text.str.replace(r'^(\d+)\.0+$', r'\1', regex=True)
+    if upper:
+        text = text.str.upper()
+    if pad_width:
+        digits = text.str.fullmatch(r'\d+')
+        text[digits] = text[digits].str.zfill(pad_width)
+
+    new_codes, categories = pd.factorize(text, sort=True)
+    # Eski kodlar tekil değerler üzerinden yeni (birleştirilmiş) kodlara eşlenir, NaN -1 kalır
+    final_codes = np.append(new_codes, -1)[codes]
+    return pd.Series(
+        pd.Categorical.from_codes(final_codes, categories=categories),
+        index=series.index, name=series.name
+    )
+
+
+def period_codes(dates):
+    """Tarihleri ay dönemi koduna çevir: yıl * 12 + (ay - 1), int32
+
+    Ay etiketleri satır başına metin olarak tutulmaz; gruplama, sıralama ve eşleştirme
+    tamsayı kodlarla yapılır, metne sadece gösterimde format_periods ile çevrilir.
+    """
+    return (dates.dt.year * 12 + dates.dt.month - 1).astype('int32')
+
+
+def format_periods(codes):
+    """Dönem kodlarını 'YYYY-MM' etiketlerine çevir (tekil kodlar üzerinden)"""
+    positions, uniques = pd.factorize(codes)
+    labels = np.array([f"{code // 12}-{code % 12 + 1:02d}" for code in uniques] + [None], dtype=object)
+    return pd.Series(labels[positions], index=codes.index, name=codes.name)
+
+
+def align_categories(frames, columns=('TN', 'Sozlesme_No')):
+    """Birleştirilecek tabloların kategorik ID sütunlarını ortak, sıralı kategorilere getir
+
+    Kategoriler farklıysa pd.concat ve pd.merge nesne karşılaştırmasına düşer;
+    ortak kategorilerle tamsayı kodlar üzerinden çalışırlar.
+    """
+    frames = list(frames)
+    for col in columns:
+        if not all(isinstance(f[col].dtype, pd.CategoricalDtype) for f in frames):
+            continue
+        categories = pd.Index(np.unique(np.concatenate([
+            np.asarray(f[col].cat.categories, dtype=object) for f in frames
+        ])))
+        frames = [f.assign(**{col: f[col].cat.set_categories(categories)}) for f in frames]
+    return frames
+
+
+# Temizlikte satırın atılma nedenleri; bir satır ilk tuttuğu nedene sayılır
+DROP_REASONS = ('bad_date', 'bad_number', 'negative', 'wrong_year', 'missing_id')
+
+
+def clean_rows(df, id_columns=('TN', 'Sozlesme_No'), number_column='Tuketim', date_column='Tarih',
+               years=None, allow_negative=False, upper=True,
+               date_stats=None, number_stats=None, drop_stats=None, number_convention=None):
+    """Tek geçişli temizlik: tüm kurallar tek bir geçerlilik maskesinde birleşir
+
+    Tarih ve tüketim tekil değerler üzerinde bir kez çevrilir; geçersiz tarih, geçersiz
+    tüketim, negatif tüketim (allow_negative değilse), years dışındaki yıl ve eksik ID
+    kontrolleri aynı maskeye işlenir. Çıktı tablo, kalan satırlar için bir kez üretilir;
+    ID sütunları normalize_ids ile kategorik olur, diğer sütunlar aynen taşınır.
+    date_column None ise tarih kontrolleri atlanır. drop_stats sözlüğü verilirse her
+    nedenle atılan ve kalan ('kept') satır sayısı eklenir. number_convention: parçalar
+    arasında paylaşılan ayraç kuralı (parse_consumption).
+    """
+    if drop_stats is None:
+        drop_stats = {}
+    for name in DROP_REASONS + ('kept',):
+        drop_stats.setdefault(name, 0)
+
+    values = parse_consumption(df[number_column], stats=number_stats,
+                               convention=number_convention).to_numpy()
+    no_check = np.zeros(len(df), dtype=bool)
+    checks = [
+        ('bad_number', np.isnan(values)),
+        ('negative', no_check if allow_negative else values < 0),
+        ('missing_id', df[list(id_columns)].isna().any(axis=1).to_numpy()),
+    ]
+    if date_column is not None:
+        dates = decode_dates(df[date_column], stats=date_stats)
+        date_values = dates.to_numpy()
+        checks[:0] = [('bad_date', np.isnat(date_values))]
+        if years:
+            checks.insert(3, ('wrong_year', ~dates.dt.year.isin(list(years)).to_numpy()))
+
+    dropped = np.zeros(len(df), dtype=bool)
+    for name, failed in checks:
+        drop_stats[name] += int(np.count_nonzero(failed & ~dropped))
+        dropped |= failed
+    keep = np.flatnonzero(~dropped)
+    drop_stats['kept'] += len(keep)
+
+    columns = {}
+    for name in df.columns:
+        if name == number_column:
+            columns[name] = values[keep]
+        elif name == date_column:
+            columns[name] = date_values[keep]
+        elif name in id_columns:
+            columns[name] = normalize_ids(df[name].iloc[keep], upper=upper).array
+        else:
+            columns[name] = df[name].iloc[keep].array
+    return pd.DataFrame(columns, index=df.index[keep])
+
+
+DROP_REASON_LABELS = {
+    'bad_date': 'geçersiz tarih',
+    'bad_number': 'geçersiz tüketim',
+    'negative': 'negatif tüketim',
+    'wrong_year': 'farklı yıl',
+    'missing_id': 'eksik ID',
+}
+
+
+def format_drop_stats(stats):
+    """Temizlik sayaçlarını kısa bir veri kalitesi özetine çevir"""
+    parts = [f"{stats[name]:,} {DROP_REASON_LABELS[name]}" for name in DROP_REASONS if stats.get(name)]
+    return (f"🧹 Temizlik: {stats.get('kept', 0):,} satır kaldı; atılan: "
+            + (", ".join(parts) if parts else "yok"))
+
+
+NUMBER_PATH_LABELS = {
+    'numeric': 'sayı hücresi',
+    'plain': 'düz metin',
+    'turkish': 'Türkçe ondalık',
+    'thousands': 'binlik ayraçlı',
+    'english': 'İngilizce biçim',
+    'unit': 'birim eki atıldı',
+    'failed': 'çevrilemedi',
+}
+
+
+def format_number_stats(stats):
+    """Tüketim çevirme sayaçlarını kısa bir özet metnine çevir"""
+    parts = [f"{stats[name]:,} {NUMBER_PATH_LABELS[name]}" for name in NUMBER_PATHS if stats.get(name)]
+    return "🔢 Tüketim çevirme: " + (", ".join(parts) if parts else "veri yok")
+
+
+DATE_PATH_LABELS = {
+    'native': 'tarih hücresi',
+    'serial': 'Excel seri no',
+    'format': 'açık format',
+    'generic': 'genel ayrıştırıcı',
+    'failed': 'çözülemedi',
+}
+
+
+def format_date_stats(stats):
+    """Tarih çözümleme sayaçlarını kısa bir özet metnine çevir"""
+    parts = [f"{stats[name]:,} {DATE_PATH_LABELS[name]}" for name in DATE_PATHS if stats.get(name)]
+    return "📅 Tarih çözümleme: " + (", ".join(parts) if parts else "veri yok")
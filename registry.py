@@ -0,0 +1,173 @@
+import argparse
+import os
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from parsers import normalize_ids
+from store import STORE_DIR, store_lock
+
+# (TN, Sözleşme No) -> kalıcı tesisat numarası; satır numarası tesisat numarasıdır
+REGISTRY_NAME = 'installations.parquet'
+ID_COLUMN = 'Tesisat_ID'
+
+
+class InstallationRegistry:
+    """Tüm yıllar ve dosyalar için ortak, kalıcı tesisat numarası kaydı
+
+    Her (TN, Sözleşme No) çifti ilk görüldüğünde sıradaki int32 numarayı alır ve bu
+    numara bir daha değişmez. Gruplama ve birleştirmeler yoğun tamsayı anahtarlar
+    üzerinde yapılır; TN ve Sözleşme No sadece gösterimde names() ile geri alınır.
+    """
+
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        self.path = os.path.join(root, REGISTRY_NAME)
+        self._lock = threading.Lock()
+        self._signature = None
+        self._tn = np.array([], dtype=object)
+        self._contract = np.array([], dtype=object)
+        self._index = pd.MultiIndex.from_arrays([self._tn, self._contract])
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._tn)
+
+    def _refresh(self):
+        """Kayıt dosyası başka bir süreçte değiştiyse yeniden oku
+
+        Değişiklik dosyanın değişiklik zamanı, boyutu ve satır sayısıyla anlaşılır; aynı
+        zaman damgasına düşen iki yazım da satır sayısından ayırt edilir.
+        """
+        try:
+            stat = os.stat(self.path)
+            rows = pq.read_metadata(self.path).num_rows
+        except FileNotFoundError:
+            return
+        if (stat.st_mtime_ns, stat.st_size, rows) == self._signature:
+            return
+        # Tek dosya tanıtıcısından okunur; başka süreç arada dosyayı değiştirse de
+        # üst veri ve sayfalar aynı sürümden gelir
+        with open(self.path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            table = pq.read_table(f)
+        signature = (stat.st_mtime_ns, stat.st_size, table.num_rows)
+        self._tn = np.asarray(table['TN'].to_pylist(), dtype=object)
+        self._contract = np.asarray(table['Sozlesme_No'].to_pylist(), dtype=object)
+        self._index = pd.MultiIndex.from_arrays([self._tn, self._contract])
+        self._signature = signature
+
+    def _save(self):
+        # Her yazım kendi geçici dosyasına yapılır; süreçler aynı .tmp'yi paylaşmaz
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=REGISTRY_NAME, suffix='.tmp')
+        os.close(fd)
+        table = pa.table({
+            'TN': pa.array(self._tn, pa.string()),
+            'Sozlesme_No': pa.array(self._contract, pa.string()),
+        })
+        try:
+            pq.write_table(table, tmp_path, compression='snappy')
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        stat = os.stat(self.path)
+        self._signature = (stat.st_mtime_ns, stat.st_size, len(self._tn))
+
+    def _lookup_or_add(self, tn, contract):
+        """Tekil (TN, Sözleşme No) çiftlerinin numaraları; yeni çiftler kayda eklenir
+
+        Yeni çift varsa kayıt depo kilidi (store.store_lock, süreçler arası) altında
+        yeniden okunur, numaralar verilir ve dosya yazılır; aynı depoyu kullanan
+        uygulamalar aynı çifte hiçbir zaman farklı numara vermez.
+        """
+        pairs = pd.MultiIndex.from_arrays([tn, contract])
+        with self._lock:
+            self._refresh()
+            ids = self._index.get_indexer(pairs)
+            if not (ids < 0).any():
+                return ids.astype('int32')
+
+            os.makedirs(self.root, exist_ok=True)
+            with store_lock(self.root):
+                self._refresh()
+                ids = self._index.get_indexer(pairs)
+                new = ids < 0
+                if new.any():
+                    start = len(self._tn)
+                    ids[new] = np.arange(start, start + int(new.sum()))
+                    self._tn = np.concatenate([self._tn, tn[new]])
+                    self._contract = np.concatenate([self._contract, contract[new]])
+                    self._index = pd.MultiIndex.from_arrays([self._tn, self._contract])
+                    self._save()
+            return ids.astype('int32')
+
+    def assign(self, tn, contract):
+        """Satır başına tesisat numarası (int32); eksik ID'li satırlar -1
+
+        Kayıt sadece tekil çiftler için aranır: kategorik kodlar tek bir tamsayı çift
+        koduna indirgenir ve satırlara dizi indeksleme ile geri dağıtılır.
+        """
+        tn, contract = (
+            s if isinstance(s.dtype, pd.CategoricalDtype) else normalize_ids(s)
+            for s in (tn, contract)
+        )
+        tn_codes = tn.cat.codes.to_numpy(dtype='int64')
+        contract_codes = contract.cat.codes.to_numpy(dtype='int64')
+        pair_codes = tn_codes * (len(contract.cat.categories) + 1) + (contract_codes + 1)
+        positions, uniques = pd.factorize(pair_codes)
+
+        # Her tekil çift için örnek bir satır (aynı çiftin tüm satırları aynı kodları taşır)
+        first = np.empty(len(uniques), dtype='int64')
+        first[positions] = np.arange(len(positions))
+        unique_tn, unique_contract = tn_codes[first], contract_codes[first]
+        valid = (unique_tn >= 0) & (unique_contract >= 0)
+
+        unique_ids = np.full(len(uniques), -1, dtype='int32')
+        if valid.any():
+            unique_ids[valid] = self._lookup_or_add(
+                np.asarray(tn.cat.categories, dtype=object)[unique_tn[valid]],
+                np.asarray(contract.cat.categories, dtype=object)[unique_contract[valid]],
+            )
+        return unique_ids[positions]
+
+    def attach(self, df):
+        """TN ve Sozlesme_No sütunlu tabloya Tesisat_ID sütununu ekle"""
+        return df.assign(**{ID_COLUMN: self.assign(df['TN'], df['Sozlesme_No'])})
+
+    def names(self, ids):
+        """Tesisat numaralarından (>= 0) gösterim için kategorik TN ve Sozlesme_No sütunları"""
+        with self._lock:
+            self._refresh()
+            tn, contract = self._tn, self._contract
+        index = ids.index if isinstance(ids, pd.Series) else None
+        ids = np.asarray(ids)
+        return pd.DataFrame({
+            'TN': normalize_ids(pd.Series(tn[ids], dtype=object)).array,
+            'Sozlesme_No': normalize_ids(pd.Series(contract[ids], dtype=object)).array,
+        }, index=index)
+
+
+# Süreç genelinde paylaşılan kayıt; dosya değişince kendini yeniler
+REGISTRY = InstallationRegistry()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tesisat numarası kaydı")
+    parser.add_argument('--root', default=STORE_DIR)
+    parser.add_argument('--show', type=int, default=0, metavar='N', help="İlk N kaydı yazdır")
+    args = parser.parse_args()
+
+    registry = InstallationRegistry(args.root)
+    print(f"{len(registry):,} tesisat kayıtlı ({registry.path})")
+    if args.show:
+        print(registry.names(np.arange(min(args.show, len(registry)))).to_string())
+
+
+if __name__ == "__main__":
+    main()
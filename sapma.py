@@ -4,6 +4,13 @@ import numpy as np
 from io import BytesIO
 from datetime import datetime
 
+from baseline import combine_baseline, partial_aggregates, stored_partials
+from cache import DATA_CACHE, format_cache_stats
+from deviation import DeviationIndex, deviation_table
+from ingest import SUPPORTED_TYPES, parse_uploaded, preview, project, upload_key
+from parsers import clean_rows, format_date_stats, format_drop_stats, format_number_stats, period_codes
+from store import DatasetStore, variant_key
+
 def main():
     st.title("🔥 Doğalgaz Tüketim Sapma Analizi")
     st.markdown("2023-2024 ortalamasından %30 fazla sapma gösteren tesisatları tespit edin")
@@ -14,7 +21,7 @@ def main():
     # 2023-2024 dosyası yükleme
     file_historical = st.sidebar.file_uploader(
         "2023-2024 Geçmiş Veriler", 
-        type=['xlsx', 'xls'],
+        type=SUPPORTED_TYPES,
         key="file_historical",
         help="TN, Tüketim Miktarı, Tarih, Sözleşme Numarası sütunları olmalı"
     )
@@ -22,25 +29,17 @@ def main():
     # 2025 dosyası yükleme
     file_2025 = st.sidebar.file_uploader(
         "2025 Güncel Veriler", 
-        type=['xlsx', 'xls'],
+        type=SUPPORTED_TYPES,
         key="file_2025",
         help="TN, Tüketim Miktarı, Tarih, Sözleşme Numarası sütunları olmalı"
     )
     
-    # Eşik değeri ayarı
-    threshold = st.sidebar.slider(
-        "Sapma Eşiği (%)", 
-        min_value=10, 
-        max_value=100, 
-        value=30,
-        help="Bu yüzdeden fazla artış gösteren tesisatlar raporlanacak"
-    )
-    
     if file_historical is not None and file_2025 is not None:
         try:
-            # Excel dosyalarını okuma
-            df_historical = pd.read_excel(file_historical)
-            df_2025 = pd.read_excel(file_2025)
+            # Yüklenen dosyalar içerik anahtarına göre bir kez ayrıştırılır (Excel, CSV, Parquet, Feather);
+            # eşik veya sütun seçimi değişince önbellekteki tablo kullanılır
+            table_historical = parse_uploaded(file_historical)
+            table_2025 = parse_uploaded(file_2025)
             
             st.success("✅ Dosyalar başarıyla yüklendi!")
             
@@ -49,13 +48,13 @@ def main():
             
             with col1:
                 st.subheader("2023-2024 Verisi")
-                st.dataframe(df_historical.head(), use_container_width=True)
-                st.info(f"Toplam kayıt: {len(df_historical)}")
+                st.dataframe(preview(table_historical), use_container_width=True)
+                st.info(f"Toplam kayıt: {table_historical.num_rows}")
             
             with col2:
                 st.subheader("2025 Verisi")
-                st.dataframe(df_2025.head(), use_container_width=True)
-                st.info(f"Toplam kayıt: {len(df_2025)}")
+                st.dataframe(preview(table_2025), use_container_width=True)
+                st.info(f"Toplam kayıt: {table_2025.num_rows}")
             
             # Sütun eşleştirmesi
             st.header("🔧 Sütun Eşleştirmesi")
@@ -64,32 +63,42 @@ def main():
             with col1:
                 tn_col = st.selectbox(
                     "TN Sütunu:",
-                    options=df_historical.columns.tolist()
+                    options=table_historical.column_names
                 )
                 
             with col2:
                 tuketim_col = st.selectbox(
                     "Tüketim Sütunu:",
-                    options=df_historical.columns.tolist()
+                    options=table_historical.column_names
                 )
                 
             with col3:
                 tarih_col = st.selectbox(
                     "Tarih Sütunu:",
-                    options=df_historical.columns.tolist()
+                    options=table_historical.column_names
                 )
                 
             with col4:
                 sozlesme_col = st.selectbox(
                     "Sözleşme No Sütunu:",
-                    options=df_historical.columns.tolist()
+                    options=table_historical.column_names
                 )
             
+            # Sonuçlar bu girdilere aittir; dosya veya sütun değişince eski sonuç gösterilmez
+            signature = (upload_key(file_historical), upload_key(file_2025),
+                         tn_col, tuketim_col, tarih_col, sozlesme_col)
+            
             if st.button("🔍 Sapma Analizini Başlat", type="primary"):
                 with st.spinner("Analiz yapılıyor..."):
+                    # Sadece seçilen sütunlar DataFrame'e çevrilir
+                    key_cols = [tn_col, tuketim_col, tarih_col, sozlesme_col]
+                    df_historical = project(table_historical, key_cols)
+                    df_2025 = project(table_2025, key_cols)
+                    
                     # 2023-2024 ortalamalarını hesapla
                     historical_avg = calculate_historical_average(
-                        df_historical, tn_col, tuketim_col, tarih_col, sozlesme_col
+                        df_historical, tn_col, tuketim_col, tarih_col, sozlesme_col,
+                        store_key=upload_key(file_historical)
                     )
                     
                     # 2025 verilerini hazırla
@@ -98,56 +107,19 @@ def main():
                     )
                     
                     # Sapma analizini yap
-                    deviation_results = analyze_deviations(
-                        historical_avg, current_data, threshold
-                    )
+                    deviation_results = analyze_deviations(historical_avg, current_data)
                     
                     if deviation_results is not None and not deviation_results.empty:
                         st.success(f"✅ Analiz tamamlandı!")
-                        
-                        # Özet bilgi
-                        total_compared = len(deviation_results)
-                        high_deviation = len(deviation_results[deviation_results['Sapma_Yüzdesi'] >= threshold])
-                        
-                        col1, col2, col3 = st.columns(3)
-                        with col1:
-                            st.metric("Karşılaştırılan Tesisat", f"{total_compared}")
-                        with col2:
-                            st.metric(f">{threshold}% Sapma Gösteren", f"{high_deviation}")
-                        with col3:
-                            st.metric("Oran", f"{high_deviation/total_compared*100:.1f}%" if total_compared > 0 else "0%")
-                        
-                        # Yüksek sapma gösteren tesisatları filtrele
-                        high_deviations = deviation_results[
-                            deviation_results['Sapma_Yüzdesi'] >= threshold
-                        ].copy()
-                        
-                        if not high_deviations.empty:
-                            st.header(f"⚠️ {threshold}% Üzeri Sapma Gösteren Tesisatlar")
-                            
-                            # Sıralama
-                            high_deviations = high_deviations.sort_values('Sapma_Yüzdesi', ascending=False)
-                            
-                            # Tablo gösterimi
-                            display_df = format_display_table(high_deviations)
-                            st.dataframe(display_df, use_container_width=True, hide_index=True)
-                            
-                            # Excel indirme
-                            excel_data = create_deviation_report(high_deviations, threshold)
-                            
-                            st.download_button(
-                                label="📥 Sapma Raporunu Excel Olarak İndir",
-                                data=excel_data,
-                                file_name=f"sapma_raporu_{threshold}pct_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                type="primary"
-                            )
-                            
-                        else:
-                            st.success(f"🎉 {threshold}% üzeri sapma gösteren tesisat bulunmamaktadır!")
-                            
+                        # Sonuçlar bir kez sıralanıp saklanır; eşik değişince analiz tekrar çalışmaz
+                        st.session_state['sapma_sonuclari'] = (signature, DeviationIndex(deviation_results))
                     else:
+                        st.session_state.pop('sapma_sonuclari', None)
                         st.error("❌ Veri analizi sırasında hata oluştu.")
+            
+            analysis = st.session_state.get('sapma_sonuclari')
+            if analysis is not None and analysis[0] == signature:
+                show_threshold_results(analysis[1])
                         
         except Exception as e:
             st.error(f"❌ Hata: {str(e)}")
@@ -166,35 +138,84 @@ def main():
         })
         st.dataframe(example_data, use_container_width=True)
 
-def calculate_historical_average(df, tn_col, tuketim_col, tarih_col, sozlesme_col):
-    """2023-2024 verilerinin aylık ortalamalarını hesapla"""
-    try:
-        # Veriyi temizle
-        df_clean = df[[tn_col, tuketim_col, tarih_col, sozlesme_col]].copy()
-        df_clean.columns = ['TN', 'Tuketim', 'Tarih', 'Sozlesme_No']
+@st.fragment
+def show_threshold_results(index):
+    """Eşiğe bağlı metrikler, tablo ve rapor; eşik değişince sadece bu bölüm yeniden çalışır"""
+    threshold = st.slider(
+        "Sapma Eşiği (%)", 
+        min_value=10, 
+        max_value=100, 
+        value=30,
+        key="threshold",
+        help="Bu yüzdeden fazla artış gösteren tesisatlar raporlanacak"
+    )
+    
+    # Özet bilgi: eşik üstü satır sayısı sıralı indekste ikili aramayla bulunur
+    total_compared = len(index)
+    high_deviation = index.count_at_least(threshold)
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Karşılaştırılan Tesisat", f"{total_compared}")
+    with col2:
+        st.metric(f">{threshold}% Sapma Gösteren", f"{high_deviation}")
+    with col3:
+        st.metric("Oran", f"{high_deviation/total_compared*100:.1f}%" if total_compared > 0 else "0%")
+    
+    if high_deviation:
+        st.header(f"⚠️ {threshold}% Üzeri Sapma Gösteren Tesisatlar")
         
-        # Tarihi datetime'a çevir
-        df_clean['Tarih'] = pd.to_datetime(df_clean['Tarih'], errors='coerce')
-        df_clean = df_clean.dropna(subset=['Tarih'])
+        # Yüksek sapmalar zaten azalan sırada
+        high_deviations = index.at_least(threshold)
         
-        # Tüketimi sayısal yap
-        df_clean['Tuketim'] = pd.to_numeric(df_clean['Tuketim'], errors='coerce')
-        df_clean = df_clean.dropna(subset=['Tuketim'])
+        # Tablo gösterimi
+        display_df = format_display_table(high_deviations)
+        st.dataframe(display_df, use_container_width=True, hide_index=True)
         
-        # 2023-2024 yıllarını filtrele
-        df_clean = df_clean[
-            (df_clean['Tarih'].dt.year == 2023) | 
-            (df_clean['Tarih'].dt.year == 2024)
-        ]
+        # Excel raporu sadece indirme tıklanınca üretilir
+        st.download_button(
+            label="📥 Sapma Raporunu Excel Olarak İndir",
+            data=lambda: create_deviation_report(high_deviations, threshold),
+            file_name=f"sapma_raporu_{threshold}pct_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            type="primary"
+        )
         
-        # Ay-yıl sütunu ekle
-        df_clean['Ay_Yil'] = df_clean['Tarih'].dt.to_period('M')
+    else:
+        st.success(f"🎉 {threshold}% üzeri sapma gösteren tesisat bulunmamaktadır!")
+
+def calculate_historical_average(df, tn_col, tuketim_col, tarih_col, sozlesme_col, store_key=None):
+    """2023-2024 verilerinin ortalamalarını kısmi toplamlardan hesapla
+
+    store_key (yüklenen dosyanın içerik anahtarı) verilirse tesisat × ay kısmi toplamları
+    depoda saklanır; aynı dosya ve sütun eşleştirmesiyle ham satırlar tekrar taranmaz.
+    """
+    try:
+        def load_rows():
+            # Veriyi temizle
+            df_clean = df[[tn_col, tuketim_col, tarih_col, sozlesme_col]].copy()
+            df_clean.columns = ['TN', 'Tuketim', 'Tarih', 'Sozlesme_No']
+            
+            # Tek geçişli temizlik: tarih/tüketim çevirme ve filtreler tek maskede
+            # (sıfır ve negatif tüketimler ortalamaya dahil olduğu için tutulur)
+            date_stats, number_stats, drop_stats = {}, {}, {}
+            df_clean = clean_rows(df_clean, allow_negative=True, date_stats=date_stats,
+                                  number_stats=number_stats, drop_stats=drop_stats)
+            st.caption(format_date_stats(date_stats))
+            st.caption(format_number_stats(number_stats))
+            st.caption(format_drop_stats(drop_stats))
+            return df_clean
         
-        # TN bazında aylık ortalama hesapla
-        monthly_avg = df_clean.groupby(['TN', 'Sozlesme_No'])['Tuketim'].mean().reset_index()
-        monthly_avg.columns = ['TN', 'Sozlesme_No', 'Ortalama_Tuketim']
+        if store_key:
+            variant = variant_key(tn_col, tuketim_col, tarih_col, sozlesme_col)
+            partials = stored_partials(DatasetStore(), store_key, variant, load_rows)
+        else:
+            partials = partial_aggregates(load_rows())
         
-        return monthly_avg
+        # TN bazında 2023-2024 ortalaması (sıfır ve negatif değerler dahil)
+        monthly_avg = combine_baseline([partials], years=[2023, 2024], positive_only=False)
+        
+        return monthly_avg[['TN', 'Sozlesme_No', 'Ortalama_Tuketim']]
         
     except Exception as e:
         st.error(f"Geçmiş veri analizi hatası: {str(e)}")
@@ -206,20 +227,17 @@ def prepare_current_data(df, tn_col, tuketim_col, tarih_col, sozlesme_col):
         df_clean = df[[tn_col, tuketim_col, tarih_col, sozlesme_col]].copy()
         df_clean.columns = ['TN', 'Tuketim', 'Tarih', 'Sozlesme_No']
         
-        # Tarihi datetime'a çevir
-        df_clean['Tarih'] = pd.to_datetime(df_clean['Tarih'], errors='coerce')
-        df_clean = df_clean.dropna(subset=['Tarih'])
-        
-        # Tüketimi sayısal yap
-        df_clean['Tuketim'] = pd.to_numeric(df_clean['Tuketim'], errors='coerce')
-        df_clean = df_clean.dropna(subset=['Tuketim'])
-        
-        # 2025 yılını filtrele
-        df_clean = df_clean[df_clean['Tarih'].dt.year == 2025]
+        # Tek geçişli temizlik: tarih/tüketim çevirme ve 2025 filtresi tek maskede
+        date_stats, number_stats, drop_stats = {}, {}, {}
+        df_clean = clean_rows(df_clean, years=[2025], allow_negative=True, date_stats=date_stats,
+                              number_stats=number_stats, drop_stats=drop_stats)
+        st.caption(format_date_stats(date_stats))
+        st.caption(format_number_stats(number_stats))
+        st.caption(format_drop_stats(drop_stats))
         
         # Ay bilgisi ekle
         df_clean['Ay'] = df_clean['Tarih'].dt.month
-        df_clean['Ay_Adi'] = df_clean['Tarih'].dt.strftime('%Y-%m')
+        df_clean['Ay_Kodu'] = period_codes(df_clean['Tarih'])
         
         return df_clean
         
@@ -227,51 +245,14 @@ def prepare_current_data(df, tn_col, tuketim_col, tarih_col, sozlesme_col):
         st.error(f"2025 veri hazırlama hatası: {str(e)}")
         return None
 
-def analyze_deviations(historical_avg, current_data, threshold):
-    """Sapma analizini yap"""
+def analyze_deviations(historical_avg, current_data):
+    """Sapma analizini yap (TN + Sözleşme No anahtarıyla tek birleştirme)"""
     try:
         if historical_avg is None or current_data is None:
             return None
-            
-        results = []
         
-        # Her 2025 kaydı için kontrol et
-        for _, row in current_data.iterrows():
-            tn = row['TN']
-            sozlesme_no = row['Sozlesme_No']
-            current_tuketim = row['Tuketim']
-            ay_adi = row['Ay_Adi']
-            tarih = row['Tarih']
-            
-            # Bu TN'nin geçmiş ortalamasını bul
-            historical_record = historical_avg[
-                (historical_avg['TN'] == tn) & 
-                (historical_avg['Sozlesme_No'] == sozlesme_no)
-            ]
-            
-            if not historical_record.empty:
-                avg_tuketim = historical_record.iloc[0]['Ortalama_Tuketim']
-                
-                # Sapma hesapla
-                if avg_tuketim > 0:
-                    sapma_miktar = current_tuketim - avg_tuketim
-                    sapma_yuzde = (sapma_miktar / avg_tuketim) * 100
-                    
-                    results.append({
-                        'TN': tn,
-                        'Sozlesme_No': sozlesme_no,
-                        'Ay': ay_adi,
-                        'Tarih': tarih,
-                        'Geçmiş_Ortalama': avg_tuketim,
-                        'Güncel_Tuketim': current_tuketim,
-                        'Sapma_Miktarı': sapma_miktar,
-                        'Sapma_Yüzdesi': sapma_yuzde
-                    })
-        
-        if results:
-            return pd.DataFrame(results)
-        else:
-            return pd.DataFrame()
+        # Ortalaması sıfırdan büyük tesisatlar için her 2025 kaydının sapması
+        return deviation_table(historical_avg, current_data, positive_only=True)
             
     except Exception as e:
         st.error(f"Sapma analizi hatası: {str(e)}")
@@ -366,3 +347,4 @@ if __name__ == "__main__":
     )
     
     main()
+    st.sidebar.caption(format_cache_stats(DATA_CACHE.stats()))
@@ -0,0 +1,501 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+try:
+    import fcntl
+except ImportError:  # Windows: süreçler arası dosya kilidi yok, süreç içi kilit yine geçerli
+    fcntl = None
+
+# Veri deposunun kök dizini (SAPMA_STORE_DIR ile değiştirilebilir)
+STORE_DIR = os.environ.get(
+    'SAPMA_STORE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.veri_deposu')
+)
+
+MANIFEST_NAME = 'manifest.json'
+# manifest.json ve series.json oku-değiştir-yaz işlemlerinin süreçler arası kilit dosyası
+LOCK_NAME = '.depo.lock'
+# Güncel yıl serileri: sütun eşleştirmesi başına geçmiş yıl anahtarları ve eklenen aylar
+SERIES_NAME = 'series.json'
+
+# year=/month= dizinleri; filtreler bu sütunlar üzerinden dosya seviyesinde budanır
+PARTITIONING = ds.partitioning(
+    pa.schema([('year', pa.int16()), ('month', pa.int8())]), flavor='hive'
+)
+HASH_BLOCK_SIZE = 1024 * 1024
+# Parça parça okumada bir parçanın satır sayısı
+BATCH_ROWS = 256 * 1024
+
+
+def file_sha256(file_obj):
+    """Yüklenen dosyanın içeriğinden SHA-256 anahtarı üret"""
+    digest = hashlib.sha256()
+    file_obj.seek(0)
+    for block in iter(lambda: file_obj.read(HASH_BLOCK_SIZE), b''):
+        digest.update(block)
+    file_obj.seek(0)
+    return digest.hexdigest()
+
+
+def group_key(keys):
+    """Birlikte işlenen dosyaların ortak içerik anahtarı; dosya sırasından bağımsız"""
+    text = json.dumps(['group'] + sorted(keys))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def variant_key(*params):
+    """Aynı dosyanın farklı sütun eşleştirmeleri için kısa anahtar"""
+    text = json.dumps([str(p) for p in params], ensure_ascii=False)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+
+def temp_path(path):
+    """Hedefle aynı dizinde benzersiz geçici dosya yolu
+
+    Aynı veri setini eşzamanlı üreten oturumlar ortak bir '.tmp' dosyasını ezmez;
+    her biri kendi dosyasını yazar ve os.replace ile yerine koyar.
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix=os.path.basename(path) + '.', suffix='.tmp'
+    )
+    os.close(fd)
+    return tmp_path
+
+
+def _discard(tmp_path):
+    try:
+        os.remove(tmp_path)
+    except OSError:
+        pass
+
+
+class StoreLock:
+    """Depo kökü başına manifest / seri kilidi
+
+    Süreç içinde aynı kökü kullanan tüm DatasetStore örnekleri (uygulama oturumları,
+    klasör izleyici thread'i) tek bir RLock paylaşır; ayrı süreçler (ör. watch.py
+    komut satırı) arasında kökteki kilit dosyası fcntl.flock ile tutulur. İç içe
+    kullanımda dosya kilidi sadece en dıştaki girişte alınır.
+    """
+
+    def __init__(self, root):
+        self.path = os.path.join(root, LOCK_NAME)
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            try:
+                self._file = open(self.path, 'a')
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+            except BaseException:
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0 and self._file is not None:
+            try:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+            finally:
+                self._file.close()
+                self._file = None
+        self._thread_lock.release()
+
+
+_store_locks = {}
+_store_locks_guard = threading.Lock()
+
+
+def store_lock(root):
+    """Kök dizin için süreç genelinde paylaşılan StoreLock"""
+    with _store_locks_guard:
+        key = os.path.realpath(root)
+        if key not in _store_locks:
+            _store_locks[key] = StoreLock(root)
+        return _store_locks[key]
+
+
+class DatasetStore:
+    """İçerik adresli, diskte kalıcı kolonsal veri deposu"""
+
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+        # Örneğe değil köke bağlı: aynı depoyu açan tüm örnekler aynı kilidi kullanır
+        self._lock = store_lock(self.root)
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.root, MANIFEST_NAME)
+
+    def load_manifest(self):
+        """Manifest dosyasını oku (yoksa boş)"""
+        try:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_manifest(self, manifest):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def dataset_path(self, key, variant):
+        return os.path.join(self.root, key, f"{variant}.parquet")
+
+    def arrow_path(self, key, variant):
+        return os.path.join(self.root, key, f"{variant}.arrow")
+
+    def partitioned_path(self, key, variant):
+        return os.path.join(self.root, key, f"{variant}.parts")
+
+    def baseline_path(self, key, variant):
+        return os.path.join(self.root, key, f"{variant}.baseline.parquet")
+
+    def locate(self, path):
+        """Depo yolundan (anahtar, eşleştirme) çiftini çıkar (.parquet, .arrow, .parts)"""
+        variant = os.path.splitext(os.path.basename(os.path.normpath(path)))[0]
+        key = os.path.basename(os.path.dirname(os.path.normpath(path)))
+        return key, variant
+
+    def has(self, key, variant):
+        """Veri seti daha önce işlendi mi?"""
+        entry = self.load_manifest().get(key, {})
+        return variant in entry.get('variants', {}) and os.path.exists(self.dataset_path(key, variant))
+
+    def put(self, key, variant, write, file_name=None):
+        """write(path) ile Parquet üret, manifest'e satır sayısı ve şemayı kaydet
+
+        Dosya benzersiz bir geçici yola yazılır; aynı yüklemeyi eşzamanlı işleyen başka
+        bir oturum veri setini önce kaydettiyse bu kopya atılır ve onunki kullanılır.
+        """
+        path = self.dataset_path(key, variant)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = temp_path(path)
+        try:
+            write(tmp_path)
+            with self._lock:
+                if self.has(key, variant):
+                    _discard(tmp_path)
+                    return path
+                os.replace(tmp_path, path)
+
+                parquet_file = pq.ParquetFile(path)
+                info = {
+                    'path': os.path.relpath(path, self.root),
+                    'rows': parquet_file.metadata.num_rows,
+                    'schema': {field.name: str(field.type) for field in parquet_file.schema_arrow},
+                    'size_bytes': os.path.getsize(path),
+                    'ingested_at': datetime.now().isoformat(timespec='seconds'),
+                }
+                manifest = self.load_manifest()
+                entry = manifest.setdefault(key, {'file_name': file_name, 'variants': {}})
+                if file_name:
+                    entry['file_name'] = file_name
+                entry['variants'][variant] = info
+                self._save_manifest(manifest)
+        except BaseException:
+            _discard(tmp_path)
+            raise
+        return path
+
+    def put_bytes(self, key, variant, data, file_name=None):
+        """Hazır Parquet bytes'ını depoya yaz"""
+        def write(path):
+            with open(path, 'wb') as f:
+                f.write(data)
+        return self.put(key, variant, write, file_name=file_name)
+
+    def ensure_arrow(self, key, variant):
+        """Parquet kopyasından memory map ile açılabilecek sıkıştırmasız Arrow IPC dosyası üret"""
+        path = self.arrow_path(key, variant)
+        if not os.path.exists(path):
+            tmp_path = temp_path(path)
+            try:
+                table = pq.read_table(self.dataset_path(key, variant))
+                # Sıkıştırma olmadan yazılır, böylece okuma sırasında sayfalar kopyalanmaz
+                feather.write_feather(table, tmp_path, compression='uncompressed')
+            except BaseException:
+                _discard(tmp_path)
+                raise
+            with self._lock:
+                if os.path.exists(path):
+                    _discard(tmp_path)
+                else:
+                    os.replace(tmp_path, path)
+        return path
+
+    def ensure_partitioned(self, key, variant):
+        """Parquet kopyasını year=/month= bölümlü bir veri setine dönüştür"""
+        path = self.partitioned_path(key, variant)
+        if not os.path.isdir(path):
+            # Her çağrı kendi geçici dizinine yazar; başka bir çağrının yazdığı dizin silinmez
+            tmp_path = tempfile.mkdtemp(
+                dir=os.path.dirname(path), prefix=os.path.basename(path) + '.', suffix='.tmp'
+            )
+            try:
+                table = pq.read_table(self.dataset_path(key, variant))
+                table = table.append_column('year', pc.year(table['Tarih']).cast(pa.int16()))
+                table = table.append_column('month', pc.month(table['Tarih']).cast(pa.int8()))
+                ds.write_dataset(
+                    table, tmp_path, format='parquet', partitioning=PARTITIONING,
+                    basename_template='part-{i}.parquet', existing_data_behavior='overwrite_or_ignore'
+                )
+                with self._lock:
+                    if not os.path.isdir(path):
+                        os.replace(tmp_path, path)
+            finally:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+        return path
+
+    @property
+    def series_manifest_path(self):
+        return os.path.join(self.root, SERIES_NAME)
+
+    def series_path(self, variant):
+        """Güncel yıl serisinin year=/month= bölümlü dizini"""
+        return os.path.join(self.root, 'series', variant)
+
+    def load_series(self):
+        """Seri kayıtlarını oku (yoksa boş)"""
+        try:
+            with open(self.series_manifest_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_series(self, series):
+        tmp_path = self.series_manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(series, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.series_manifest_path)
+
+    def start_series(self, variant, baseline_keys, key, file_name=None):
+        """Tam analizden sonra seriyi başlat: geçmiş yıl anahtarlarını kaydet, güncel dosyayı ekle
+
+        Geçmiş yıl anahtarları aynıysa ve dosya seride zaten varsa seri olduğu gibi kalır;
+        sonradan eklenen aylar korunur. Seri sadece geçmiş yıllar veya ilk dosya değişince
+        sıfırlanır. Dönüş: (eklenen (yıl, ay) listesi, sıfırlamada atılan eklenmiş aylar).
+        """
+        with self._lock:
+            series = self.load_series()
+            entry = series.get(variant)
+            if (entry and entry['baseline'] == dict(baseline_keys)
+                    and any(source['key'] == key for source in entry['sources'])
+                    and os.path.isdir(self.series_path(variant))):
+                # Aynı dosyalarla tekrar çalıştırıldı, seri zaten bu haliyle kayıtlı
+                return [], []
+            discarded = sorted({
+                tuple(month) for source in (entry or {}).get('sources', [])[1:] for month in source['months']
+            })
+            shutil.rmtree(self.series_path(variant), ignore_errors=True)
+            series[variant] = {'baseline': dict(baseline_keys), 'months': [], 'sources': []}
+            self._save_series(series)
+        return self.append_series(variant, key, file_name=file_name), discarded
+
+    def append_series(self, variant, key, file_name=None):
+        """Depodaki aylık dosyayı seriye ekle; dönüş: seride daha önce olmayan (yıl, ay) listesi
+
+        Dosyada seride zaten olan aylar varsa o ayların bölümleri yeni veriyle değiştirilir.
+        """
+        table = pq.read_table(self.dataset_path(key, variant))
+        table = table.append_column('year', pc.year(table['Tarih']).cast(pa.int16()))
+        table = table.append_column('month', pc.month(table['Tarih']).cast(pa.int8()))
+        months = sorted({
+            (int(y), int(m)) for y, m in zip(
+                table['year'].to_pylist(), table['month'].to_pylist()
+            )
+        })
+
+        with self._lock:
+            ds.write_dataset(
+                table, self.series_path(variant), format='parquet', partitioning=PARTITIONING,
+                basename_template=f"{key[:16]}-{{i}}.parquet",
+                existing_data_behavior='delete_matching'
+            )
+            series = self.load_series()
+            entry = series.setdefault(variant, {'baseline': {}, 'months': [], 'sources': []})
+            known = {tuple(month) for month in entry['months']}
+            added = [month for month in months if month not in known]
+            entry['months'] = sorted(known | set(months))
+            entry['sources'].append({
+                'key': key, 'file_name': file_name, 'months': months,
+                'appended_at': datetime.now().isoformat(timespec='seconds'),
+            })
+            self._save_series(series)
+        return added
+
+    def ensure_baseline(self, key, variant, compute):
+        """Kısmi toplam tablosunu (baseline.py) diskten oku; yoksa compute() ile üretip kaydet"""
+        path = self.baseline_path(key, variant)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Hesap kilit dışında yapılır; kilit sadece yerine koyma ve manifest için tutulur
+            tmp_path = temp_path(path)
+            try:
+                pq.write_table(compute(), tmp_path, compression='snappy')
+            except BaseException:
+                _discard(tmp_path)
+                raise
+            with self._lock:
+                if os.path.exists(path):
+                    # Aynı tabloyu eşzamanlı hesaplayan başka bir oturum önce kaydetti
+                    _discard(tmp_path)
+                    return pq.read_table(path)
+                os.replace(tmp_path, path)
+                manifest = self.load_manifest()
+                entry = manifest.setdefault(key, {'file_name': None, 'variants': {}})
+                entry.setdefault('baselines', {})[variant] = {
+                    'path': os.path.relpath(path, self.root),
+                    'rows': pq.ParquetFile(path).metadata.num_rows,
+                    'size_bytes': os.path.getsize(path),
+                    'ingested_at': datetime.now().isoformat(timespec='seconds'),
+                }
+                self._save_manifest(manifest)
+        return pq.read_table(path)
+
+    def evict(self, key=None, older_than_days=None):
+        """Veri setlerini sil; key yoksa tüm eskileri (veya hepsini) temizle"""
+        with self._lock:
+            manifest = self.load_manifest()
+            cutoff = None
+            if older_than_days is not None:
+                cutoff = datetime.now() - timedelta(days=older_than_days)
+
+            removed = []
+            for entry_key in list(manifest):
+                if key is not None and entry_key != key:
+                    continue
+                if cutoff is not None:
+                    entry = manifest[entry_key]
+                    newest = max(
+                        (datetime.fromisoformat(v['ingested_at'])
+                         for v in [*entry['variants'].values(), *entry.get('baselines', {}).values()]),
+                        default=datetime.min
+                    )
+                    if newest >= cutoff:
+                        continue
+                shutil.rmtree(os.path.join(self.root, entry_key), ignore_errors=True)
+                del manifest[entry_key]
+                removed.append(entry_key)
+
+            self._save_manifest(manifest)
+        return removed
+
+
+def schema_names(path):
+    """Depodaki veri setinin sütun adları (veri okunmadan)"""
+    if os.path.isdir(path):
+        return ds.dataset(path, format='parquet', partitioning=PARTITIONING).schema.names
+    if path.endswith('.arrow'):
+        with pa.memory_map(path) as source:
+            return pa.ipc.open_file(source).schema.names
+    return pq.read_schema(path).names
+
+
+def read_table(path, columns=None, year=None, months=None, positive_only=False):
+    """Depodaki veri setini oku; yıl, ay ve tüketim filtreleri okuma sırasında uygulanır
+
+    Bölümlü dizinlerde filtreler dosya ve row group seviyesine itilir, Arrow IPC
+    dosyaları memory map ile açılır.
+    """
+    if os.path.isdir(path):
+        dataset = ds.dataset(path, format='parquet', partitioning=PARTITIONING)
+        expression = None
+        if year is not None:
+            expression = ds.field('year') == year
+        if months:
+            month_expression = ds.field('month').isin(list(months))
+            expression = month_expression if expression is None else expression & month_expression
+        if positive_only:
+            positive = ds.field('Tuketim') > 0
+            expression = positive if expression is None else expression & positive
+        return dataset.to_table(columns=columns, filter=expression)
+
+    if path.endswith('.arrow'):
+        table = feather.read_table(path, columns=columns, memory_map=True)
+    else:
+        table = pq.read_table(path, columns=columns)
+
+    # Filtreler Arrow üzerinde uygulanır, pandas'a sadece kalan satırlar çevrilir
+    mask = None
+    if year is not None:
+        mask = pc.equal(pc.year(table['Tarih']), year)
+    if months:
+        month_mask = pc.is_in(pc.month(table['Tarih']), value_set=pa.array(list(months), pa.int64()))
+        mask = month_mask if mask is None else pc.and_(mask, month_mask)
+    if positive_only:
+        positive = pc.greater(table['Tuketim'], 0)
+        mask = positive if mask is None else pc.and_(mask, positive)
+    if mask is not None:
+        table = table.filter(mask)
+    return table
+
+
+def iter_batches(path, columns=None, year=None, positive_only=False, batch_size=BATCH_ROWS):
+    """Veri setini Arrow RecordBatch parçaları halinde oku; bellekte tek parça tutulur"""
+    if os.path.isdir(path):
+        dataset = ds.dataset(path, format='parquet', partitioning=PARTITIONING)
+        year_field = ds.field('year')
+    else:
+        dataset = ds.dataset(path, format='ipc' if path.endswith('.arrow') else 'parquet')
+        year_field = pc.year(ds.field('Tarih'))
+
+    expression = None
+    if year is not None:
+        expression = year_field == year
+    if positive_only:
+        positive = ds.field('Tuketim') > 0
+        expression = positive if expression is None else expression & positive
+    yield from dataset.to_batches(columns=columns, filter=expression, batch_size=batch_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Veri deposu yönetimi")
+    parser.add_argument('--root', default=STORE_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help="Depodaki veri setlerini listele")
+    evict_parser = commands.add_parser('evict', help="Veri setlerini sil")
+    evict_parser.add_argument('--key', help="Sadece bu SHA-256 anahtarını sil")
+    evict_parser.add_argument('--older-than', type=float, metavar='GÜN',
+                              help="Bu kadar günden eski veri setlerini sil")
+    evict_parser.add_argument('--all', action='store_true', help="Tüm depoyu temizle")
+    args = parser.parse_args()
+
+    store = DatasetStore(args.root)
+    if args.command == 'list':
+        for key, entry in store.load_manifest().items():
+            for variant, info in entry['variants'].items():
+                print(f"{key[:12]}  {variant}  {info['rows']:>10,} satır  "
+                      f"{info['ingested_at']}  {entry.get('file_name') or ''}")
+        for variant, entry in store.load_series().items():
+            months = ", ".join(f"{year}-{month:02d}" for year, month in entry['months'])
+            print(f"seri  {variant}  {len(entry['sources'])} dosya  aylar: {months}")
+    else:
+        if not (args.key or args.older_than is not None or args.all):
+            parser.error("evict için --key, --older-than veya --all gerekli")
+        removed = store.evict(key=args.key, older_than_days=args.older_than)
+        print(f"{len(removed)} veri seti silindi")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+from baseline import combine_baseline, partial_aggregates, seasonal_matrix
+from parsers import normalize_ids
+from registry import ID_COLUMN
+
+
+def raw_rows(year, seed):
+    """Bir yılın temizlenmiş satırları: 5 tesisat, her ay birkaç okuma, arada sıfırlar"""
+    rng = np.random.default_rng(seed)
+    count = 400
+    df = pd.DataFrame({
+        'TN': rng.choice(['10', '11', '12', '13', '14'], count),
+        'Tarih': pd.to_datetime({'year': year, 'month': rng.integers(1, 13, count), 'day': 1}),
+        'Tuketim': np.where(rng.random(count) < 0.1, 0.0, rng.gamma(2.0, 50.0, count).round(2)),
+    })
+    df['Sozlesme_No'] = 'S' + df['TN']
+    for col in ('TN', 'Sozlesme_No'):
+        df[col] = normalize_ids(df[col])
+    return df
+
+
+def exact_baseline(rows, min_count):
+    grouped = rows[rows['Tuketim'] > 0].groupby(['TN', 'Sozlesme_No'], observed=True)['Tuketim']
+    exact = grouped.agg(['mean', 'count', 'std', 'min', 'max']).reset_index()
+    return exact[exact['count'] >= min_count].reset_index(drop=True)
+
+
+def test_combined_partials_match_exact_groupby_of_raw_rows():
+    years = [raw_rows(2023, 1), raw_rows(2024, 2)]
+    result = combine_baseline([partial_aggregates(df) for df in years], min_count=2)
+    exact = exact_baseline(pd.concat(years, ignore_index=True), min_count=2)
+
+    result = result.sort_values('TN').reset_index(drop=True)
+    assert list(result['TN'].astype(str)) == list(exact['TN'].astype(str))
+    np.testing.assert_allclose(result['Ortalama_Tuketim'], exact['mean'], rtol=1e-12)
+    np.testing.assert_allclose(result['Standart_Sapma'], exact['std'], rtol=1e-9)
+    assert list(result['Adet']) == list(exact['count'])
+    assert list(result['Min']) == list(exact['min']) and list(result['Max']) == list(exact['max'])
+
+
+def test_year_and_month_filters_select_partials_without_raw_rows():
+    years = [raw_rows(2023, 3), raw_rows(2024, 4)]
+    partials = [partial_aggregates(df) for df in years]
+    rows = pd.concat(years, ignore_index=True)
+
+    result = combine_baseline(partials, years=[2024], months=[1, 2, 3])
+    subset = rows[(rows['Tarih'].dt.year == 2024) & rows['Tarih'].dt.month.isin([1, 2, 3])]
+    exact = exact_baseline(subset, min_count=1)
+    np.testing.assert_allclose(
+        result.sort_values('TN')['Ortalama_Tuketim'], exact['mean'], rtol=1e-12
+    )
+
+
+def test_seasonal_matrix_holds_monthly_means_per_installation():
+    rows = raw_rows(2023, 5)
+    rows[ID_COLUMN] = rows['TN'].cat.codes.astype('int32')
+    partials = partial_aggregates(rows).merge(
+        rows[['TN', ID_COLUMN]].drop_duplicates(), on='TN'
+    )
+    matrix = seasonal_matrix([partials])
+
+    positive = rows[rows['Tuketim'] > 0]
+    exact = positive.groupby([ID_COLUMN, positive['Tarih'].dt.month])['Tuketim'].mean()
+    for (id_, month), mean in exact.items():
+        assert np.isclose(matrix[id_, month - 1], mean, rtol=1e-12)
+    assert np.isnan(matrix).sum() == matrix.size - len(exact)
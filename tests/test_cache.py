@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+from cache import ByteLRUCache
+
+MATRIX = np.arange(24, dtype='float64').reshape(2, 12)
+
+
+def test_evicted_array_is_spilled_and_reloaded_memory_mapped(tmp_path):
+    cache = ByteLRUCache(budget_bytes=MATRIX.nbytes, spill_dir=str(tmp_path))
+    cache.put('matris', MATRIX)
+    cache.put('tablo', pd.DataFrame({'a': [1.0]}))
+
+    value = cache.get('matris')
+    assert isinstance(value, np.memmap)
+    assert np.array_equal(value, MATRIX)
+    assert cache.stats()['spill_hits'] == 1
+
+
+def test_evicted_frame_round_trips_through_spill(tmp_path):
+    frame = pd.DataFrame({'Tesisat_ID': [1, 2], 'Ortalama_Tuketim': [1.5, 2.5]})
+    cache = ByteLRUCache(budget_bytes=frame.memory_usage(deep=True).sum(), spill_dir=str(tmp_path))
+    cache.put('a', frame)
+    cache.put('b', frame)
+    pd.testing.assert_frame_equal(cache.get('a'), frame)
+
+
+def test_entry_larger_than_budget_is_returned_uncached(tmp_path):
+    cache = ByteLRUCache(budget_bytes=MATRIX.nbytes - 1, spill_dir=str(tmp_path))
+    assert cache.put('matris', MATRIX) is MATRIX
+    stats = cache.stats()
+    assert (stats['entries'], stats['spilled_entries'], stats['spilled']) == (0, 0, 0)
+    assert stats['oversized'] == 1
+    assert cache.get('matris') is None
+
+
+def test_shared_frame_changes_do_not_reach_the_cache(tmp_path):
+    cache = ByteLRUCache(spill_dir=str(tmp_path))
+    cache.put('tablo', pd.DataFrame({'Tarih': pd.to_datetime(['2025-01-01']), 'Tuketim': [1.0]}))
+    df = cache.get('tablo')
+    df['Ay_Kodu'] = 1
+    df.loc[0, 'Tuketim'] = 99.0
+    cached = cache.get('tablo')
+    assert list(cached.columns) == ['Tarih', 'Tuketim']
+    assert cached.loc[0, 'Tuketim'] == 1.0
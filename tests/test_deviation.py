@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+from deviation import DEVIATION_COLUMNS, DeviationIndex, deviation_table
+from parsers import normalize_ids, period_codes
+
+
+def results_with(percentages):
+    return pd.DataFrame({'TN': [str(i) for i in range(len(percentages))],
+                         'Sapma_Yüzdesi': percentages})
+
+
+def test_count_at_least_matches_a_full_scan():
+    rng = np.random.default_rng(0)
+    percentages = rng.normal(20, 40, 500).round(1)
+    percentages[::17] = np.nan
+    index = DeviationIndex(results_with(percentages))
+
+    for threshold in (-50, 0, 10, 20.5, 55.3, 200, np.nanmax(percentages)):
+        assert index.count_at_least(threshold) == int((percentages >= threshold).sum())
+    assert index.max() == np.nanmax(percentages)
+
+
+def test_at_least_returns_highest_deviations_first_and_respects_limit():
+    index = DeviationIndex(results_with([10.0, np.nan, 75.0, 30.0, 75.0]))
+    top = index.at_least(30)
+    assert list(top['Sapma_Yüzdesi']) == [75.0, 75.0, 30.0]
+    # Eşit sapmalarda özgün sıra korunur
+    assert list(top['TN']) == ['2', '4', '3']
+    assert len(index.at_least(0, limit=2)) == 2
+    assert len(index) == 5
+
+
+def test_empty_analysis_has_no_rows_at_any_threshold():
+    index = DeviationIndex(pd.DataFrame())
+    assert len(index) == 0 and index.count_at_least(0) == 0
+    assert np.isnan(index.max())
+
+
+def test_deviation_table_joins_current_rows_to_their_average():
+    historical = pd.DataFrame({'TN': ['1', '2', '3'], 'Sozlesme_No': ['A', 'B', 'C'],
+                               'Ortalama_Tuketim': [100.0, 50.0, 0.0]})
+    current = pd.DataFrame({'TN': ['2', '1', '3', '9'], 'Sozlesme_No': ['B', 'A', 'C', 'Z'],
+                            'Tarih': pd.to_datetime(['2025-01-01', '2025-02-01', '2025-01-01', '2025-01-01']),
+                            'Tuketim': [80.0, 90.0, 5.0, 1.0]})
+    for frame in (historical, current):
+        for col in ('TN', 'Sozlesme_No'):
+            frame[col] = normalize_ids(frame[col])
+    current['Ay_Kodu'] = period_codes(current['Tarih'])
+
+    table = deviation_table(historical, current)
+    assert list(table.columns) == DEVIATION_COLUMNS
+    assert list(table['TN'].astype(str)) == ['2', '1']
+    assert list(table['Ay']) == ['2025-01', '2025-02']
+    np.testing.assert_allclose(table['Sapma_Yüzdesi'], [60.0, -10.0])
@@ -0,0 +1,44 @@
+from datetime import datetime
+from io import BytesIO
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from ingest import parse_uploaded, project, stream_excel_to_parquet
+from parsers import clean_rows
+
+COLUMNS = ['TN', 'Tüketim', 'Tarih', 'Sözleşme']
+
+
+def workbook():
+    """Tarih ve tüketim kodlamaları karışık, 11 satırlık bir yükleme"""
+    frame = pd.DataFrame({
+        'TN': [str(100 + i % 4) for i in range(11)],
+        'Tüketim': ['12,5', 30, '1.250,75', '', 7.25, '890,25 m³', 0, '45', '3,5', 'yok', 18],
+        'Tarih': [datetime(2024, 1 + i % 12, 1) if i % 3 else f"{1 + i % 28:02d}.{1 + i % 12:02d}.2024"
+                  for i in range(11)],
+        'Sözleşme': [f"S{i % 4}" for i in range(11)],
+    })
+    file_obj = BytesIO()
+    frame.to_excel(file_obj, index=False, engine='openpyxl')
+    file_obj.name = 'akis.xlsx'
+    file_obj.seek(0)
+    return file_obj
+
+
+def test_streamed_chunks_match_a_full_read():
+    file_obj = workbook()
+    full = project(parse_uploaded(file_obj), COLUMNS)
+    full.columns = ['TN', 'Tuketim', 'Tarih', 'Sozlesme_No']
+    expected = clean_rows(full)
+
+    sink = pa.BufferOutputStream()
+    stats = stream_excel_to_parquet(file_obj, sink, *COLUMNS, chunk_size=3)
+    streamed = pq.read_table(pa.BufferReader(sink.getvalue())).to_pandas()
+
+    assert stats['row_groups'] == 4 and stats['rows_read'] == 11
+    assert stats['rows_kept'] == len(streamed) == len(expected)
+    assert list(streamed['Tuketim']) == list(expected['Tuketim'])
+    assert list(streamed['Tarih']) == list(expected['Tarih'])
+    assert list(streamed['TN'].astype(str)) == list(expected['TN'].astype(str))
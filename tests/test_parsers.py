@@ -0,0 +1,95 @@
+from datetime import datetime
+from io import BytesIO
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from ingest import parse_uploaded, project, stream_excel_to_parquet
+from parsers import clean_rows, decode_dates, parse_consumption
+
+EXPECTED = pd.to_datetime(['2023-02-01', '2023-05-10', '2023-03-15', '2023-04-01'])
+
+
+def mixed_dates():
+    """Aynı sütunda gerçek tarihler ve gg.aa.yyyy metinleri"""
+    return [datetime(2023, 2, 1), datetime(2023, 5, 10), '15.03.2023', '01.04.2023']
+
+
+def test_decode_dates_keeps_iso_text_month_first():
+    # Metne çevrilmiş datetime değerleri ISO biçimindedir; gün-önce okunmamalı
+    series = pd.Series(['2023-02-01 00:00:00', '2023-05-10 00:00:00', '15.03.2023', '01.04.2023'])
+    decoded = decode_dates(series, cache_key='test_iso_text')
+    assert list(decoded) == list(EXPECTED)
+
+
+def test_number_like_text_tries_explicit_formats_before_serials():
+    series = pd.Series(['01.2023', '2023', True, '45000', 45000], dtype=object)
+    decoded = decode_dates(series, cache_key='test_number_like')
+    assert list(decoded[:2]) == [pd.Timestamp('2023-01-01')] * 2
+    assert pd.isna(decoded[2])
+    assert list(decoded[3:]) == [pd.Timestamp('2023-03-15')] * 2
+
+def test_uploaded_mixed_date_column_cleans_to_correct_dates():
+    frame = pd.DataFrame({
+        'TN': ['1', '2', '3', '4'],
+        'Tüketim': [10.0, 20.0, 30.0, 40.0],
+        'Tarih': pd.Series(mixed_dates(), dtype=object),
+        'Sözleşme': ['S1', 'S2', 'S3', 'S4'],
+    })
+    file_obj = BytesIO()
+    frame.to_excel(file_obj, index=False, engine='openpyxl')
+    file_obj.name = 'karisik_tarih.xlsx'
+    file_obj.seek(0)
+
+    df = project(parse_uploaded(file_obj), ['TN', 'Tüketim', 'Tarih', 'Sözleşme'])
+    df.columns = ['TN', 'Tuketim', 'Tarih', 'Sozlesme_No']
+    cleaned = clean_rows(df)
+
+    assert list(cleaned.sort_values('Tuketim')['Tarih']) == list(EXPECTED)
+
+
+def test_thousands_convention_is_fixed_across_chunks():
+    # "1.250" ilk parçada ondalık okunduysa sonraki parçada da aynı sayı olmalı
+    convention = {}
+    first = parse_consumption(pd.Series(['1.250', '3']), convention=convention)
+    second = parse_consumption(pd.Series(['2,5', '1.250']), convention=convention)
+    assert first[0] == second[1] == 1.25
+
+
+def test_streamed_workbook_parses_same_value_identically_in_every_row_group():
+    frame = pd.DataFrame({
+        'TN': ['1', '2', '3', '4'],
+        'Tüketim': ['1.250', '7', '2,5', '1.250'],
+        'Tarih': ['01.01.2023'] * 4,
+        'Sözleşme': ['S1', 'S2', 'S3', 'S4'],
+    })
+    file_obj = BytesIO()
+    frame.to_excel(file_obj, index=False, engine='openpyxl')
+    file_obj.name = 'parcali.xlsx'
+    file_obj.seek(0)
+
+    sink = pa.BufferOutputStream()
+    stats = stream_excel_to_parquet(file_obj, sink, 'TN', 'Tüketim', 'Tarih', 'Sözleşme', chunk_size=2)
+    table = pq.read_table(pa.BufferReader(sink.getvalue()))
+
+    assert stats['row_groups'] == 2
+    values = dict(zip(table['TN'].to_pylist(), table['Tuketim'].to_pylist()))
+    assert values['1'] == values['4']
+
+
+def test_comma_groups_are_decimals_in_a_decimal_comma_column():
+    # Sütunda "2,5" ve "1.250,50" varken "1,250" bin değil 1,25 m³'tür
+    values = parse_consumption(pd.Series(['2,5', '1.250,50', '1,250', '890,250 m³', '1,250.50']))
+    assert list(values) == [2.5, 1250.5, 1.25, 890.25, 1250.5]
+
+
+def test_comma_groups_stay_thousands_without_decimal_comma():
+    values = parse_consumption(pd.Series(['1,250', '12,345,678', '7']))
+    assert list(values) == [1250.0, 12345678.0, 7.0]
+
+
+def test_decimal_comma_convention_carries_to_later_chunks():
+    convention = {}
+    parse_consumption(pd.Series(['2,5']), convention=convention)
+    assert parse_consumption(pd.Series(['1,250']), convention=convention)[0] == 1.25
@@ -0,0 +1,44 @@
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+from registry import InstallationRegistry
+
+
+def _assign_pairs(root, worker):
+    """Ayrı süreçte 60 yeni çift ve herkesle ortak 5 çift numaralandır"""
+    registry = InstallationRegistry(root)
+    tn = [f"{worker}-{i}" for i in range(60)] + [f"ORTAK-{i}" for i in range(5)]
+    ids = []
+    for start in range(0, len(tn), 7):
+        chunk = pd.Series(tn[start:start + 7])
+        ids.extend(registry.assign(chunk, 'S-' + chunk).tolist())
+    return dict(zip(tn, ids))
+
+
+def test_ids_stay_stable_when_processes_add_pairs_concurrently(tmp_path):
+    root = str(tmp_path)
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(4) as pool:
+        results = pool.starmap(_assign_pairs, [(root, worker) for worker in range(4)])
+
+    registry = InstallationRegistry(root)
+    assert len(registry) == 4 * 60 + 5
+
+    assigned = {}
+    for result in results:
+        for tn, id_ in result.items():
+            assert assigned.setdefault(tn, id_) == id_
+    ids = np.array(list(assigned.values()))
+    names = registry.names(ids)
+    assert list(names['TN'].astype(str)) == list(assigned)
+    assert list(names['Sozlesme_No'].astype(str)) == ['S-' + tn for tn in assigned]
+
+
+def test_refresh_sees_rows_added_by_another_instance(tmp_path):
+    first, second = InstallationRegistry(str(tmp_path)), InstallationRegistry(str(tmp_path))
+    a = first.assign(pd.Series(['1']), pd.Series(['A']))
+    b = second.assign(pd.Series(['2']), pd.Series(['B']))
+    assert (a[0], b[0]) == (0, 1)
+    assert first.assign(pd.Series(['2', '1']), pd.Series(['B', 'A'])).tolist() == [1, 0]
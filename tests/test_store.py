@@ -0,0 +1,124 @@
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from store import DatasetStore, read_table
+
+TABLE = pa.table({'TN': ['1', '2'], 'Tuketim': [1.5, 2.5]})
+
+
+def write_table(path):
+    pq.write_table(TABLE, path)
+
+
+def test_put_has_and_evict(tmp_path):
+    store = DatasetStore(str(tmp_path))
+    assert not store.has('k1', 'v')
+    path = store.put('k1', 'v', write_table, file_name='a.xlsx')
+    store.put('k2', 'v', write_table)
+
+    assert store.has('k1', 'v')
+    assert pq.read_table(path).equals(TABLE)
+    entry = store.load_manifest()['k1']
+    assert entry['file_name'] == 'a.xlsx'
+    assert entry['variants']['v']['rows'] == 2
+
+    assert store.evict(key='k1') == ['k1']
+    assert not store.has('k1', 'v') and store.has('k2', 'v')
+    assert store.evict(older_than_days=1) == []
+    assert store.evict() == ['k2']
+    assert store.load_manifest() == {}
+
+
+def test_concurrent_put_of_same_upload_keeps_one_copy(tmp_path):
+    store = DatasetStore(str(tmp_path))
+    barrier = threading.Barrier(4)
+
+    def write(path):
+        # Tüm oturumlar yazmayı aynı anda bitirir, sonra yerine koymaya çalışır
+        write_table(path)
+        barrier.wait()
+
+    with ThreadPoolExecutor(4) as pool:
+        paths = list(pool.map(lambda _: store.put('k', 'v', write), range(4)))
+
+    assert len(set(paths)) == 1
+    assert pq.read_table(paths[0]).equals(TABLE)
+    assert [name for name in (tmp_path / 'k').iterdir() if name.suffix == '.tmp'] == []
+
+
+def test_concurrent_ensure_baseline_computes_once_per_session(tmp_path):
+    store = DatasetStore(str(tmp_path))
+    barrier = threading.Barrier(4)
+
+    # Yazım birkaç milisaniye sürsün diye büyük tablo; eşzamanlı yazımlar çakışır
+    big = pa.table({'Tuketim': pa.array(range(1_000_000), pa.float64())})
+
+    def compute():
+        barrier.wait()
+        return big
+
+    with ThreadPoolExecutor(4) as pool:
+        tables = list(pool.map(lambda _: store.ensure_baseline('k', 'v', compute), range(4)))
+
+    assert all(table.equals(big) for table in tables)
+    assert store.load_manifest()['k']['baselines']['v']['rows'] == big.num_rows
+    assert [name for name in (tmp_path / 'k').iterdir() if name.suffix == '.tmp'] == []
+
+
+def test_concurrent_ensure_arrow_produces_one_file(tmp_path):
+    store = DatasetStore(str(tmp_path))
+    big = pa.table({'Tuketim': pa.array(range(1_000_000), pa.float64())})
+    store.put('k', 'v', lambda path: pq.write_table(big, path))
+
+    with ThreadPoolExecutor(4) as pool:
+        paths = list(pool.map(lambda _: store.ensure_arrow('k', 'v'), range(4)))
+
+    assert len(set(paths)) == 1
+    with pa.memory_map(paths[0]) as source:
+        assert pa.ipc.open_file(source).read_all().equals(big)
+    assert [name for name in (tmp_path / 'k').iterdir() if name.suffix == '.tmp'] == []
+
+
+def test_concurrent_ensure_partitioned_keeps_a_complete_dataset(tmp_path):
+    store = DatasetStore(str(tmp_path))
+    dates = pa.array([datetime(2024, 1 + i % 12, 1) for i in range(120_000)], pa.timestamp('ns'))
+    table = pa.table({'Tarih': dates, 'Tuketim': pa.array(range(120_000), pa.float64())})
+    store.put('k', 'v', lambda path: pq.write_table(table, path))
+
+    with ThreadPoolExecutor(4) as pool:
+        paths = list(pool.map(lambda _: store.ensure_partitioned('k', 'v'), range(4)))
+
+    assert len(set(paths)) == 1
+    assert read_table(paths[0]).num_rows == table.num_rows
+    assert read_table(paths[0], year=2024, months=[3]).num_rows == 10_000
+    assert [name for name in (tmp_path / 'k').iterdir() if name.suffix == '.tmp'] == []
+
+
+def put_months(store, key, months):
+    dates = pa.array([datetime(2025, month, 1) for month in months], pa.timestamp('ns'))
+    table = pa.table({'Tarih': dates, 'Tuketim': pa.array([1.0] * len(months))})
+    store.put(key, 'v', lambda path: pq.write_table(table, path))
+
+
+def test_rerunning_full_analysis_keeps_appended_months(tmp_path):
+    store = DatasetStore(str(tmp_path))
+    put_months(store, 'ocak-subat', [1, 2])
+    put_months(store, 'mart', [3])
+    put_months(store, 'ocak-nisan', [1, 4])
+    baseline = {'2023': 'a', '2024': 'b'}
+
+    assert store.start_series('v', baseline, 'ocak-subat') == ([(2025, 1), (2025, 2)], [])
+    assert store.append_series('v', 'mart') == [(2025, 3)]
+    # Aynı geçmiş yıllar ve aynı güncel dosya: eklenen mart korunur
+    assert store.start_series('v', baseline, 'ocak-subat') == ([], [])
+    assert store.load_series()['v']['months'] == [[2025, 1], [2025, 2], [2025, 3]]
+    assert read_table(store.series_path('v')).num_rows == 3
+
+    # İlk dosya değişti: seri sıfırlanır, atılan eklenmiş aylar bildirilir
+    added, discarded = store.start_series('v', baseline, 'ocak-nisan')
+    assert (added, discarded) == ([(2025, 1), (2025, 4)], [(2025, 3)])
+    assert read_table(store.series_path('v')).num_rows == 2
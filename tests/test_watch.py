@@ -0,0 +1,80 @@
+import os
+import threading
+from datetime import datetime
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+import ingest
+import watch
+from ingest import parse_uploaded, stream_raw_to_parquet
+from store import DatasetStore
+from watch import write_raw_parquet
+
+
+def test_raw_copy_streams_every_sheet_and_widens_changing_types(tmp_path):
+    path = tmp_path / 'iki_sayfa.xlsx'
+    with pd.ExcelWriter(path) as writer:
+        pd.DataFrame({
+            'TN': ['1', '2', '3'],
+            'Tüketim': [1, 2, 3.5],
+            'Tarih': [datetime(2024, 1, day) for day in (1, 2, 3)],
+        }).to_excel(writer, sheet_name='Ocak', index=False)
+        pd.DataFrame({'TN': ['4'], 'Tüketim': [4], 'Ek': ['x']}).to_excel(
+            writer, sheet_name='Şubat', index=False
+        )
+    out_path = tmp_path / 'kaynak.parquet'
+
+    with open(path, 'rb') as f:
+        rows = stream_raw_to_parquet(f, str(out_path), chunk_size=2)
+    table = pq.read_table(out_path)
+
+    assert rows == table.num_rows == 4
+    assert pq.ParquetFile(out_path).metadata.num_row_groups == 3
+    assert table['Tüketim'].to_pylist() == [1.0, 2.0, 3.5, 4.0]
+    assert table['Ek'].to_pylist() == [None, None, None, 'x']
+    assert table['Kaynak'].to_pylist()[-1] == 'iki_sayfa.xlsx / Şubat'
+    assert write_raw_parquet(str(path), str(out_path)) == 4
+
+
+def test_streaming_paths_do_not_use_calamine_for_xlsx(tmp_path, monkeypatch):
+    class Calamine:
+        class CalamineWorkbook:
+            @staticmethod
+            def from_filelike(file_obj):
+                raise AssertionError("calamine sayfayı bütünüyle belleğe alır")
+
+    monkeypatch.setattr(ingest, 'python_calamine', Calamine)
+    path = tmp_path / 'tek.xlsx'
+    pd.DataFrame({'TN': ['1'], 'Tüketim': [1.5]}).to_excel(path, index=False)
+
+    assert ingest.excel_engine() == 'calamine'
+    with open(path, 'rb') as f:
+        assert stream_raw_to_parquet(f, str(tmp_path / 'out.parquet')) == 1
+
+
+def test_watcher_snapshot_and_stored_file_read_from_disk(tmp_path, monkeypatch):
+    monkeypatch.setattr(watch, 'SETTLE_SECONDS', 0)
+    folder = tmp_path / 'gelen'
+    folder.mkdir()
+    frame = pd.DataFrame({'TN': ['1', '2'], 'Tüketim': [1.5, 2.5]})
+    for i in range(20):
+        frame.to_csv(folder / f"dosya{i}.csv", index=False)
+    watcher = watch.FolderWatcher(str(folder), store=DatasetStore(str(tmp_path / 'depo')))
+
+    # Tarama sürerken durumlar gezilir; sözlük boyutu değişse de hata olmamalı
+    scanner = threading.Thread(target=watcher.scan)
+    scanner.start()
+    while scanner.is_alive():
+        for name, status in sorted(watcher.snapshot().items()):
+            assert status['state'] in ('işleniyor', 'hazır')
+    scanner.join()
+    statuses = watcher.snapshot()
+    assert len(statuses) == 20 and {s['state'] for s in statuses.values()} == {'hazır'}
+
+    source = watch.stored_sources(watcher.store)[0]
+    stored = watch.StoredFile(watcher.store, source['key'], source['file_name'])
+    table = parse_uploaded(stored)
+    assert table.num_rows == 2
+    assert stored._file is None
+    assert os.path.exists(stored.path)
@@ -0,0 +1,217 @@
+import argparse
+import os
+import threading
+import time
+from datetime import datetime
+from ingest import SUPPORTED_TYPES, stream_raw_to_parquet
+from store import DatasetStore, file_sha256
+
+# Sunucu tarafında taranan klasör (SAPMA_WATCH_DIR ile değiştirilebilir); dosyalar
+# tarayıcıdan yüklenmek yerine buraya kopyalanır
+WATCH_DIR = os.environ.get(
+    'SAPMA_WATCH_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gelen_veriler')
+)
+# Arka planda klasörün yoklanma aralığı (saniye)
+POLL_SECONDS = float(os.environ.get('SAPMA_WATCH_POLL', 30))
+# Son değişikliğinden bu kadar saniye geçmemiş dosyalar hâlâ kopyalanıyor sayılır
+SETTLE_SECONDS = 5
+
+# Klasörden alınan dosyaların sütun eşleştirmesinden bağımsız, tam tablo kopyası
+RAW_VARIANT = 'kaynak'
+
+
+def watched_files(watch_dir=WATCH_DIR):
+    """Klasördeki desteklenen dosyalar: {yol: (boyut, değişiklik zamanı ns)}"""
+    files = {}
+    if not os.path.isdir(watch_dir):
+        return files
+    for entry in os.scandir(watch_dir):
+        if not entry.is_file() or entry.name.startswith(('.', '~$')):
+            continue
+        if entry.name.lower().rsplit('.', 1)[-1] not in SUPPORTED_TYPES:
+            continue
+        stat = entry.stat()
+        files[entry.path] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def write_raw_parquet(path, out_path):
+    """Kaynak dosyanın tüm sayfalarını parça parça tipli Parquet olarak yaz"""
+    with open(path, 'rb') as f:
+        return stream_raw_to_parquet(f, out_path)
+
+
+class FolderWatcher:
+    """Klasörü yoklayıp yeni ve değişen dosyaları arka planda depoya alır
+
+    Her dosya içerik SHA-256'sı ile RAW_VARIANT olarak depolanır; aynı içerik ikinci
+    kez işlenmez. Değişen dosya yeni bir anahtarla eklenir, eski sürüm depoda kalır.
+    """
+
+    def __init__(self, watch_dir=WATCH_DIR, store=None, poll_seconds=POLL_SECONDS):
+        self.watch_dir = watch_dir
+        self.store = store or DatasetStore()
+        self.poll_seconds = poll_seconds
+        self.status = {}  # dosya adı -> {'state', 'key', 'rows', 'error', 'at'}
+        # status arka plan thread'inde güncellenir; arayüz snapshot() ile kopyasını okur
+        self._status_lock = threading.Lock()
+        self._seen = {}  # yol -> (boyut, değişiklik zamanı ns)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def pending(self):
+        """Son taramadan beri eklenen veya değişen, kopyalanması bitmiş dosyalar"""
+        now_ns = time.time_ns()
+        return [
+            path for path, signature in watched_files(self.watch_dir).items()
+            if self._seen.get(path) != signature
+            and now_ns - signature[1] >= SETTLE_SECONDS * 1_000_000_000
+        ]
+
+    def ingest_file(self, path):
+        """Tek dosyayı depoya al; içerik zaten depodaysa sadece durumu güncelle"""
+        name = os.path.basename(path)
+        signature = watched_files(self.watch_dir).get(path)
+        self._set_status(name, {'state': 'işleniyor', 'at': datetime.now().isoformat(timespec='seconds')})
+        try:
+            with open(path, 'rb') as f:
+                key = file_sha256(f)
+            if not self.store.has(key, RAW_VARIANT):
+                self.store.put(key, RAW_VARIANT, lambda out: write_raw_parquet(path, out), file_name=name)
+            rows = self.store.load_manifest()[key]['variants'][RAW_VARIANT]['rows']
+            self._set_status(name, {'state': 'hazır', 'key': key, 'rows': rows,
+                                    'at': datetime.now().isoformat(timespec='seconds')})
+        except Exception as e:
+            self._set_status(name, {'state': 'hata', 'error': str(e),
+                                    'at': datetime.now().isoformat(timespec='seconds')})
+        # Hatalı dosya da işaretlenir; dosya değişmedikçe tekrar denenmez
+        self._seen[path] = signature
+
+    def _set_status(self, name, status):
+        with self._status_lock:
+            self.status[name] = status
+
+    def snapshot(self):
+        """Dosya durumlarının kopyası; arka plan thread'i güncellerken de güvenle gezilir"""
+        with self._status_lock:
+            return dict(self.status)
+
+    def scan(self):
+        """Bekleyen dosyaları sırayla depoya al; işlenen dosya adlarını döndür"""
+        with self._lock:
+            paths = self.pending()
+            for path in paths:
+                self.ingest_file(path)
+        return [os.path.basename(path) for path in paths]
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.scan()
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+
+    def start(self):
+        """Arka plan yoklama thread'ini başlat (zaten çalışıyorsa bir şey yapmaz)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='klasor-izleyici', daemon=True)
+            self._thread.start()
+        return self
+
+    def wake(self):
+        """Bir sonraki yoklamayı beklemeden taramayı tetikle"""
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def stored_sources(store=None):
+    """Klasörden depoya alınmış veri setleri, en yeni önce
+
+    Dönüş: [{'key', 'file_name', 'rows', 'ingested_at'}]
+    """
+    store = store or DatasetStore()
+    sources = [
+        {'key': key, 'file_name': entry.get('file_name') or key[:12],
+         'rows': entry['variants'][RAW_VARIANT]['rows'],
+         'ingested_at': entry['variants'][RAW_VARIANT]['ingested_at']}
+        for key, entry in store.load_manifest().items()
+        if RAW_VARIANT in entry.get('variants', {})
+    ]
+    return sorted(sources, key=lambda source: source['ingested_at'], reverse=True)
+
+
+def stored_label(source):
+    """Seçim kutusunda gösterilecek kısa açıklama"""
+    return (f"{source['file_name']} · {source['rows']:,} satır · "
+            f"{source['ingested_at'].replace('T', ' ')[:16]}")
+
+
+class StoredFile:
+    """Depodaki ham veri setini yüklenmiş dosya gibi sunar
+
+    Mevcut yükleme akışı (başlık okuma, dönüşüm, önbellek) değişmeden çalışır. İçerik
+    anahtarı kaynak dosyanınkidir; aynı dosya tarayıcıdan yüklenirse depo girdileri
+    paylaşılır. Dosya belleğe kopyalanmaz: okumalar diskteki dosyadan yapılır, Arrow
+    okuyucuları path üzerinden memory map ile açar.
+    """
+
+    def __init__(self, store, key, file_name):
+        self.path = store.dataset_path(key, RAW_VARIANT)
+        self.name = f"{file_name}.parquet"
+        self.content_key = key
+        self._file = None
+
+    def _data(self):
+        if self._file is None:
+            self._file = open(self.path, 'rb')
+        return self._file
+
+    def getvalue(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def read(self, size=-1):
+        return self._data().read(size)
+
+    def seek(self, offset, whence=0):
+        return self._data().seek(offset, whence)
+
+    def tell(self):
+        return self._data().tell()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Klasördeki veri dosyalarını depoya al")
+    parser.add_argument('--dir', default=WATCH_DIR, help="İzlenecek klasör")
+    parser.add_argument('--poll', type=float, default=POLL_SECONDS, help="Yoklama aralığı (saniye)")
+    parser.add_argument('--once', action='store_true', help="Bir kez tara ve çık")
+    args = parser.parse_args()
+
+    watcher = FolderWatcher(args.dir, poll_seconds=args.poll)
+    while True:
+        for name in watcher.scan():
+            status = watcher.snapshot()[name]
+            if status['state'] == 'hata':
+                print(f"{name}: hata: {status['error']}")
+            else:
+                print(f"{name}: {status['rows']:,} satır  {status['key'][:12]}")
+        if args.once:
+            break
+        time.sleep(args.poll)
+
+
+if __name__ == "__main__":
+    main()